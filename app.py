@@ -1,10 +1,16 @@
 import streamlit as st
+# Imported before warm_up() starts its thread: importing altair while that thread imports xgboost can deadlock
+import altair as alt
 import pandas as pd
 import numpy as np
 from datetime import datetime
-import time
 import json
-from infer import info_response, chat_response, get_multiple_sensor_samples
+from infer import info_response_stream, chat_response_stream, analyze_all, get_multiple_sensor_samples, get_trend_series
+from chat_context import ChatContext
+from session_store import sessions
+from validation import InvalidReading
+from report import VARIABLES
+from soil import STATUS_LABELS, warm_up
 
 # Page configuration
 st.set_page_config(
@@ -13,6 +19,9 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Load the model and LLM chains in the background while the page renders
+warm_up()
+
 # Initialize language in session state
 if 'language' not in st.session_state:
     st.session_state.language = "English"  # Default language
@@ -22,6 +31,9 @@ content_en = {
     "title": "🌱 Soil Quality Analysis System",
     "sensor_data": "📊 Sensor Data",
     "load_new_samples": "🔄 Load New Samples",
+    "analyze_all": "⚡ Analyze All Samples",
+    "analyzing_all": "Analyzing all samples...",
+    "analysis_failed": "AI commentary unavailable, showing the report",
     "getting_data": "Getting live sensor data...",
     "live_sensor": "Live sensor data",
     "analyze": "Analyze",
@@ -44,6 +56,21 @@ content_en = {
     "analysis_complete": "Analysis complete for",
     "soil_classified": "The soil is classified as",
     "how_help": "How can I help you improve your soil quality?",
+    "prompt_tokens": "Prompt tokens (last turn)",
+    "earlier_messages": "earlier messages archived (summarized for the assistant)",
+    "reading_rejected": "Reading rejected as a likely sensor error",
+    "trends": "📉 Trends",
+    "resolution": "Resolution",
+    "hour": "Hourly",
+    "day": "Daily",
+    "statistic": "Statistic",
+    "mean": "Mean",
+    "min": "Minimum",
+    "max": "Maximum",
+    "rolling_window": "Rolling window (buckets)",
+    "variables": "Variables",
+    "status_timeline": "Fertility status share per bucket",
+    "no_trend_data": "No readings to chart yet",
     "nutrient_question": "What specific nutrients does my soil need based on the analysis? How can I improve them?",
     "fertilizer_question": "What type and amount of fertilizers should I use for this soil condition?"
 }
@@ -52,6 +79,9 @@ content_ja = {
     #"title": "🌱 土壌品質分析システム",
     "sensor_data": "📊 センサーデータ",
     "load_new_samples": "🔄 新しいサンプルを読み込む",
+    "analyze_all": "⚡ すべてのサンプルを分析",
+    "analyzing_all": "すべてのサンプルを分析中...",
+    "analysis_failed": "AIの解説を取得できないため、レポートを表示しています",
     "getting_data": "ライブセンサーデータを取得中...",
     "live_sensor": "ライブセンサーデータ",
     "analyze": "分析",
@@ -74,6 +104,21 @@ content_ja = {
     "analysis_complete": "分析が完了しました：",
     "soil_classified": "土壌は次のように分類されます：",
     "how_help": "土壌品質の改善についてどのようにお手伝いできますか？",
+    "prompt_tokens": "プロンプトトークン数（直近）",
+    "earlier_messages": "件の以前のメッセージはアーカイブ済み（要約はアシスタントに保持）",
+    "reading_rejected": "センサー異常の可能性があるため測定値を除外しました",
+    "trends": "📉 トレンド",
+    "resolution": "集計単位",
+    "hour": "1時間",
+    "day": "1日",
+    "statistic": "統計量",
+    "mean": "平均",
+    "min": "最小",
+    "max": "最大",
+    "rolling_window": "移動窓（区間数）",
+    "variables": "変数",
+    "status_timeline": "区間ごとの肥沃度ステータスの割合",
+    "no_trend_data": "表示できる測定値がまだありません",
     "nutrient_question": "分析に基づいて、私の土壌にはどのような特定の栄養素が必要ですか？どのように改善できますか？",
     "fertilizer_question": "この土壌状態にはどのような種類と量の肥料を使用すべきですか？"
 }
@@ -253,16 +298,33 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize other session states
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-if 'sensor_samples' not in st.session_state:
-    st.session_state.sensor_samples = get_multiple_sensor_samples(3)
-if 'analysis_results' not in st.session_state:
-    st.session_state.analysis_results = {}
-if 'current_analysis' not in st.session_state:
-    st.session_state.current_analysis = None
 if 'loading_data' not in st.session_state:
     st.session_state.loading_data = False
+if 'pending_response' not in st.session_state:
+    st.session_state.pending_response = None
+
+# Samples, results and chat are kept server-side in a compact, memory-capped store
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = sessions.new_id()
+session = sessions.get(st.session_state.session_id)
+if not session.timestamps:
+    # New session, or evicted by the memory cap
+    session.set_samples(get_multiple_sensor_samples(3))
+    st.session_state.pending_response = None
+
+def analysis_intro(sample_num, status):
+    """Opening chat message for an analyzed sample"""
+    translated_status = get_text(status.lower().replace(' ', '_'))
+    return f"{get_text('analysis_complete')} {get_text('sample')} {sample_num}. {get_text('soil_classified')} **{translated_status}**. {get_text('how_help')}"
+
+def ask_question(question):
+    """Add a user question to the chat; the answer streams in on the next run"""
+    history = session.history
+    session.add_turn("user", question)
+    st.session_state.pending_response = {
+        "stream": chat_response_stream(history, question, st.session_state.language, session.chat_context),
+        "sample_id": None
+    }
 
 # Create a container for title and language selector
 title_container = st.container()
@@ -306,14 +368,42 @@ with st.container():
         # Show loading indicator when getting new data
         if st.session_state.loading_data:
             with st.spinner(get_text('getting_data')):
-                time.sleep(1.5)  # Simulate data fetching
-                st.session_state.sensor_samples = get_multiple_sensor_samples(3)
-                st.session_state.analysis_results = {}
-                st.session_state.current_analysis = None
-                st.session_state.chat_history = []
+                session.set_samples(get_multiple_sensor_samples(3))
+                st.session_state.pending_response = None
                 st.session_state.loading_data = False
                 st.rerun()
         
+        # Analyze every displayed sample at once; results appear as they complete
+        if st.button(get_text('analyze_all'), key="analyze_all", use_container_width=True):
+            with st.status(get_text('analyzing_all'), expanded=True) as progress:
+                def show_result(sample_id, explanation, data_json, error):
+                    sample_num = sample_id.split()[-1]
+                    translated_status = get_text(data_json['status'].lower().replace(' ', '_'))
+                    if error is None:
+                        progress.write(f"{get_text('sample')} {sample_num}: **{translated_status}**")
+                    elif isinstance(error, InvalidReading):
+                        progress.write(f"{get_text('sample')} {sample_num}: {get_text('reading_rejected')} ({error})")
+                    else:
+                        # The instant report is still shown when the LLM fails
+                        progress.write(f"{get_text('sample')} {sample_num}: **{translated_status}** "
+                                       f"({get_text('analysis_failed')}: {error})")
+                    session.set_result(sample_id, explanation, data_json)
+                
+                analyze_all(session.samples, st.session_state.language, on_result=show_result)
+                progress.update(state="complete")
+            
+            # Open the chat on the first sample
+            first_id = session.sample(0)['sample_id']
+            first_result = session.result(first_id)
+            session.open_analysis(first_id, ChatContext(first_result['data_json']))
+            session.reset_chat([{
+                "role": "assistant",
+                "content": analysis_intro(first_id.split()[-1], first_result['data_json']['status'])
+            }])
+            if first_result['explanation']:
+                session.add_turn("assistant", first_result['explanation'])
+            st.session_state.pending_response = None
+        
         # Live data indicator
         st.markdown(f"""
             <div class="live-indicator">
@@ -327,7 +417,7 @@ with st.container():
         
         with sensor_container:
             # Display sensor samples
-            for i, sample in enumerate(st.session_state.sensor_samples):
+            for i, sample in enumerate(session.samples):
                 with st.container():
                     # Compact sensor box header
                     st.markdown(f"""
@@ -336,6 +426,14 @@ with st.container():
                         </div>
                     """, unsafe_allow_html=True)
                     
+                    # Fertility status, precomputed for stored and live readings
+                    if session.has_result(sample['sample_id']):
+                        status = session.result(sample['sample_id'])['data_json']['status']
+                    else:
+                        status = sample.get('status')
+                    if status:
+                        st.caption(f"{get_text('analysis_results')} {get_text(status.lower().replace(' ', '_'))}")
+                    
                     # Display sensor values in a more compact format
                     col_a, col_b = st.columns(2)
                     
@@ -355,30 +453,28 @@ with st.container():
                     # Analyze button
                     if st.button(f"{get_text('analyze')} {get_text('sample')} {i+1}", key=f"analyze_{sample['sample_id']}", use_container_width=True):
                         with st.spinner(get_text('analyzing')):
-                            # Get analysis from backend with language
-                            explanation, data_json = info_response(sample['input_sensor'], st.session_state.language)
+                            # Status comes from the scored index; the explanation streams into the chat panel
+                            try:
+                                explanation_stream, data_json = info_response_stream(
+                                    sample['input_sensor'], st.session_state.language, status=sample.get('status'))
+                            except InvalidReading as e:
+                                st.error(f"{get_text('reading_rejected')}: {e}")
+                                st.stop()
                             
                             # Store results
-                            st.session_state.analysis_results[sample['sample_id']] = {
-                                'explanation': explanation,
-                                'data_json': data_json,
-                                'sample': sample
-                            }
-                            st.session_state.current_analysis = sample['sample_id']
-                            
-                            # Translate status
-                            status = data_json['status']
-                            translated_status = get_text(status.lower().replace(' ', '_'))
+                            session.set_result(sample['sample_id'], None, data_json)
+                            session.open_analysis(sample['sample_id'], ChatContext(data_json))
                             
                             # Add initial message to chat
-                            initial_msg = f"{get_text('analysis_complete')} {get_text('sample')} {i+1}. {get_text('soil_classified')} **{translated_status}**. {get_text('how_help')}"
-                            
-                            st.session_state.chat_history = [{
+                            session.reset_chat([{
                                 "role": "assistant",
-                                "content": initial_msg
-                            }]
+                                "content": analysis_intro(i + 1, data_json['status'])
+                            }])
+                            st.session_state.pending_response = {
+                                "stream": explanation_stream,
+                                "sample_id": sample['sample_id']
+                            }
                             
-                            time.sleep(0.5)
                             st.rerun()
                     
                     st.markdown("---")
@@ -388,8 +484,8 @@ with st.container():
         st.markdown(f"### {get_text('chat_title')}")
         
         # Display analysis result at the top of chat if available
-        if st.session_state.current_analysis and st.session_state.current_analysis in st.session_state.analysis_results:
-            result = st.session_state.analysis_results[st.session_state.current_analysis]
+        if session.current_analysis and session.has_result(session.current_analysis):
+            result = session.result(session.current_analysis)
             status = result['data_json']['status']
             
             # Translate status
@@ -409,7 +505,7 @@ with st.container():
                 bg_color = "#e8f5e9"
                 border_color = "#c8e6c9"
             
-            sample_num = st.session_state.current_analysis.split()[-1]
+            sample_num = session.current_analysis.split()[-1]
             
             st.markdown(f"""
                 <div class='analysis-result-box' style='background-color: {bg_color}; border: 2px solid {border_color};'>
@@ -421,42 +517,18 @@ with st.container():
             """, unsafe_allow_html=True)
         
         # Quick action buttons
-        if st.session_state.current_analysis:
+        if session.current_analysis:
             st.markdown(f"**{get_text('quick_questions')}**")
             
             col_btn1, col_btn2 = st.columns(2)
             with col_btn1:
                 if st.button(get_text('nutrient_improvement'), use_container_width=True):
-                    question = get_text('nutrient_question')
-                    
-                    st.session_state.chat_history.append({
-                        "role": "user",
-                        "content": question
-                    })
-                    
-                    response = chat_response(st.session_state.chat_history[:-1], question, st.session_state.language)
-                    
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": response
-                    })
+                    ask_question(get_text('nutrient_question'))
                     st.rerun()
             
             with col_btn2:
                 if st.button(get_text('fertilizer_guide'), use_container_width=True):
-                    question = get_text('fertilizer_question')
-                    
-                    st.session_state.chat_history.append({
-                        "role": "user",
-                        "content": question
-                    })
-                    
-                    response = chat_response(st.session_state.chat_history[:-1], question, st.session_state.language)
-                    
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": response
-                    })
+                    ask_question(get_text('fertilizer_question'))
                     st.rerun()
         
         # Chat messages container
@@ -464,38 +536,77 @@ with st.container():
         chat_container = st.container(height=350)
         
         with chat_container:
-            if st.session_state.chat_history:
-                for message in st.session_state.chat_history:
+            history = session.history
+            if history:
+                if session.dropped_turns:
+                    st.caption(f"{session.dropped_turns} {get_text('earlier_messages')}")
+                for message in history:
                     with st.chat_message(message["role"]):
                         st.markdown(message["content"])
             else:
-                if st.session_state.current_analysis:
+                if session.current_analysis:
                     st.info(get_text('ask_anything'))
                 else:
                     st.info(get_text('analyze_first'))
+            
+            # Stream a pending answer token by token, then keep it in the history
+            pending = st.session_state.pending_response
+            if pending is not None:
+                st.session_state.pending_response = None
+                with st.chat_message("assistant"):
+                    response = st.write_stream(pending["stream"])
+                session.add_turn("assistant", response)
+                if pending["sample_id"] is not None:
+                    session.set_explanation(pending["sample_id"], response)
+        
+        # Size of the last chat prompt after context trimming
+        if session.chat_context is not None and session.chat_context.token_log:
+            st.caption(f"{get_text('prompt_tokens')}: {session.chat_context.last_prompt_tokens}")
         
         # Chat input
-        if st.session_state.current_analysis:
+        if session.current_analysis:
             placeholder = get_text('chat_placeholder')
             user_question = st.chat_input(placeholder, key="chat_input")
             
             if user_question:
-                # Add user message
-                st.session_state.chat_history.append({
-                    "role": "user",
-                    "content": user_question
-                })
-                
-                # Get AI response with language
-                with st.spinner(get_text('thinking')):
-                    response = chat_response(st.session_state.chat_history[:-1], user_question, st.session_state.language)
-                    
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": response
-                    })
-                
+                # Add user message; the answer streams into the chat on rerun
+                ask_question(user_question)
                 st.rerun()
 
+# Trend panel: charts come from the precomputed hourly/daily rollups, not the raw readings
+with st.expander(get_text('trends')):
+    series = get_trend_series()
+    col_res, col_stat, col_window = st.columns(3)
+    # Options are shown translated and mapped back to the rollup names
+    with col_res:
+        resolutions = ["hour", "day"]
+        resolution = st.radio(get_text('resolution'), [get_text(name) for name in resolutions], horizontal=True)
+        resolution = resolutions[[get_text(name) for name in resolutions].index(resolution)]
+    with col_stat:
+        statistics = ["mean", "min", "max"]
+        statistic = st.radio(get_text('statistic'), [get_text(name) for name in statistics], horizontal=True)
+        statistic = statistics[[get_text(name) for name in statistics].index(statistic)]
+    with col_window:
+        window = st.number_input(get_text('rolling_window'), min_value=1, max_value=168, value=1,
+                                 key="trend_window")
+    variables = st.multiselect(get_text('variables'), list(VARIABLES), default=["N", "P", "K"],
+                               key="trend_variables")
+    trend = series.frame(resolution, statistic, int(window), variables=variables or ["N"])
+    if trend.empty:
+        st.info(get_text('no_trend_data'))
+    else:
+        st.line_chart(trend)
+        st.markdown(f"**{get_text('status_timeline')}**")
+        timeline = series.status_timeline(resolution)[list(STATUS_LABELS)].fillna(0)
+        timeline.columns = [get_text(status.lower().replace(' ', '_')) for status in STATUS_LABELS]
+        shares = timeline.rename_axis("time").reset_index().melt("time", var_name="status", value_name="share")
+        # Same colours as the analysis result box
+        st.altair_chart(alt.Chart(shares).mark_bar().encode(
+            x="time:T",
+            y=alt.Y("share:Q", stack="normalize", axis=alt.Axis(format="%")),
+            color=alt.Color("status:N", sort=list(timeline.columns),
+                            scale=alt.Scale(domain=list(timeline.columns), range=["#f44336", "#ff9800", "#4caf50"])),
+        ))
+
 # Add footer
 st.markdown("<br><br>", unsafe_allow_html=True)
@@ -0,0 +1,184 @@
+"""Score large CSV/Parquet files with the fertility model
+
+Reads files in the dataset1.csv column layout (the 12 nutrient columns; any
+other columns are ignored unless listed in --keep). The input is streamed in
+fixed-size chunks, which are scored by a pool of worker processes. Each
+worker loads the model once. At most --inflight chunks are queued or being
+scored at a time, and results are written in input order. Memory therefore
+depends on the chunk size and worker count, not on the file size. The output
+has one row per input row with `label`, `status` and one probability column
+per class. Rows with missing values are scored too: xgboost follows each
+tree's default branch for them.
+
+    python batch_score.py lab_export.csv scores.parquet
+    python batch_score.py lab_export.parquet scores.csv --chunk-size 200000 --workers 8 --keep sample_id
+    python batch_score.py big.csv out.csv --model xgb_soil_analysis.bin     # legacy joblib model
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from model_registry import ModelRegistry
+from soil import FEATURE_COLUMNS, STATUS_LABELS
+from train import peak_memory_mb
+
+PROBABILITY_COLUMNS = [f"p_{status.lower().replace(' ', '_')}" for status in STATUS_LABELS]
+
+# Set in each worker process by _init_worker
+_model = None
+
+
+def _init_worker(model_dir, version, model_path, threads):
+    """Load the model once per worker process"""
+    global _model
+    if model_path:
+        import joblib
+        _model = joblib.load(model_path)
+    else:
+        _model = ModelRegistry(model_dir).load(version)
+    # Parallelism comes from the processes; more threads per worker would oversubscribe the cores
+    _model.set_params(n_jobs=threads)
+
+
+def score_chunk(X):
+    """(labels, probabilities) for one chunk (runs in a worker process)"""
+    proba = _model.predict_proba(X).astype(np.float32)
+    return proba.argmax(axis=1).astype(np.int8), proba
+
+
+def read_chunks(path, chunk_size, keep=()):
+    """Yield (features as float32, kept columns) for fixed-size chunks of a CSV or Parquet file"""
+    columns = list(FEATURE_COLUMNS) + [column for column in keep if column not in FEATURE_COLUMNS]
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            frame = batch.to_pandas()
+            yield frame[FEATURE_COLUMNS].to_numpy(dtype=np.float32), frame[list(keep)]
+    else:
+        dtypes = {name: np.float32 for name in FEATURE_COLUMNS}
+        for frame in pd.read_csv(path, usecols=columns, dtype=dtypes, chunksize=chunk_size):
+            yield frame[FEATURE_COLUMNS].to_numpy(dtype=np.float32), frame[list(keep)].reset_index(drop=True)
+
+
+class ChunkWriter:
+    """Appends scored chunks to a CSV or Parquet file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._parquet = None
+        self._first = True
+
+    def write(self, frame):
+        if self.path.endswith(".parquet"):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            frame.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+def result_frame(kept, labels, proba):
+    frame = kept.copy()
+    frame["label"] = labels
+    frame["status"] = STATUS_LABELS[labels]
+    for i, column in enumerate(PROBABILITY_COLUMNS):
+        frame[column] = proba[:, i]
+    return frame
+
+
+def score_file(args):
+    """Stream args.input through the worker pool into args.output; returns a summary dict"""
+    version = None
+    if not args.model:
+        version = args.version or ModelRegistry(args.model_dir).current()
+        if version is None:
+            raise SystemExit(f"No model has been promoted in {args.model_dir}; pass --version or --model")
+    workers = args.workers or os.cpu_count() or 1
+    inflight = args.inflight or 2 * workers
+    # spawn: xgboost's thread pool does not survive fork reliably
+    context = multiprocessing.get_context("spawn")
+    writer = ChunkWriter(args.output)
+    rows = chunks = 0
+    pending = []
+    started = time.perf_counter()
+    last_report = started
+
+    def write_oldest():
+        nonlocal rows, chunks, last_report
+        kept, future = pending.pop(0)
+        labels, proba = future.result()
+        writer.write(result_frame(kept, labels, proba))
+        rows += len(labels)
+        chunks += 1
+        now = time.perf_counter()
+        if args.progress and now - last_report >= args.progress:
+            print(f"{rows:,} rows, {rows / (now - started):,.0f} rows/s", file=sys.stderr)
+            last_report = now
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(args.model_dir, version, args.model, args.threads)) as pool:
+            for X, kept in read_chunks(args.input, args.chunk_size, args.keep):
+                # Bounded: wait for the oldest chunk before reading further ahead
+                if len(pending) >= inflight:
+                    write_oldest()
+                pending.append((kept, pool.submit(score_chunk, X)))
+            while pending:
+                write_oldest()
+    finally:
+        writer.close()
+    seconds = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds) if seconds else 0,
+        "workers": workers,
+        "model": args.model or f"{args.model_dir}/{version}",
+        "peak_memory_mb": round(peak_memory_mb(), 1),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Score a CSV/Parquet file of soil readings in parallel chunks")
+    parser.add_argument("input", help="CSV or Parquet file with the 12 nutrient columns")
+    parser.add_argument("output", help="CSV or Parquet file to write (by extension)")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="rows per chunk")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--threads", type=int, default=1, help="xgboost threads per worker")
+    parser.add_argument("--inflight", type=int, default=None, help="chunks queued at once (default: 2 per worker)")
+    parser.add_argument("--keep", nargs="+", default=[], help="input columns to copy to the output, e.g. ids")
+    parser.add_argument("--model-dir", default=os.getenv("SOIL_MODEL_DIR") or "models")
+    parser.add_argument("--version", default=None, help="model version (default: the current one)")
+    parser.add_argument("--model", default=None, help="legacy joblib model file instead of the registry")
+    parser.add_argument("--progress", type=float, default=5.0, help="seconds between progress lines (0: off)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    summary = score_file(args)
+    print(f"Scored {summary['rows']:,} rows in {summary['chunks']} chunks with {summary['workers']} workers "
+          f"in {summary['seconds']:.2f} s ({summary['rows_per_second']:,} rows/s, "
+          f"peak memory {summary['peak_memory_mb']} MB, model {summary['model']})")
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Benchmarks for prediction, sampling, prompt rendering, app reruns and the HTTP service
+
+Times the hot paths of soil.py, infer.py, app.py and service.py against a stub LLM, so
+no network calls are made. Results are written as JSON. When a baseline
+file exists, each benchmark's median is compared against it:
+
+    python benchmark.py                          # run all, compare to baseline
+    python benchmark.py --save-baseline          # store this run as the baseline
+    python benchmark.py --suite predict sampling --fail-on-regression 1.2
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# Never call the real Groq API or reuse cached responses while benchmarking
+os.environ["SOIL_LLM_CACHE"] = "off"
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+# Caches and state written during the run (sensor store and its rescored
+# archive, rollups, drift state, drivers) go to a directory removed at exit
+STATE_DIR = tempfile.TemporaryDirectory(prefix="soil-benchmark-")
+os.environ["SOIL_SENSOR_STORE"] = os.path.join(STATE_DIR.name, "sensor_store")
+os.environ["SOIL_DRIFT_STATE"] = os.path.join(STATE_DIR.name, "drift_state.npz")
+os.environ["SOIL_DRIVERS_CACHE"] = os.path.join(STATE_DIR.name, "drivers")
+os.environ["SOIL_LLM_CACHE_PATH"] = os.path.join(STATE_DIR.name, "llm_responses.sqlite")
+
+import numpy as np
+
+
+def measure(fn, repeat=20, number=1, warmup=1):
+    """Run fn repeat*number times; return per-call timing stats in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number * 1000)
+    samples.sort()
+    return {
+        "median_ms": statistics.median(samples),
+        "min_ms": samples[0],
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def stub_llm(responses=None):
+    """Chat model that answers instantly with canned text"""
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    return FakeListChatModel(responses=responses or ["The soil looks balanced. " * 20])
+
+
+def _sensor_rows():
+    import infer
+    return infer.get_sensor_store().values
+
+
+def bench_predict(results, repeat):
+    import soil
+    rows = np.asarray(_sensor_rows(), dtype=np.float64)
+    single = rows[0].tolist()
+    for name in ("loaded_model", "compiled_model"):
+        model = getattr(soil, name)
+        results[f"predict.get_data_JSON.single.{name}"] = measure(
+            lambda: soil.get_data_JSON(single, model), repeat, number=20)
+        for n in (100, 1000):
+            batch = rows[np.arange(n) % len(rows)]
+            results[f"predict.predict_batch.{n}.{name}"] = measure(
+                lambda: soil.predict_batch(batch, model, return_proba=True), repeat)
+
+
+def bench_sampling(results, repeat):
+    import infer
+    from resources import registry
+    from sensor_store import SensorStore
+
+    original = registry.get("sensor_store")
+    rng = np.random.default_rng(0)
+    try:
+        for n in (1_000, 10_000, 100_000, 1_000_000):
+            store = SensorStore(np.arange(n, dtype=np.int64) * 900, rng.random((n, 12)))
+            registry.set("sensor_store", store)
+            results[f"sampling.get_multiple_sensor_samples.{n}"] = measure(
+                lambda: infer.get_multiple_sensor_samples(3), repeat, number=20)
+    finally:
+        registry.set("sensor_store", original)
+
+
+def bench_prompts(results, repeat):
+    import infer
+    import soil
+
+    data_json = json.dumps(soil.get_data_JSON(_sensor_rows()[0].tolist(), soil.compiled_model), indent=2)
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": "Message %d about soil nutrients." % i}
+               for i in range(20)]
+    results["prompts.create_prompt1"] = measure(lambda: soil.create_prompt1("English"), repeat, number=20)
+    results["prompts.create_prompt2"] = measure(lambda: soil.create_prompt2("Japanese"), repeat, number=20)
+    prompt1 = soil.create_prompt1("English")
+    results["prompts.render_prompt1"] = measure(lambda: prompt1.format(data_JSON=data_json), repeat, number=20)
+
+    chain1 = soil.LanguageAwareLLMChain(stub_llm(), soil.create_prompt1)
+    chain2 = soil.LanguageAwareLLMChain(stub_llm(), soil.create_prompt2)
+    results["prompts.chain1.predict"] = measure(
+        lambda: chain1.predict(data_JSON=data_json, language="English"), repeat, number=5)
+    original = soil.registry.get("chain2")
+    soil.registry.set("chain2", chain2)
+    try:
+        results["prompts.chat_response"] = measure(
+            lambda: infer.chat_response(history, "How do I raise nitrogen?", "English"), repeat, number=5)
+    finally:
+        soil.registry.set("chain2", original)
+
+
+def bench_app(results, repeat):
+    import soil
+    from streamlit.testing.v1 import AppTest
+
+    originals = {name: soil.registry.get(name) for name in ("chain1", "chain2")}
+    llm = stub_llm()
+    soil.registry.set("chain1", soil.LanguageAwareLLMChain(llm, soil.create_prompt1))
+    soil.registry.set("chain2", soil.LanguageAwareLLMChain(llm, soil.create_prompt2))
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+    def first_run():
+        AppTest.from_file(app_path, default_timeout=60).run()
+
+    def analyze_run():
+        at = AppTest.from_file(app_path, default_timeout=60).run()
+        at.button(key="analyze_Sample 1").click().run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+    try:
+        results["app.first_run"] = measure(first_run, max(3, repeat // 4))
+        results["app.analyze_sample"] = measure(analyze_run, max(3, repeat // 4))
+    finally:
+        for name, chain in originals.items():
+            soil.registry.set(name, chain)
+
+
+def bench_service(results, repeat, concurrency=256):
+    """Requests/s of service.py for bursts of concurrent single-reading requests, with and without batching"""
+    import asyncio
+
+    import aiohttp
+
+    import service
+    import soil
+
+    originals = {name: soil.registry.get(name) for name in ("chain1", "chain2")}
+    llm = stub_llm()
+    soil.registry.set("chain1", soil.LanguageAwareLLMChain(llm, soil.create_prompt1))
+    soil.registry.set("chain2", soil.LanguageAwareLLMChain(llm, soil.create_prompt2))
+    rows = np.asarray(_sensor_rows(), dtype=np.float64)
+    rows = rows[np.arange(concurrency) % len(rows)].tolist()
+    loop = asyncio.new_event_loop()
+
+    async def open_session():
+        # Created on the loop that uses it; one connection per concurrent request
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency))
+
+    async def burst(session, url, key):
+        responses = await asyncio.gather(*[session.post(url, json={key: row if key == "reading" else [row]})
+                                           for row in rows])
+        for response in responses:
+            response.raise_for_status()
+            await response.read()
+
+    try:
+        for label, max_batch in (("batched", service.PREDICT_BATCH), ("unbatched", 1)):
+            server = service.ServiceThread(service.create_app(max_batch=max_batch)).start()
+            session = loop.run_until_complete(open_session())
+            try:
+                for endpoint, key in (("predict", "readings"), ("analyze", "reading")):
+                    url = f"{server.base_url}/{endpoint}"
+                    stats = measure(lambda: loop.run_until_complete(burst(session, url, key)), max(3, repeat // 4))
+                    stats["requests_per_second"] = concurrency / (stats["median_ms"] / 1000)
+                    results[f"service.{endpoint}.{concurrency}.{label}"] = stats
+            finally:
+                loop.run_until_complete(session.close())
+                server.stop()
+    finally:
+        loop.close()
+        for name, chain in originals.items():
+            soil.registry.set(name, chain)
+
+
+SUITES = {
+    "predict": bench_predict,
+    "sampling": bench_sampling,
+    "prompts": bench_prompts,
+    "app": bench_app,
+    "service": bench_service,
+}
+
+
+def compare(results, baseline, threshold):
+    """Print median ratios against the baseline; return names slower than threshold"""
+    regressions = []
+    print(f"{'benchmark':<55} {'median ms':>10} {'baseline':>10} {'ratio':>7}")
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<55} {stats['median_ms']:>10.3f} {'-':>10} {'-':>7}")
+            continue
+        ratio = stats["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{name:<55} {stats['median_ms']:>10.3f} {base['median_ms']:>10.3f} {ratio:>7.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the soil analysis hot paths")
+    parser.add_argument("--suite", nargs="+", choices=sorted(SUITES), default=list(SUITES))
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run to the baseline file")
+    parser.add_argument("--fail-on-regression", type=float, default=None, metavar="RATIO",
+                        help="exit with status 1 if any median is slower than baseline by this ratio")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.suite:
+        SUITES[name](results, args.repeat)
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r") as infile:
+            baseline = json.load(infile)["results"]
+    regressions = compare(results, baseline, args.fail_on_regression or float("inf"))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed beyond {args.fail_on_regression}x")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Bounded-size conversation context for the chat chain
+
+ChatContext builds the chain2 inputs under a hard token budget. The compact
+analysis result is always included and the most recent turns are kept
+verbatim. Older turns are folded into a running summary that is updated
+incrementally, so each turn is summarized only once. If the message and
+analysis alone are still over the budget, the message and then the analysis
+are truncated to fit. The token count of every rendered prompt is recorded.
+"""
+import json
+import re
+
+# Latin words/numbers, single punctuation marks, and CJK characters each
+# count as roughly one token; good enough for budgeting without a tokenizer
+TOKEN_PATTERN = re.compile(r"[぀-ヿ㐀-鿿＀-￯]|\w+|[^\w\s]")
+
+
+def count_tokens(text):
+    """Approximate LLM token count of text"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def truncate_tokens(text, max_tokens):
+    """The first tokens of text, ending in "…" when cut, at most max_tokens in all"""
+    tokens = list(TOKEN_PATTERN.finditer(text))
+    if len(tokens) <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ""
+    return text[:tokens[max_tokens - 2].end()] + "…"
+
+
+def compact_analysis(data_json):
+    """One-line analysis result: status first, then short variable names"""
+    if not data_json:
+        return "No analysis available."
+    values = {key.split(" - ")[0]: value for key, value in data_json.items() if key != "status"}
+    return f"Status: {data_json.get('status')}; " + json.dumps(values, separators=(",", ":"))
+
+
+def summarize_turn(message, max_chars=160):
+    """Extractive one-line summary of a chat message"""
+    text = " ".join(message["content"].split())
+    sentence = re.split(r"(?<=[.!?。！？])\s*", text, maxsplit=1)[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars].rstrip() + "…"
+    return f"{message['role']}: {sentence}"
+
+
+class ChatContext:
+    """Conversation state for one analyzed sample"""
+
+    def __init__(self, data_json=None, token_budget=1500, recent_messages=6,
+                 summary_budget=300, summarizer=None):
+        self.analysis = compact_analysis(data_json)
+        self.token_budget = token_budget
+        self.recent_messages = recent_messages
+        self.summary_budget = summary_budget
+        # summarizer(previous_summary, new_messages) -> summary; extractive by default
+        self.summarizer = summarizer
+        self.summary = ""
+        self.summarized_count = 0
+        self.token_log = []
+
+    @property
+    def last_prompt_tokens(self):
+        return self.token_log[-1] if self.token_log else 0
+
+    def forget(self, count):
+        """The caller dropped `count` already-summarized turns from the front of its history"""
+        self.summarized_count = max(0, self.summarized_count - count)
+
+    def _fold(self, history, upto):
+        """Add history[summarized_count:upto] to the running summary"""
+        new_messages = history[self.summarized_count:upto]
+        if not new_messages:
+            return
+        if self.summarizer is not None:
+            self.summary = self.summarizer(self.summary, new_messages)
+        else:
+            lines = [line for line in self.summary.split("\n") if line]
+            lines.extend(summarize_turn(message) for message in new_messages)
+            # Keep the newest summary lines that fit the summary budget
+            while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_budget:
+                lines.pop(0)
+            self.summary = "\n".join(lines)
+        self.summarized_count = upto
+
+    def build(self, history, message, render):
+        """Return chain2 inputs that fit the budget; render(inputs) gives the prompt text
+
+        Turns are summarized or dropped first. Then the summary, the message
+        and the analysis are truncated, in that order. Raises ValueError only
+        if the template alone is over the budget.
+        """
+        if len(history) < self.summarized_count:
+            # History was reset (new analysis); start the summary over
+            self.summary, self.summarized_count = "", 0
+        self._fold(history, max(self.summarized_count, len(history) - self.recent_messages))
+        recent = list(history[self.summarized_count:])
+
+        while True:
+            inputs = {
+                "analysis": self.analysis,
+                "conversation_summary": self.summary or "None yet.",
+                "user_history": "\n".join(f"{msg['role']}: {msg['content']}" for msg in recent),
+                "user_message": message,
+            }
+            tokens = count_tokens(render(inputs))
+            if tokens <= self.token_budget:
+                break
+            if recent:
+                # Move the oldest verbatim turn into the summary
+                self._fold(history, self.summarized_count + 1)
+                recent.pop(0)
+            elif "\n" in self.summary:
+                self.summary = self.summary.split("\n", 1)[1]
+            else:
+                # Only the analysis, the message and the template remain
+                break
+        if tokens > self.token_budget:
+            inputs, tokens = self._truncate(inputs, tokens, render)
+        self.token_log.append(tokens)
+        return inputs
+
+    def _truncate(self, inputs, tokens, render):
+        """Cut the summary, the message and then the analysis until the prompt fits"""
+        for key in ("conversation_summary", "user_message", "analysis"):
+            while tokens > self.token_budget and inputs[key]:
+                keep = count_tokens(inputs[key]) - (tokens - self.token_budget)
+                inputs[key] = truncate_tokens(inputs[key], keep)
+                tokens = count_tokens(render(inputs))
+        if tokens > self.token_budget:
+            raise ValueError(f"The chat prompt template alone needs {tokens} tokens, "
+                             f"over the budget of {self.token_budget}")
+        return inputs, tokens
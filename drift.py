@@ -0,0 +1,334 @@
+"""Constant-memory drift monitoring of scored readings against the training data
+
+Every scored reading (live feed, app analyses, service requests) updates a
+DriftState. Each state holds three fixed-size structures, and two states
+combine by adding their arrays:
+
+    sketch    per-variable quantile sketch: counts over logarithmic buckets
+              (relative accuracy `alpha`), the same grid for every variable
+    hist      per-variable counts over the baseline's decile bins, for PSI
+    classes   counts of predicted fertility classes
+
+The baseline is the same kind of state built once from dataset1.csv (using its
+Output labels as class frequencies). Live data is kept as a rotating window
+of `panes` states, each covering `pane_seconds`, so old readings age out while
+memory stays fixed. drift() merges the window and scores every variable:
+
+    psi   population stability index over the decile bins
+          (< 0.1 stable, 0.1-0.25 moderate shift, > 0.25 major shift)
+    ks    Kolmogorov-Smirnov distance between the two CDFs on the sketch grid
+
+The window is saved to a compact .npz (SOIL_DRIFT_STATE), so it survives restarts.
+Processes sharing the file merge their new readings into it on every save.
+
+    python drift.py                  # drift report from the saved state
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from report import VARIABLES, read_reference
+from soil import STATUS_LABELS
+
+DRIFT_STATE_PATH = os.getenv("SOIL_DRIFT_STATE", os.path.join(".cache", "drift_state.npz"))
+PSI_MODERATE, PSI_MAJOR = 0.1, 0.25
+# Class indices as predicted by the model
+CLASS_NAMES = [str(status) for status in STATUS_LABELS]
+N_CLASSES = len(CLASS_NAMES)
+
+
+class SketchGrid:
+    """Logarithmic bucket layout shared by every sketch, so sketches can be merged"""
+
+    def __init__(self, alpha=0.02, min_value=1e-3, max_value=1e5):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.min_value = min_value
+        self.max_value = max_value
+        # Bucket 0 holds values <= min_value (including zero and negatives), the last one overflow
+        self.n_buckets = int(np.ceil(np.log(max_value / min_value) / np.log(self.gamma))) + 2
+
+    def index(self, X):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            index = np.ceil(np.log(X / self.min_value) / np.log(self.gamma))
+        index = np.where(X > self.min_value, index, 0)
+        return np.clip(np.nan_to_num(index, nan=0), 0, self.n_buckets - 1).astype(np.intp)
+
+    def value(self, index):
+        """Representative value of buckets (within alpha of every value in them)"""
+        index = np.asarray(index)
+        lower = self.min_value * self.gamma ** (index - 1.0)
+        return np.where(index == 0, self.min_value, lower * (1 + self.gamma) / 2)
+
+
+class DriftState:
+    """Mergeable fixed-size summary of a set of readings"""
+
+    def __init__(self, n_buckets, n_bins, sketch=None, hist=None, classes=None):
+        features = len(VARIABLES)
+        self.sketch = np.zeros((features, n_buckets), np.int64) if sketch is None else sketch
+        self.hist = np.zeros((features, n_bins), np.int64) if hist is None else hist
+        self.classes = np.zeros(N_CLASSES, np.int64) if classes is None else classes
+
+    @property
+    def count(self):
+        return int(self.hist[0].sum())
+
+    def add(self, grid, edges, X, labels=None):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        features, n_buckets = self.sketch.shape
+        offsets = np.arange(features) * n_buckets
+        self.sketch += np.bincount((grid.index(X) + offsets).ravel(),
+                                   minlength=features * n_buckets).reshape(features, n_buckets)
+        n_bins = self.hist.shape[1]
+        bins = np.stack([np.searchsorted(edges[j], X[:, j], side="right") for j in range(features)], axis=1)
+        self.hist += np.bincount((bins + np.arange(features) * n_bins).ravel(),
+                                 minlength=features * n_bins).reshape(features, n_bins)
+        if labels is not None:
+            labels = np.clip(np.asarray(labels, dtype=np.intp), 0, N_CLASSES - 1)
+            self.classes += np.bincount(labels, minlength=N_CLASSES)
+
+    def merge(self, other):
+        return DriftState(0, 0, self.sketch + other.sketch, self.hist + other.hist, self.classes + other.classes)
+
+    def quantiles(self, grid, q):
+        """(features, len(q)) approximate quantiles"""
+        cumulative = np.cumsum(self.sketch, axis=1)
+        totals = np.maximum(cumulative[:, -1:], 1)
+        targets = np.asarray(q)[None, :] * totals
+        index = np.stack([np.searchsorted(cumulative[j], targets[j], side="left")
+                          for j in range(len(cumulative))])
+        return grid.value(index)
+
+
+def psi(expected, actual, epsilon=1e-4):
+    """Population stability index per row of two count arrays"""
+    p = np.maximum(expected / np.maximum(expected.sum(axis=-1, keepdims=True), 1), epsilon)
+    q = np.maximum(actual / np.maximum(actual.sum(axis=-1, keepdims=True), 1), epsilon)
+    return ((q - p) * np.log(q / p)).sum(axis=-1)
+
+
+def ks(expected, actual):
+    """Kolmogorov-Smirnov distance per row of two count arrays on the same grid"""
+    cdf_expected = np.cumsum(expected, axis=-1) / np.maximum(expected.sum(axis=-1, keepdims=True), 1)
+    cdf_actual = np.cumsum(actual, axis=-1) / np.maximum(actual.sum(axis=-1, keepdims=True), 1)
+    return np.abs(cdf_expected - cdf_actual).max(axis=-1)
+
+
+class DriftMonitor:
+    """Training baseline plus a rotating window of live DriftStates"""
+
+    def __init__(self, reference, grid=None, n_bins=10, panes=24, pane_seconds=3600, path=None,
+                 save_interval=60.0):
+        values, labels = reference
+        self.grid = grid or SketchGrid()
+        # Decile edges of the training data (interior edges only; outer bins are open-ended)
+        self.edges = np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1], axis=0).T
+        self.baseline = self._new_state()
+        self.baseline.add(self.grid, self.edges, values, labels)
+        self.panes = panes
+        self.pane_seconds = pane_seconds
+        self.path = path
+        self.save_interval = save_interval
+        # (pane start time, DriftState), oldest first
+        self.window = []
+        # Readings added since the last save, by pane start time
+        self._delta = {}
+        self.stats = {"updates": 0, "readings": 0, "saves": 0, "save_errors": 0}
+        self._last_save = time.monotonic()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    @classmethod
+    def from_csv(cls, reference_path, **kwargs):
+        return cls(read_reference(reference_path), **kwargs)
+
+    def _new_state(self):
+        return DriftState(self.grid.n_buckets, self.edges.shape[1] + 1)
+
+    def update(self, X, labels=None, now=None):
+        """Add scored readings (labels are class indices) to the current pane"""
+        if len(X) == 0:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            start = now - now % self.pane_seconds
+            self._expire(start)
+            panes = dict(self.window)
+            if start not in panes:
+                panes[start] = self._new_state()
+                self.window = sorted(panes.items())
+            panes[start].add(self.grid, self.edges, X, labels)
+            if start not in self._delta:
+                self._delta[start] = self._new_state()
+            self._delta[start].add(self.grid, self.edges, X, labels)
+            self.stats["updates"] += 1
+            self.stats["readings"] += len(np.atleast_2d(X))
+            due = self.path and time.monotonic() - self._last_save >= self.save_interval
+        if due:
+            # Saving is best effort; the window stays in memory either way
+            try:
+                self.save()
+            except OSError:
+                self.stats["save_errors"] += 1
+
+    def _expire(self, start):
+        """Drop panes that have fallen out of the window ending with the pane at `start`"""
+        self.window = [(t, state) for t, state in self.window if t > start - self.panes * self.pane_seconds]
+
+    def on_scored(self, timestamps, values, labels, statuses):
+        """IngestPipeline listener"""
+        self.update(values, labels)
+
+    def current(self, now=None):
+        """The merged window as one DriftState"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now - now % self.pane_seconds)
+            state = self._new_state()
+            for _, pane in self.window:
+                state = state.merge(pane)
+            return state
+
+    def drift(self, min_count=30):
+        """Drift scores of the window against the baseline"""
+        live = self.current()
+        n = live.count
+        psi_scores = psi(self.baseline.hist, live.hist)
+        ks_scores = ks(self.baseline.sketch, live.sketch)
+        medians = live.quantiles(self.grid, [0.5])[:, 0]
+        baseline_medians = self.baseline.quantiles(self.grid, [0.5])[:, 0]
+        features = {
+            name: {"psi": round(float(psi_scores[j]), 4), "ks": round(float(ks_scores[j]), 4),
+                   "median": round(float(medians[j]), 3), "baseline_median": round(float(baseline_medians[j]), 3)}
+            for j, name in enumerate(VARIABLES)
+        }
+        classes = live.classes / max(live.classes.sum(), 1)
+        baseline_classes = self.baseline.classes / max(self.baseline.classes.sum(), 1)
+        worst = float(psi_scores.max()) if n else 0.0
+        level = "insufficient_data" if n < min_count else \
+            "major" if worst > PSI_MAJOR else "moderate" if worst > PSI_MODERATE else "stable"
+        return {
+            "level": level,
+            "readings": n,
+            "window_seconds": self.panes * self.pane_seconds,
+            "features": features,
+            "class_frequencies": dict(zip(CLASS_NAMES, classes.round(4).tolist())),
+            "baseline_class_frequencies": dict(zip(CLASS_NAMES, baseline_classes.round(4).tolist())),
+            "class_psi": round(float(psi(self.baseline.classes, live.classes)), 4),
+        }
+
+    def save(self, path=None):
+        """Merge the readings added since the last save into the state on disk
+
+        Several processes (the app, the service) may share one state file;
+        each adds only its own new readings, under a file lock, so nothing
+        is lost and nothing is counted twice. The window then holds the
+        merged state, including what the other processes saved.
+        """
+        path = path or self.path
+        with self._lock:
+            delta, self._delta = self._delta, {}
+            self._last_save = time.monotonic()
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with _file_lock(f"{path}.lock"):
+                panes = dict(self._read(path) or [])
+                for start, state in delta.items():
+                    panes[start] = panes[start].merge(state) if start in panes else state
+                newest = max(panes, default=0)
+                panes = {t: state for t, state in sorted(panes.items())
+                         if t > newest - self.panes * self.pane_seconds}
+                tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+                # Mostly-empty sketches compress to a few KB
+                np.savez_compressed(
+                    tmp_path, starts=np.array(list(panes), dtype=np.float64),
+                    sketch=np.array([state.sketch for state in panes.values()], dtype=np.int64),
+                    hist=np.array([state.hist for state in panes.values()], dtype=np.int64),
+                    classes=np.array([state.classes for state in panes.values()], dtype=np.int64),
+                    edges=self.edges, grid=np.array([self.grid.alpha, self.grid.min_value, self.grid.max_value]))
+                os.replace(tmp_path, path)
+        except BaseException:
+            # Keep the unsaved readings for the next attempt
+            with self._lock:
+                for start, state in delta.items():
+                    self._delta[start] = self._delta[start].merge(state) if start in self._delta else state
+            raise
+        with self._lock:
+            # Readings added while saving are in _delta and not yet on disk (merge copies them)
+            for start, state in self._delta.items():
+                panes[start] = panes.get(start, self._new_state()).merge(state)
+            self.window = sorted(panes.items())
+        self.stats["saves"] += 1
+
+    def _read(self, path):
+        """Saved (pane start, DriftState) list, or None if missing or built with another grid or bins"""
+        try:
+            with np.load(path) as saved:
+                grid = saved["grid"]
+                if not (np.allclose(grid, [self.grid.alpha, self.grid.min_value, self.grid.max_value])
+                        and saved["edges"].shape == self.edges.shape and np.allclose(saved["edges"], self.edges)):
+                    return None
+                return [(float(t), DriftState(0, 0, sketch, hist, classes)) for t, sketch, hist, classes
+                        in zip(saved["starts"], saved["sketch"], saved["hist"], saved["classes"])]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def load(self, path):
+        """Restore a saved window; ignored if it was built with a different grid or baseline bins"""
+        window = self._read(path)
+        if window is None:
+            return False
+        with self._lock:
+            self.window = window
+        return True
+
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive lock across processes (a no-op where fcntl is unavailable)"""
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def format_report(report):
+    lines = [f"Drift: {report['level']} ({report['readings']} readings in the last "
+             f"{report['window_seconds'] / 3600:.0f} h)", "",
+             f"{'variable':<9} {'psi':>7} {'ks':>7} {'median':>10} {'baseline':>10}"]
+    for name, scores in report["features"].items():
+        flag = "  <- major" if scores["psi"] > PSI_MAJOR else "  <- moderate" if scores["psi"] > PSI_MODERATE else ""
+        lines.append(f"{name:<9} {scores['psi']:>7.3f} {scores['ks']:>7.3f} {scores['median']:>10.3f} "
+                     f"{scores['baseline_median']:>10.3f}{flag}")
+    lines += ["", "predicted classes: " + ", ".join(f"{k} {v:.1%}" for k, v in report["class_frequencies"].items()),
+              "training classes:  " + ", ".join(f"{k} {v:.1%}"
+                                                for k, v in report["baseline_class_frequencies"].items()),
+              f"class psi: {report['class_psi']:.3f}"]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Drift of scored readings against dataset1.csv")
+    parser.add_argument("--state", default=DRIFT_STATE_PATH)
+    parser.add_argument("--reference", default="dataset1.csv")
+    args = parser.parse_args()
+    monitor = DriftMonitor.from_csv(args.reference, path=args.state)
+    print(format_report(monitor.drift()))
@@ -0,0 +1,127 @@
+"""Per-reading feature attributions (TreeSHAP) for the fertility model
+
+xgboost's pred_contribs gives, for every reading and class, an additive
+contribution of each variable to the class margin. The analysis needs a
+single signed number per variable. That number is the variable's
+contribution to the fertile classes (the mean over Fertile and Highly
+fertile) minus its contribution to Less fertile. Positive values raise
+fertility and negative values lower it. Because the contributions are
+additive, these effects are exact for the log-odds between the groups.
+
+Effects are computed in vectorized batches and cached per reading (keyed by
+its 12 values) for each model version. Readings attributed with precompute()
+(the sensor archive) are kept for good and saved to .npz, so the archive is
+attributed once rather than on every request. Any other reading (user input,
+service requests, the live feed) goes to an LRU of at most max_recent entries.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.getenv("SOIL_DRIVERS_CACHE", os.path.join(".cache", "drivers"))
+
+
+def fertility_effects(booster, X, batch_size=65536):
+    """(n, 12) signed effect of each variable on fertility, via pred_contribs"""
+    import xgboost as xgb
+
+    X = np.asarray(X, dtype=np.float32)
+    effects = np.empty(X.shape, dtype=np.float32)
+    for start in range(0, len(X), batch_size):
+        block = X[start:start + batch_size]
+        contribs = booster.predict(xgb.DMatrix(block, feature_names=booster.feature_names), pred_contribs=True)
+        # (rows, classes, features + bias); drop the bias column
+        contribs = contribs[:, :, :-1]
+        effects[start:start + len(block)] = contribs[:, 1:, :].mean(axis=1) - contribs[:, 0, :]
+    return effects
+
+
+class FeatureDrivers:
+    """Cached fertility effects for one model version"""
+
+    def __init__(self, model, version=None, cache_dir=DEFAULT_CACHE_DIR, max_recent=4096):
+        self.booster = model.get_booster() if hasattr(model, "get_booster") else model
+        self.version = version
+        self.cache_path = os.path.join(cache_dir, f"drivers-{version}.npz") if version and cache_dir else None
+        self.max_recent = max_recent
+        # Pinned archive effects, and an LRU of effects for any other reading
+        self._effects = {}
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        if self.cache_path and os.path.exists(self.cache_path):
+            with np.load(self.cache_path) as saved:
+                self._effects = dict(zip(map(bytes, saved["rows"]), saved["effects"]))
+
+    def __len__(self):
+        return len(self._effects) + len(self._recent)
+
+    @staticmethod
+    def _keys(X):
+        # float32 matches what the model sees, so equal readings share a key
+        rows = np.ascontiguousarray(X, dtype=np.float32)
+        return rows, [row.tobytes() for row in rows]
+
+    def effects(self, X, pin=False):
+        """(n, 12) effects for the readings in X, computing only the uncached ones
+
+        pin keeps them for good (and in the saved cache) instead of in the LRU.
+        """
+        rows, keys = self._keys(np.atleast_2d(np.asarray(X, dtype=np.float64)))
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._effects:
+                    found[key] = self._effects[key]
+                elif key in self._recent:
+                    self._recent.move_to_end(key)
+                    found[key] = self._recent[key]
+                    if pin:
+                        self._effects[key] = self._recent.pop(key)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            computed = fertility_effects(self.booster, rows[missing])
+            with self._lock:
+                for i, effect in zip(missing, computed):
+                    found[keys[i]] = effect
+                    if pin:
+                        self._effects[keys[i]] = effect
+                    else:
+                        self._recent[keys[i]] = effect
+                while len(self._recent) > self.max_recent:
+                    self._recent.popitem(last=False)
+        return np.vstack([found[key] for key in keys])
+
+    def pinned_rows(self):
+        """(n, 12) float32 readings whose effects are pinned (the archive)"""
+        with self._lock:
+            keys = list(self._effects)
+        return np.frombuffer(b"".join(keys), dtype=np.float32).reshape(len(keys), -1)
+
+    def precompute(self, X, save=True):
+        """Attribute every reading in X (e.g. the whole sensor archive) and persist the cache"""
+        self.effects(X, pin=True)
+        if save:
+            self.save()
+        return len(self._effects)
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        with self._lock:
+            keys = list(self._effects)
+            effects = np.vstack([self._effects[key] for key in keys]) if keys else np.empty((0, 0), np.float32)
+        rows = np.frombuffer(b"".join(keys), dtype=np.float32).reshape(len(keys), -1)
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp.npz"
+        np.savez(tmp_path, rows=rows, effects=effects)
+        os.replace(tmp_path, self.cache_path)
+
+
+def top_drivers(effects, names, k=3, min_effect=0.05):
+    """Strongest raising and lowering variables for one reading's effects"""
+    order = np.argsort(effects)
+    raising = {names[i]: round(float(effects[i]), 2) for i in order[::-1][:k] if effects[i] >= min_effect}
+    lowering = {names[i]: round(float(effects[i]), 2) for i in order[:k] if effects[i] <= -min_effect}
+    return {"raising_fertility": raising, "lowering_fertility": lowering}
@@ -1,72 +1,424 @@
-from soil import get_data_JSON, loaded_model, chain1, chain2
+import soil
+from soil import FEATURE_KEYS, STATUS_LABELS, get_data_JSON, get_data_JSON_batch
+from resources import registry
+from scored_index import ScoredIndex
+from sensor_store import load_store
+from chat_context import ChatContext
+from metrics import metrics
+from report import ReferenceStats, generate_report
+from validation import VALIDATION_POLICY, InvalidReading, Validator
+from drift import DRIFT_STATE_PATH, DriftMonitor
+from timeseries import TimeSeries
+import asyncio
+import atexit
+import numpy as np
+import os
 import random
 import json
-import time
+import threading
 
-# Load sensor data
-with open('assets/sensor_data.json', 'r') as infile:
-    sensor_data = json.load(infile)
+# Exporters selected by SOIL_METRICS_FILE, SOIL_METRICS_PORT and SOIL_TRACE_LOG
+metrics.configure_from_env()
 
-def info_response(input_sensor, language="English"):
-    """Generate analysis response for sensor data"""
-    data_json = get_data_JSON(input_sensor, loaded_model)
-    explanation = chain1.predict(data_JSON=json.dumps(data_json, indent=2), language=language)
-    return explanation, data_json
+# The instant rule-based report is always shown first; set SOIL_LLM_NARRATIVE=off
+# to skip the LLM narrative that otherwise follows it
+LLM_NARRATIVE = os.getenv("SOIL_LLM_NARRATIVE", "on").lower() not in ("off", "0", "false")
+NARRATIVE_SEPARATOR = "\n\n---\n\n"
+REFERENCE_DATA_PATH = "dataset1.csv"
+registry.register("reference_stats", lambda: ReferenceStats.from_csv(REFERENCE_DATA_PATH))
+# Range and out-of-distribution checks run before any LLM call (see validation.py)
+registry.register("input_validator", lambda: Validator.from_csv(REFERENCE_DATA_PATH))
+# Drift of scored readings against the training data over a rolling window
+# of SOIL_DRIFT_PANES panes of SOIL_DRIFT_PANE_SECONDS each (see drift.py)
+def _create_drift_monitor():
+    monitor = DriftMonitor.from_csv(
+        REFERENCE_DATA_PATH, path=DRIFT_STATE_PATH,
+        panes=int(os.getenv("SOIL_DRIFT_PANES", "24")),
+        pane_seconds=float(os.getenv("SOIL_DRIFT_PANE_SECONDS", "3600")),
+        save_interval=float(os.getenv("SOIL_DRIFT_SAVE_SECONDS", "60")))
+    # Readings since the last periodic save are merged into the file on exit
+    atexit.register(_save_drift_state, monitor)
+    return monitor
 
-def chat_response(history, message, language="English"):
+def _save_drift_state(monitor):
+    try:
+        monitor.save()
+    except OSError:
+        pass
+
+registry.register("drift_monitor", _create_drift_monitor)
+
+def record_drift(readings, data_jsons):
+    """Add scored readings that passed validation to the drift monitor"""
+    passed = [i for i, data_json in enumerate(data_jsons) if "validation" not in data_json]
+    if passed:
+        labels = [int(np.flatnonzero(STATUS_LABELS == data_jsons[i]["status"])[0]) for i in passed]
+        registry.get("drift_monitor").update(np.asarray(readings, dtype=np.float64)[passed], labels)
+
+def _record_live_drift(timestamps, values, labels, statuses):
+    """IngestPipeline listener: live readings count towards drift only if they pass validation"""
+    if VALIDATION_POLICY != "off":
+        passed = ~registry.get("input_validator").check(values).failed
+        values, labels = values[passed], labels[passed]
+    registry.get("drift_monitor").update(values, labels)
+
+# Limits for analyze_all(): concurrent chain1 calls and per-call timeout (seconds)
+ANALYZE_CONCURRENCY = int(os.getenv("SOIL_ANALYZE_CONCURRENCY", "4"))
+ANALYZE_TIMEOUT = float(os.getenv("SOIL_ANALYZE_TIMEOUT", "60"))
+
+# Sensor readings: built from the JSON file once, then memory-mapped from .npy
+SENSOR_DATA_PATH = 'assets/sensor_data.json'
+SENSOR_STORE_DIR = os.getenv("SOIL_SENSOR_STORE", ".cache/sensor_store")
+registry.register("sensor_store", lambda: load_store(SENSOR_DATA_PATH, SENSOR_STORE_DIR))
+
+def get_sensor_store():
+    """Shared SensorStore with all readings"""
+    return registry.get("sensor_store")
+
+# Attribute the whole archive in one batch during warm-up, so analyses only
+# look up their drivers (the value is the number of cached readings)
+registry.register("archive_drivers",
+                  lambda: registry.get("feature_drivers").precompute(get_sensor_store().values))
+
+# Predictions for every stored reading, saved next to the store's arrays and
+# brought up to date when the store or the model version changes
+SCORED_INDEX_DIR = os.path.join(SENSOR_STORE_DIR, "scores")
+_scored_index_lock = threading.Lock()
+
+def _refresh_scored_index(index):
+    store, version = get_sensor_store(), soil.model_version
+    with metrics.span("score_archive"):
+        index, scored = index.refresh(store, lambda: soil.loaded_model, version)
+    if scored:
+        try:
+            index.save(SCORED_INDEX_DIR)
+        except OSError:
+            pass
+    return index
+
+registry.register("scored_index",
+                  lambda: _refresh_scored_index(ScoredIndex.open(SCORED_INDEX_DIR) or ScoredIndex.empty()))
+
+def get_scored_index():
+    """ScoredIndex aligned with the current sensor store and model version"""
+    index = registry.get("scored_index")
+    if index.is_current(get_sensor_store(), soil.model_version):
+        return index
+    with _scored_index_lock:
+        index = registry.get("scored_index")
+        if not index.is_current(get_sensor_store(), soil.model_version):
+            index = _refresh_scored_index(index)
+            registry.set("scored_index", index)
+    return index
+
+# Hourly and daily aggregates of the store, saved next to its arrays,
+# extended with new rows and rebuilt when earlier rows change
+SENSOR_ROLLUPS_PATH = os.path.join(SENSOR_STORE_DIR, "rollups.npz")
+_rollups_lock = threading.Lock()
+
+def _refresh_rollups(series):
+    store = get_sensor_store()
+    with metrics.span("rollup_archive"):
+        added = series.refresh(store, get_scored_index())
+    if added:
+        try:
+            series.save(SENSOR_ROLLUPS_PATH)
+        except OSError:
+            pass
+    return series
+
+registry.register("sensor_rollups",
+                  lambda: _refresh_rollups(TimeSeries.open(SENSOR_ROLLUPS_PATH) or TimeSeries()))
+
+def get_sensor_rollups():
+    """TimeSeries of the sensor store, up to date with its readings and the model version"""
+    series = registry.get("sensor_rollups")
+    if not series.is_current(get_sensor_store(), soil.model_version):
+        with _rollups_lock:
+            series = _refresh_rollups(series)
+    return series
+
+# Aggregates of the live feed, kept in memory (replays reuse archive timestamps)
+registry.register("live_rollups", TimeSeries)
+
+def get_trend_series():
+    """TimeSeries of the live feed when it has readings, else of the sensor store"""
+    live = registry.get("live_rollups")
+    if get_ingest_pipeline() is not None and live.rows:
+        return live
+    return get_sensor_rollups()
+
+# Live feed: SOIL_SENSOR_FEED tails a JSONL/CSV file, SOIL_SENSOR_SOCKET
+# ("host:port") accepts gateway connections. Without either, readings come
+# from the sensor store.
+def _start_ingest_pipeline():
+    feed_path = os.getenv("SOIL_SENSOR_FEED")
+    socket_address = os.getenv("SOIL_SENSOR_SOCKET")
+    if not feed_path and not socket_address:
+        return None
+    from ingest import IngestPipeline
+    pipeline = IngestPipeline(
+        lambda: soil.scoring_model,
+        capacity=int(os.getenv("SOIL_INGEST_CAPACITY", "10000")),
+        backpressure=os.getenv("SOIL_INGEST_BACKPRESSURE", "drop_oldest"),
+    )
+    pipeline.add_listener(_record_live_drift)
+    pipeline.add_listener(registry.get("live_rollups").on_scored)
+    pipeline.start()
+    if feed_path:
+        pipeline.follow(feed_path)
+    if socket_address:
+        host, port = socket_address.rsplit(":", 1)
+        pipeline.listen(host, int(port))
+    return pipeline
+
+registry.register("ingest_pipeline", _start_ingest_pipeline)
+
+def get_ingest_pipeline():
+    """Running IngestPipeline, or None when no live feed is configured"""
+    return registry.get("ingest_pipeline")
+
+def get_live_readings(n):
+    """(timestamps, readings, statuses) of the n newest live readings, or None without a feed"""
+    pipeline = get_ingest_pipeline()
+    if pipeline is None or len(pipeline.buffer) == 0:
+        return None
+    timestamps, values, labels = pipeline.latest(n)
+    statuses = STATUS_LABELS[np.clip(labels, 0, len(STATUS_LABELS) - 1)].tolist()
+    return timestamps, values.tolist(), statuses
+
+def validate_readings(readings, data_jsons, policy=VALIDATION_POLICY):
+    """Check a batch in one pass and attach a "validation" entry to the data of failing readings"""
+    if policy == "off":
+        return
+    with metrics.span("validate"):
+        result = registry.get("input_validator").check(readings)
+    for i in np.flatnonzero(result.failed):
+        data_jsons[i]["validation"] = result.summary(i)
+        metrics.increment("soil_validation_failures_total", help_text="Readings that failed input validation",
+                          result=result.kind(i), policy=policy)
+
+def narrative_allowed(data_json, policy=VALIDATION_POLICY):
+    """Apply the validation policy: raise for rejected readings, False if the LLM call is skipped"""
+    validation = data_json.get("validation")
+    if not validation or policy == "flag":
+        return True
+    if policy == "reject":
+        raise InvalidReading(validation["issues"])
+    validation["llm"] = "skipped"
+    metrics.increment("soil_llm_calls_skipped_total", help_text="LLM calls skipped for readings that failed validation")
+    return False
+
+def score_reading(input_sensor, status=None):
+    """Predict the fertility status (unless already known), validate, and serialize it for the prompt"""
+    with metrics.span("predict"):
+        data_json = get_data_JSON(input_sensor, soil.scoring_model, status=status)
+    validate_readings([input_sensor], [data_json])
+    if status is None:
+        record_drift([input_sensor], [data_json])
+    with metrics.span("serialize"):
+        data_JSON = json.dumps(data_json, indent=2)
+    return data_json, data_JSON
+
+def instant_report(data_json, language="English"):
+    """Rule-based report for a scored reading; renders in well under a millisecond"""
+    with metrics.span("report"):
+        return generate_report(data_json, registry.get("reference_stats"), language)
+
+def record_fallback(chain, error):
+    metrics.increment("soil_llm_fallbacks_total", help_text="Responses served without the LLM narrative",
+                      chain=chain, reason=type(error).__name__)
+
+def report_then_narrative(report, stream):
+    """Yield the report at once, then the LLM narrative; LLM failures leave the report as the answer"""
+    yield report
+    if stream is None:
+        return
+    started = False
+    try:
+        for chunk in stream:
+            if not started:
+                yield NARRATIVE_SEPARATOR
+                started = True
+            yield chunk
+    except Exception as e:
+        record_fallback("chain1", e)
+
+def traced_stream(request, stream, language):
+    """Consume a token stream inside a metrics trace"""
+    with metrics.trace(request, language=language):
+        yield from stream
+
+def info_response(input_sensor, language="English", status=None, narrative=LLM_NARRATIVE):
+    """Generate analysis response for sensor data: the instant report plus, optionally, the LLM narrative"""
+    with metrics.trace("info_response", language=language):
+        data_json, data_JSON = score_reading(input_sensor, status)
+        narrative = narrative_allowed(data_json) and narrative
+        report = instant_report(data_json, language)
+        if not narrative:
+            return report, data_json
+        try:
+            explanation = soil.chain1.predict(data_JSON=data_JSON, language=language)
+        except Exception as e:
+            record_fallback("chain1", e)
+            return report, data_json
+    return report + NARRATIVE_SEPARATOR + explanation, data_json
+
+def info_response_stream(input_sensor, language="English", status=None, narrative=LLM_NARRATIVE):
+    """Return (stream of the report then the LLM narrative, data_json); status skips scoring when known"""
+    data_json, data_JSON = score_reading(input_sensor, status)
+    narrative = narrative_allowed(data_json) and narrative
+    report = instant_report(data_json, language)
+    stream = soil.chain1.stream(data_JSON=data_JSON, language=language) if narrative else None
+    return traced_stream("info_response_stream", report_then_narrative(report, stream), language), data_json
+
+def is_rate_limited(error):
+    """True if an LLM error is an HTTP 429 / rate-limit response"""
+    return getattr(error, "status_code", None) == 429 or "RateLimit" in type(error).__name__
+
+def retry_delay(error, attempt, base_delay=1.0, max_delay=30.0):
+    """Seconds to wait before retrying: Retry-After if given, else jittered exponential backoff"""
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), max_delay)
+        except ValueError:
+            pass
+    return min(base_delay * 2 ** attempt, max_delay) * random.uniform(0.5, 1.5)
+
+async def analyze_all_async(samples, language="English", concurrency=ANALYZE_CONCURRENCY,
+                            timeout=ANALYZE_TIMEOUT, max_retries=3, narrative=LLM_NARRATIVE):
+    """Analyze many samples concurrently, yielding results as they complete
+
+    All readings are scored in one batch, then every chain1 request is sent at
+    once, bounded by `concurrency`. Rate-limited calls are retried with
+    backoff; each call is limited to `timeout` seconds. Yields
+    (sample_id, explanation, data_json, error). The explanation is the instant
+    report followed by the LLM narrative; when the LLM fails it is the report
+    alone and error is set. Readings that fail validation follow the
+    validation policy; rejected ones have no explanation and an
+    InvalidReading error.
+    """
+    with metrics.span("predict_batch"):
+        # Samples from the sensor store or live feed arrive with their status already scored
+        statuses = [sample.get("status") for sample in samples]
+        data_jsons = get_data_JSON_batch([sample["input_sensor"] for sample in samples], soil.scoring_model,
+                                         statuses=None if None in statuses else statuses)
+    validate_readings([sample["input_sensor"] for sample in samples], data_jsons)
+    if None in statuses:
+        record_drift([sample["input_sensor"] for sample in samples], data_jsons)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(sample, data_json):
+        try:
+            allowed = narrative_allowed(data_json)
+        except InvalidReading as e:
+            return sample["sample_id"], None, data_json, e
+        report = instant_report(data_json, language)
+        if not (narrative and allowed):
+            return sample["sample_id"], report, data_json, None
+        error = None
+        for attempt in range(max_retries + 1):
+            try:
+                async with semaphore:
+                    with metrics.trace("analyze_all", language=language, attempt=attempt):
+                        explanation = await asyncio.wait_for(
+                            soil.chain1.apredict(data_JSON=json.dumps(data_json, indent=2), language=language),
+                            timeout,
+                        )
+                return sample["sample_id"], report + NARRATIVE_SEPARATOR + explanation, data_json, None
+            except asyncio.TimeoutError as e:
+                error = e
+                break
+            except Exception as e:
+                error = e
+                if not is_rate_limited(e) or attempt == max_retries:
+                    break
+                # Back off outside the semaphore so other requests keep going
+                await asyncio.sleep(retry_delay(e, attempt))
+        record_fallback("chain1", error)
+        return sample["sample_id"], report, data_json, error
+
+    tasks = [asyncio.ensure_future(analyze(sample, data_json)) for sample, data_json in zip(samples, data_jsons)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def analyze_all(samples, language="English", on_result=None, **kwargs):
+    """Blocking wrapper around analyze_all_async
+
+    Calls on_result(sample_id, explanation, data_json, error) as each sample
+    finishes and returns {sample_id: (explanation, data_json, error)}.
+    """
+    async def collect():
+        results = {}
+        async for sample_id, explanation, data_json, error in analyze_all_async(samples, language, **kwargs):
+            results[sample_id] = (explanation, data_json, error)
+            if on_result is not None:
+                on_result(sample_id, explanation, data_json, error)
+        return results
+
+    return asyncio.run(collect())
+
+def chat_inputs(history, message, language="English", context=None):
+    """chain2 inputs under the context's token budget; records the prompt token count"""
+    if context is None:
+        context = ChatContext()
+    prompt = soil.chain2.prompt(language)
+    with metrics.span("build_context"):
+        return context.build(history, message, lambda inputs: prompt.format(**inputs))
+
+def chat_response(history, message, language="English", context=None):
     """Generate chat response based on history and message"""
-    # Format history for the prompt
-    formatted_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
-    explanation = chain2.predict(user_history=formatted_history, user_message=message, language=language)
+    with metrics.trace("chat_response", language=language):
+        explanation = soil.chain2.predict(language=language, **chat_inputs(history, message, language, context))
     return explanation
 
+def chat_response_stream(history, message, language="English", context=None):
+    """Token stream of the chat response"""
+    stream = soil.chain2.stream(language=language, **chat_inputs(history, message, language, context))
+    return traced_stream("chat_response_stream", stream, language)
+
 def get_sensor_data():
-    """Get random sensor data from the JSON file"""
-    keys = [
-        "N - Ratio of Nitrogen (NH4+) content in soil",
-        "P - Ratio of Phosphorous (P) content in soil",
-        "K - Ratio of Potassium (K) content in soil",
-        "pH - Soil acidity (pH)",
-        "ec - Electrical conductivity",
-        "oc - Organic carbon",
-        "S - Sulfur (S)",
-        "zn - Zinc (Zn)",
-        "fe - Iron (Fe)",
-        "cu - Copper (Cu)",
-        "Mn - Manganese (Mn)",
-        "B - Boron (B)"
-    ]
+    """Get the newest live reading, or random sensor data from the sensor store"""
+    live = get_live_readings(1)
+    if live is not None:
+        timestamps, readings, _ = live
+        return dict(zip(FEATURE_KEYS, readings[0])), readings[0], timestamps[0]
     
-    # Get random sensor reading
-    timestamp = random.choice(list(sensor_data.keys()))
-    input_sensor = sensor_data[timestamp]
+    store = get_sensor_store()
+    index = store.sample(1)[0]
+    input_sensor = store.reading(index)
     
     # Create formatted dictionary
-    data_dict = {k: v for k, v in zip(keys, input_sensor)}
+    data_dict = dict(zip(FEATURE_KEYS, input_sensor))
     
-    return data_dict, input_sensor, timestamp
+    return data_dict, input_sensor, store.timestamp(index)
 
 def get_multiple_sensor_samples(n=2):
-    """Get multiple unique sensor samples"""
-    samples = []
-    used_timestamps = []
-    
-    available_timestamps = list(sensor_data.keys())
+    """Get the newest live readings, or multiple unique samples from the sensor store"""
+    live = get_live_readings(n)
+    if live is not None:
+        timestamps, readings, statuses = live
+    else:
+        store = get_sensor_store()
+        scored = get_scored_index()
+        indices = store.sample(n)
+        timestamps = [store.timestamp(index) for index in indices]
+        readings = [store.reading(index) for index in indices]
+        statuses = [scored.status(index) for index in indices]
     
-    for i in range(min(n, len(available_timestamps))):
-        # Get unused timestamp
-        remaining = [t for t in available_timestamps if t not in used_timestamps]
-        if not remaining:
-            break
-            
-        timestamp = random.choice(remaining)
-        used_timestamps.append(timestamp)
-        
-        data_dict, input_sensor, _ = get_sensor_data_by_timestamp(timestamp)
+    samples = []
+    for i, (timestamp, input_sensor, status) in enumerate(zip(timestamps, readings, statuses)):
         samples.append({
-            "data_dict": data_dict,
+            "data_dict": dict(zip(FEATURE_KEYS, input_sensor)),
             "input_sensor": input_sensor,
             "timestamp": timestamp,
+            "status": status,
             "sample_id": f"Sample {i+1}"
         })
     
@@ -74,22 +426,8 @@ def get_multiple_sensor_samples(n=2):
 
 def get_sensor_data_by_timestamp(timestamp):
     """Get specific sensor data by timestamp"""
-    keys = [
-        "N - Ratio of Nitrogen (NH4+) content in soil",
-        "P - Ratio of Phosphorous (P) content in soil",
-        "K - Ratio of Potassium (K) content in soil",
-        "pH - Soil acidity (pH)",
-        "ec - Electrical conductivity",
-        "oc - Organic carbon",
-        "S - Sulfur (S)",
-        "zn - Zinc (Zn)",
-        "fe - Iron (Fe)",
-        "cu - Copper (Cu)",
-        "Mn - Manganese (Mn)",
-        "B - Boron (B)"
-    ]
-    
-    input_sensor = sensor_data[timestamp]
-    data_dict = {k: v for k, v in zip(keys, input_sensor)}
+    store = get_sensor_store()
+    input_sensor = store.reading(store.index_of(timestamp))
+    data_dict = dict(zip(FEATURE_KEYS, input_sensor))
     
     return data_dict, input_sensor, timestamp
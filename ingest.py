@@ -0,0 +1,319 @@
+"""Streaming ingestion of sensor readings with incremental micro-batch scoring
+
+Readings arrive as lines from an append-only JSONL/CSV feed that is tailed, or
+from field gateways connected over a local TCP socket. Lines go into a bounded
+queue. A worker thread parses and validates them and scores each micro-batch
+with the model in one call. The most recent readings and their predictions
+are kept in a fixed-size ring buffer, so memory stays bounded however long
+the feed runs.
+
+Accepted line formats:
+
+    {"timestamp": "2023-09-14 19:20:43", "values": [295.0, 9.9, ...]}
+    {"timestamp": "2023-09-14 19:20:43", "N": 295.0, "P": 9.9, ...}
+    2023-09-14 19:20:43,295.0,9.9,...          (CSV, optional header row)
+
+Run this file directly to replay the sample archive as a live feed:
+
+    python ingest.py --out .cache/sensor_feed.jsonl --interval 1
+    python ingest.py --socket 127.0.0.1:9750 --interval 1
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import numpy as np
+
+from metrics import metrics
+from soil import FEATURE_COLUMNS, predict_batch
+from sensor_store import parse_timestamps, format_timestamps
+
+BACKPRESSURE_POLICIES = ("block", "drop_newest", "drop_oldest")
+logger = logging.getLogger(__name__)
+
+
+def parse_line(line):
+    """Parse one feed line into (timestamp_seconds, values); raises ValueError"""
+    line = line.strip()
+    if not line:
+        raise ValueError("empty line")
+    if line.startswith("{"):
+        record = json.loads(line)
+        if "values" in record:
+            values = record["values"]
+        else:
+            values = [record[c] for c in FEATURE_COLUMNS]
+        timestamp = record["timestamp"]
+    else:
+        fields = line.split(",")
+        timestamp, values = fields[0], fields[1:]
+    if not isinstance(timestamp, str):
+        raise ValueError(f"timestamp must be a string, got {type(timestamp).__name__}")
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape != (len(FEATURE_COLUMNS),):
+        raise ValueError(f"expected {len(FEATURE_COLUMNS)} values, got {values.size}")
+    if not np.all(np.isfinite(values)):
+        raise ValueError("non-finite value")
+    return int(parse_timestamps([timestamp.strip()])[0]), values
+
+
+class ReadingBuffer:
+    """Fixed-capacity ring buffer of scored readings"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, len(FEATURE_COLUMNS)), dtype=np.float64)
+        self.labels = np.zeros(capacity, dtype=np.int8)
+        self.count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamps, values, labels):
+        with self._lock:
+            # Only the last `capacity` rows of an oversized batch can survive
+            timestamps, values, labels = timestamps[-self.capacity:], values[-self.capacity:], labels[-self.capacity:]
+            positions = (self._next + np.arange(len(timestamps))) % self.capacity
+            self.timestamps[positions] = timestamps
+            self.values[positions] = values
+            self.labels[positions] = labels
+            self._next = (self._next + len(timestamps)) % self.capacity
+            self.count = min(self.count + len(timestamps), self.capacity)
+
+    def latest(self, n):
+        """(timestamps, values, labels) of the n most recent readings, newest first"""
+        with self._lock:
+            n = min(n, self.count)
+            positions = (self._next - 1 - np.arange(n)) % self.capacity
+            return self.timestamps[positions], self.values[positions], self.labels[positions]
+
+    def __len__(self):
+        return self.count
+
+
+class IngestPipeline:
+    """Bounded queue -> parse/validate -> micro-batch scoring -> ring buffer"""
+
+    def __init__(self, get_model, capacity=10000, queue_size=1000, batch_size=64,
+                 max_wait=0.25, backpressure="block"):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"backpressure must be one of {BACKPRESSURE_POLICIES}")
+        self.get_model = get_model
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.backpressure = backpressure
+        self.buffer = ReadingBuffer(capacity)
+        self.listeners = []
+        self.stats = {"received": 0, "scored": 0, "invalid": 0, "dropped": 0, "batches": 0, "errors": 0}
+        # Socket handler threads, the tailer and the scorer all update stats
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+        self._server = None
+
+    def add_listener(self, callback):
+        """Call callback(timestamps, values, labels, statuses) after every scored batch"""
+        self.listeners.append(callback)
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def submit(self, line):
+        """Queue one raw line; returns False if it was dropped by backpressure"""
+        self._count("received")
+        if self.backpressure == "block":
+            self._queue.put(line)
+            return True
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            self._count("dropped")
+            if self.backpressure == "drop_newest":
+                return False
+        # drop_oldest: make room by discarding the oldest queued line
+        try:
+            self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            return False
+        return True
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        """Start the scoring worker"""
+        self._start_thread(self._score_loop, "ingest-score")
+        return self
+
+    def stop(self):
+        """Stop all feed and scoring threads"""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+
+    def follow(self, path, poll_interval=0.5, from_start=True):
+        """Tail an append-only JSONL/CSV file and feed new lines to the pipeline"""
+        self._start_thread(lambda: self._follow_loop(path, poll_interval, from_start), "ingest-follow")
+        return self
+
+    def listen(self, host="127.0.0.1", port=9750):
+        """Accept newline-delimited readings from gateways over TCP"""
+        pipeline = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for raw in self.rfile:
+                    if pipeline._stop.is_set():
+                        break
+                    pipeline.submit(raw.decode("utf-8", errors="replace"))
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self._server = Server((host, port), Handler)
+        self._start_thread(self._server.serve_forever, "ingest-listen")
+        return self
+
+    def latest(self, n):
+        """Most recent scored readings as (timestamp strings, values, labels)"""
+        timestamps, values, labels = self.buffer.latest(n)
+        return format_timestamps(timestamps), values, labels
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _follow_loop(self, path, poll_interval, from_start):
+        position = 0
+        pending = ""
+        while not self._stop.is_set():
+            if not os.path.exists(path):
+                time.sleep(poll_interval)
+                continue
+            if not from_start and position == 0:
+                position = os.path.getsize(path)
+            if os.path.getsize(path) < position:
+                # File was truncated or rotated; start over
+                position, pending = 0, ""
+            with open(path, "r") as infile:
+                infile.seek(position)
+                chunk = infile.read()
+                position = infile.tell()
+            if chunk:
+                lines = (pending + chunk).split("\n")
+                # Keep a trailing partial line until the writer finishes it
+                pending = lines.pop()
+                for line in lines:
+                    if line.strip() and not line.lstrip().startswith("timestamp"):
+                        self.submit(line)
+            else:
+                time.sleep(poll_interval)
+
+    def _next_batch(self):
+        """Collect up to batch_size lines, waiting at most max_wait after the first"""
+        try:
+            lines = [self._queue.get(timeout=self.max_wait)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(lines) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                lines.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return lines
+
+    def _score_loop(self):
+        while not self._stop.is_set():
+            lines = self._next_batch()
+            if not lines:
+                continue
+            timestamps, rows = [], []
+            for line in lines:
+                try:
+                    timestamp, values = parse_line(line)
+                except Exception:
+                    # Any unparseable line is counted and skipped; the scorer must not die
+                    self._count("invalid")
+                    continue
+                timestamps.append(timestamp)
+                rows.append(values)
+            if not rows:
+                continue
+            timestamps, values = np.array(timestamps, dtype=np.int64), np.vstack(rows)
+            try:
+                labels, statuses, _ = predict_batch(values, self.get_model())
+            except Exception:
+                # The batch is lost, but the scorer keeps running for the next one
+                self._record_error("score", len(rows))
+                continue
+            self.buffer.append(timestamps, values, labels)
+            self._count("scored", len(rows))
+            self._count("batches")
+            for callback in self.listeners:
+                try:
+                    callback(timestamps, values, labels, statuses)
+                except Exception:
+                    self._record_error("listener", len(rows))
+
+    def _record_error(self, stage, rows):
+        self._count("errors")
+        metrics.increment("soil_ingest_errors_total", help_text="Ingest batches that failed to score or notify",
+                          stage=stage)
+        logger.exception("ingest %s failed for a batch of %d readings", stage, rows)
+
+
+def replay(source, out=None, address=None, interval=1.0):
+    """Write the readings of a {timestamp: values} JSON file to a feed, one per interval"""
+    with open(source, "r") as infile:
+        readings = json.load(infile)
+    connection = None
+    if address is not None:
+        host, port = address.rsplit(":", 1)
+        connection = socket.create_connection((host, int(port)))
+    try:
+        for timestamp, values in readings.items():
+            line = json.dumps({"timestamp": timestamp, "values": values}) + "\n"
+            if connection is not None:
+                connection.sendall(line.encode("utf-8"))
+            else:
+                with open(out, "a") as outfile:
+                    outfile.write(line)
+            time.sleep(interval)
+    finally:
+        if connection is not None:
+            connection.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay the sample archive as a live sensor feed")
+    parser.add_argument("--source", default="assets/sensor_data.json")
+    parser.add_argument("--out", default=".cache/sensor_feed.jsonl", help="JSONL feed file to append to")
+    parser.add_argument("--socket", default=None, help="host:port of a listening pipeline instead of a file")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between readings")
+    args = parser.parse_args()
+
+    if args.socket is None and os.path.dirname(args.out):
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    replay(args.source, out=args.out, address=args.socket, interval=args.interval)
@@ -0,0 +1,171 @@
+"""Multi-session load test of app.py against the local mock Groq API
+
+Each simulated user drives the real app.py script through streamlit.testing.
+The flow is: open the page, load new samples, analyze a sample, then ask the
+two quick questions. streamlit.testing keeps one script runtime per process,
+so every simulated user runs in its own worker process. For every concurrency
+level the harness reports throughput, p50/p95/p99 latency per step and the
+memory of each worker process.
+
+    python loadtest.py --concurrency 1 4 16 --latency 0.3
+    python loadtest.py --base-url http://127.0.0.1:8765   # use a running mock
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+STEPS = ("open", "load_samples", "analyze", "question")
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of values by linear interpolation"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def rss_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        # ru_maxrss is in KB on Linux; used as a fallback peak figure
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_session(app_path, timings, errors):
+    """Drive one user session through the app, appending (step, seconds) to timings"""
+    from streamlit.testing.v1 import AppTest
+
+    def timed(step, action):
+        start = time.perf_counter()
+        at = action()
+        timings.append((step, time.perf_counter() - start))
+        if at.exception:
+            raise RuntimeError(f"{step}: {at.exception[0].message}")
+        return at
+
+    def click(at, label):
+        return next(b for b in at.button if b.label == label).click().run()
+
+    try:
+        at = timed("open", lambda: AppTest.from_file(app_path, default_timeout=120).run())
+        at = timed("load_samples", lambda: at.button(key="refresh_samples").click().run())
+        at = timed("analyze", lambda: at.button(key="analyze_Sample 1").click().run())
+        at = timed("question", lambda: click(at, "🌱 Nutrient Improvement"))
+        timed("question", lambda: click(at, "🧪 Fertilizer Guide"))
+    except Exception as e:
+        errors.append(repr(e))
+
+
+def worker(app_path, iterations):
+    """One simulated user: run `iterations` sessions back to back; return results"""
+    os.environ["SOIL_LLM_CACHE"] = "off"
+    import soil
+    soil.warm_up(background=False)
+    timings, errors = [], []
+    for _ in range(iterations):
+        run_session(app_path, timings, errors)
+    return {"timings": timings, "errors": errors, "rss_mb": rss_mb(),
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def run_level(app_path, concurrency, iterations):
+    """Run `concurrency` users in parallel processes and aggregate the results"""
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    with context.Pool(concurrency) as pool:
+        results = pool.starmap(worker, [(app_path, iterations)] * concurrency)
+    elapsed = time.perf_counter() - start
+
+    timings = [t for result in results for t in result["timings"]]
+    errors = [e for result in results for e in result["errors"]]
+    sessions = concurrency * iterations
+    report = {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "failed_sessions": len(errors),
+        "wall_seconds": elapsed,
+        "sessions_per_second": (sessions - len(errors)) / elapsed,
+        "steps": {},
+        "process_rss_mb": [round(r["rss_mb"], 1) for r in results],
+        "process_max_rss_mb": [round(r["max_rss_mb"], 1) for r in results],
+        "total_rss_mb": round(sum(r["rss_mb"] for r in results), 1),
+        "errors": errors[:5],
+    }
+    for step in STEPS:
+        values = [seconds for name, seconds in timings if name == step]
+        report["steps"][step] = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+        }
+    return report
+
+
+def print_level(report):
+    print(f"\nconcurrency {report['concurrency']}: "
+          f"{report['sessions_per_second']:.2f} sessions/s, "
+          f"{report['failed_sessions']}/{report['sessions']} failed, "
+          f"RSS {report['total_rss_mb']} MB total, per process {report['process_rss_mb']} MB")
+    print(f"  {'step':<14}{'count':>6}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}")
+    for step, stats in report["steps"].items():
+        if stats["count"]:
+            print(f"  {step:<14}{stats['count']:>6}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}")
+    for error in report["errors"]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test app.py against a mock Groq endpoint")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--iterations", type=int, default=2, help="sessions per simulated user")
+    parser.add_argument("--base-url", default=None, help="use an already running mock instead of starting one")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--out", default="loadtest_results.json")
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url is None:
+        from mock_groq import MockGroqServer
+        server = MockGroqServer(("127.0.0.1", 0), args.latency, args.tokens_per_second, args.error_rate).start()
+        args.base_url = server.base_url
+    # Inherited by the spawned workers before they import soil
+    os.environ["GROQ_API_BASE"] = args.base_url
+    os.environ.setdefault("GROQ_API_KEY", "mock")
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    reports = []
+    try:
+        for concurrency in args.concurrency:
+            report = run_level(app_path, concurrency, args.iterations)
+            if server is not None:
+                report["mock_requests"] = server.requests
+            reports.append(report)
+            print_level(report)
+    finally:
+        if server is not None:
+            server.stop()
+
+    with open(args.out, "w") as outfile:
+        json.dump({"base_url": args.base_url, "levels": reports}, outfile, indent=2)
+    print(f"\nWrote {args.out}")
+    if any(report["failed_sessions"] for report in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
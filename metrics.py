@@ -0,0 +1,241 @@
+"""Per-stage latency and token metrics with Prometheus and JSONL export
+
+Code paths wrap their stages in metrics.span("stage"). Each span is observed
+into a latency histogram and, inside a metrics.trace(...), attached to that
+request's trace. LLM responses feed token counts and the model-side timings
+Groq reports. Everything can be exported as Prometheus text (a file or a
+local /metrics endpoint), plus an optional JSONL log with one trace per
+request. The exporters are configured from the environment:
+
+    SOIL_METRICS_FILE   write Prometheus text to this file after every request
+    SOIL_METRICS_PORT   serve http://127.0.0.1:<port>/metrics
+    SOIL_TRACE_LOG      append one JSON trace per request to this file
+"""
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+_current_trace = contextvars.ContextVar("soil_trace", default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram, exported with cumulative Prometheus buckets"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """Thread-safe collection of histograms and counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self.prometheus_file = None
+        self.trace_log = None
+        self._server = None
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, help_text="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help_text))
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def increment(self, name, amount=1, help_text="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help_text))
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time a stage into soil_stage_seconds and the current request trace"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(stage, time.perf_counter() - start, **labels)
+
+    def record_span(self, stage, seconds, **labels):
+        """Record a stage duration measured by the caller"""
+        self.observe("soil_stage_seconds", seconds, help_text="Latency of each pipeline stage",
+                     stage=stage, **labels)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace["spans"].append({"stage": stage, "seconds": round(seconds, 6), **labels})
+
+    @contextmanager
+    def trace(self, request, **attributes):
+        """Group the spans of one request; written to the JSONL log when it ends"""
+        trace = {"id": uuid.uuid4().hex, "request": request, "started": time.time(),
+                 "spans": [], **attributes}
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield trace
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _current_trace.reset(token)
+            trace["seconds"] = round(time.perf_counter() - start, 6)
+            if error is not None:
+                trace["error"] = repr(error)
+            self.observe("soil_request_seconds", trace["seconds"],
+                         help_text="End-to-end latency per request", request=request)
+            self.increment("soil_requests_total", help_text="Requests handled", request=request,
+                           outcome="error" if error is not None else "ok")
+            self._export(trace)
+
+    def record_llm(self, chain, message, first_token_seconds=None):
+        """Record token usage and model latency from a ChatGroq response message"""
+        usage = getattr(message, "usage_metadata", None) or {}
+        metadata = getattr(message, "response_metadata", None) or {}
+        token_usage = metadata.get("token_usage") or {}
+        prompt_tokens = usage.get("input_tokens", token_usage.get("prompt_tokens"))
+        completion_tokens = usage.get("output_tokens", token_usage.get("completion_tokens"))
+        record = {}
+        if prompt_tokens is not None:
+            self.observe("soil_llm_prompt_tokens", prompt_tokens, TOKEN_BUCKETS,
+                         help_text="Prompt tokens per LLM call", chain=chain)
+            self.increment("soil_llm_tokens_total", prompt_tokens, help_text="LLM tokens used",
+                           chain=chain, kind="prompt")
+            record["prompt_tokens"] = prompt_tokens
+        if completion_tokens is not None:
+            self.observe("soil_llm_completion_tokens", completion_tokens, TOKEN_BUCKETS,
+                         help_text="Completion tokens per LLM call", chain=chain)
+            self.increment("soil_llm_tokens_total", completion_tokens, help_text="LLM tokens used",
+                           chain=chain, kind="completion")
+            record["completion_tokens"] = completion_tokens
+        # Groq reports its own queue and generation times alongside the tokens
+        for field in ("queue_time", "prompt_time", "completion_time", "total_time"):
+            if token_usage.get(field) is not None:
+                self.observe("soil_llm_model_seconds", token_usage[field],
+                             help_text="Model-side latency reported by the API", chain=chain, phase=field)
+                record[field] = token_usage[field]
+        if first_token_seconds is not None:
+            self.observe("soil_llm_first_token_seconds", first_token_seconds,
+                         help_text="Time to first streamed token", chain=chain)
+            record["first_token_seconds"] = round(first_token_seconds, 6)
+        trace = _current_trace.get()
+        if trace is not None and record:
+            trace.setdefault("llm", []).append({"chain": chain, **record})
+
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+            help_texts = dict(self._help)
+        lines = []
+        for name, (kind, help_text) in sorted(help_texts.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for (metric, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            else:
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Atomically write the Prometheus text to a file"""
+        # A unique temp file per write: traces on other threads may be exporting at the same time
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".metrics-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as outfile:
+                outfile.write(self.prometheus_text())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def serve(self, port, host="127.0.0.1"):
+        """Expose /metrics over HTTP from a daemon thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        return self._server
+
+    def configure_from_env(self):
+        """Enable the exporters selected by SOIL_METRICS_FILE / _PORT and SOIL_TRACE_LOG"""
+        self.prometheus_file = os.getenv("SOIL_METRICS_FILE") or None
+        self.trace_log = os.getenv("SOIL_TRACE_LOG") or None
+        port = os.getenv("SOIL_METRICS_PORT")
+        if port and self._server is None:
+            try:
+                self.serve(int(port))
+            except OSError:
+                # Another worker process already serves this port
+                pass
+
+    def _export(self, trace):
+        if self.trace_log:
+            with self._lock:
+                with open(self.trace_log, "a") as outfile:
+                    outfile.write(json.dumps(trace, default=str) + "\n")
+        if self.prometheus_file:
+            self.write_prometheus(self.prometheus_file)
+
+
+# Shared metrics used by soil.py and infer.py
+metrics = Metrics()
@@ -0,0 +1,175 @@
+"""Local stand-in for the Groq (OpenAI-compatible) chat completions API
+
+Serves POST /openai/v1/chat/completions, with and without streaming, using
+configurable time to first token, token rate, error rate and tail latency
+(a fraction of requests stalled before answering). No API key or
+network access is needed. Point the app at it with GROQ_API_BASE:
+
+    python mock_groq.py --port 8765 --latency 0.3 --tokens-per-second 200
+    GROQ_API_BASE=http://127.0.0.1:8765 GROQ_API_KEY=mock streamlit run app.py
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = (
+    "The soil shows balanced macronutrients with moderate organic carbon. "
+    "Maintain fertility with crop rotation, compost and split nitrogen applications. "
+    "Monitor pH and micronutrients such as zinc and boron each season."
+)
+
+
+class MockGroqServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the mock's behaviour settings and counters"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency=0.2, tokens_per_second=100.0, error_rate=0.0,
+                 reply=DEFAULT_REPLY, seed=None, slow_rate=0.0, slow_latency=2.0):
+        super().__init__(address, MockGroqHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.reply = reply
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve in a daemon thread; returns self"""
+        threading.Thread(target=self.serve_forever, name="mock-groq", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MockGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.random.random() < server.error_rate
+            if fail:
+                server.errors += 1
+            slow = server.random.random() < server.slow_rate
+        if fail:
+            # Rate limiting is the error the real API returns most under load
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "tokens"}},
+                            {"retry-after": "1"})
+            return
+
+        time.sleep(server.slow_latency if slow else server.latency)
+        model = request.get("model", "mock")
+        tokens = [word + " " for word in server.reply.split()]
+        prompt_tokens = sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4
+        completion_time = len(tokens) / server.tokens_per_second
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+            "queue_time": server.latency,
+            "completion_time": completion_time,
+            "total_time": server.latency + completion_time,
+        }
+        if request.get("stream"):
+            self._stream(model, tokens, usage)
+        else:
+            time.sleep(completion_time)
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+    def _stream(self, model, tokens, usage):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        delay = 1.0 / self.server.tokens_per_second
+        for i, token in enumerate(tokens):
+            last = i == len(tokens) - 1
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": "stop" if last else None}],
+            }
+            if last:
+                chunk["x_groq"] = {"usage": usage}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            time.sleep(delay)
+        self._write_chunk("data: [DONE]\n\n")
+        self._write_chunk("")
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local mock of the Groq chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests delayed by --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    server = MockGroqServer((args.host, args.port), args.latency, args.tokens_per_second, args.error_rate,
+                            slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    print(f"Mock Groq API listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,245 @@
+"""Versioned model registry in xgboost's native format, with hot reload
+
+Each version is a folder holding the model in xgboost's own UBJSON (or JSON)
+format and a metadata.json with its sha256 checksum, size, xgboost version,
+features, tree count and training metrics. A CURRENT file names the version
+in production, and every promotion is appended to promotions.log:
+
+    models/
+    ├── CURRENT
+    ├── promotions.log
+    └── <version>/
+        ├── model.ubj
+        └── metadata.json
+
+Loading does not unpickle anything, and a file whose checksum does not
+match is refused. ModelWatcher polls CURRENT from a background thread so
+that running app processes pick up a promoted version without a restart.
+
+    python model_registry.py list
+    python model_registry.py import xgb_soil_analysis.bin --version legacy --promote
+    python model_registry.py promote 20240601-120000
+    python model_registry.py rollback
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+CURRENT_FILE = "CURRENT"
+PROMOTIONS_FILE = "promotions.log"
+METADATA_FILE = "metadata.json"
+MODEL_FORMATS = ("ubj", "json")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """Folder of model versions plus a pointer to the promoted one"""
+
+    def __init__(self, root="models"):
+        self.root = root
+
+    def path(self, version, name=""):
+        return os.path.join(self.root, version, name)
+
+    def versions(self):
+        """Published versions, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        found = [name for name in os.listdir(self.root)
+                 if os.path.exists(self.path(name, METADATA_FILE))]
+        return sorted(found, key=lambda name: self.metadata(name)["created"])
+
+    def metadata(self, version):
+        with open(self.path(version, METADATA_FILE), "r") as infile:
+            return json.load(infile)
+
+    def publish(self, model, version, metrics=None, fmt="ubj", source=None):
+        """Save a fitted XGBClassifier as a new version; returns its metadata"""
+        import xgboost
+
+        if fmt not in MODEL_FORMATS:
+            raise ValueError(f"fmt must be one of {MODEL_FORMATS}")
+        if os.path.exists(self.path(version)):
+            raise ValueError(f"Model version {version!r} already exists")
+        # Build the folder under a temporary name so readers never see half a version
+        staging = os.path.join(self.root, f".staging-{version}-{os.getpid()}")
+        os.makedirs(staging)
+        try:
+            model_file = f"model.{fmt}"
+            model.save_model(os.path.join(staging, model_file))
+            booster = model.get_booster()
+            metadata = {
+                "version": version,
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "format": fmt,
+                "file": model_file,
+                "sha256": file_sha256(os.path.join(staging, model_file)),
+                "size_bytes": os.path.getsize(os.path.join(staging, model_file)),
+                "xgboost": xgboost.__version__,
+                "feature_names": booster.feature_names,
+                "n_classes": int(getattr(model, "n_classes_", 0)) or None,
+                "boosted_rounds": booster.num_boosted_rounds(),
+                "source": source,
+                "metrics": metrics or {},
+            }
+            with open(os.path.join(staging, METADATA_FILE), "w") as outfile:
+                json.dump(metadata, outfile, indent=2)
+            os.rename(staging, self.path(version))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return metadata
+
+    def verify(self, version):
+        """Raise ValueError if the model file does not match its recorded checksum"""
+        metadata = self.metadata(version)
+        actual = file_sha256(self.path(version, metadata["file"]))
+        if actual != metadata["sha256"]:
+            raise ValueError(f"Checksum mismatch for model {version!r}: {actual} != {metadata['sha256']}")
+        return metadata
+
+    def load(self, version=None):
+        """Load a version (default: the current one) as an XGBClassifier"""
+        from xgboost import XGBClassifier
+
+        version = version or self.current()
+        if version is None:
+            raise ValueError(f"No model has been promoted in {self.root}")
+        metadata = self.verify(version)
+        model = XGBClassifier()
+        model.load_model(self.path(version, metadata["file"]))
+        return model
+
+    def current(self):
+        """Version named by CURRENT, or None if nothing was promoted"""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE), "r") as infile:
+                return infile.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def promote(self, version):
+        """Atomically point CURRENT at a verified version"""
+        self.verify(version)
+        tmp_path = os.path.join(self.root, f"{CURRENT_FILE}.tmp")
+        with open(tmp_path, "w") as outfile:
+            outfile.write(version + "\n")
+        os.replace(tmp_path, os.path.join(self.root, CURRENT_FILE))
+        with open(os.path.join(self.root, PROMOTIONS_FILE), "a") as outfile:
+            outfile.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')}\t{version}\n")
+
+    def promotions(self):
+        """Promoted versions in order, oldest first"""
+        try:
+            with open(os.path.join(self.root, PROMOTIONS_FILE), "r") as infile:
+                return [line.rstrip("\n").split("\t")[1] for line in infile if "\t" in line]
+        except FileNotFoundError:
+            return []
+
+    def rollback(self):
+        """Promote the version that was current before the present one"""
+        current = self.current()
+        previous = [version for version in self.promotions() if version != current]
+        if not previous:
+            raise ValueError("No earlier promoted version to roll back to")
+        self.promote(previous[-1])
+        return previous[-1]
+
+    def import_legacy(self, path, version, fmt="ubj", promote=False):
+        """Publish a joblib-pickled XGBClassifier in the native format"""
+        import joblib
+
+        metadata = self.publish(joblib.load(path), version, fmt=fmt, source=path)
+        if promote:
+            self.promote(version)
+        return metadata
+
+
+class ModelWatcher:
+    """Poll CURRENT and call on_change(version) when a new version is promoted"""
+
+    def __init__(self, model_registry, on_change, interval=10.0, current=None):
+        self.model_registry = model_registry
+        self.on_change = on_change
+        self.interval = interval
+        self.version = current
+        self.stats = {"checks": 0, "reloads": 0, "failures": 0}
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Reload once if CURRENT changed; returns True when a new version was applied"""
+        self.stats["checks"] += 1
+        version = self.model_registry.current()
+        if version is None or version == self.version:
+            return False
+        try:
+            self.on_change(version)
+        except Exception as e:
+            # Keep serving the old model; try again on the next poll
+            self.stats["failures"] += 1
+            self.last_error = repr(e)
+            return False
+        self.version = version
+        self.stats["reloads"] += 1
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry")
+    parser.add_argument("--root", default=os.getenv("SOIL_MODEL_DIR") or "models")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show versions and which one is current")
+    import_parser = commands.add_parser("import", help="convert a joblib model to the native format")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--version", required=True)
+    import_parser.add_argument("--format", choices=MODEL_FORMATS, default="ubj")
+    import_parser.add_argument("--promote", action="store_true")
+    promote_parser = commands.add_parser("promote", help="make a version current")
+    promote_parser.add_argument("version")
+    commands.add_parser("rollback", help="return to the previously promoted version")
+    args = parser.parse_args()
+
+    model_registry = ModelRegistry(args.root)
+    if args.command == "list":
+        current = model_registry.current()
+        for version in model_registry.versions():
+            metadata = model_registry.metadata(version)
+            accuracy = metadata["metrics"].get("test", {}).get("accuracy")
+            print(f"{'*' if version == current else ' '} {version:<24} {metadata['created']}  "
+                  f"{metadata['boosted_rounds']:>4} rounds  {metadata['size_bytes'] / 1024:>8.1f} KB"
+                  + (f"  accuracy {accuracy:.4f}" if accuracy is not None else ""))
+    elif args.command == "import":
+        model_registry.import_legacy(args.path, args.version, fmt=args.format, promote=args.promote)
+        print(f"Imported {args.path} as {args.version}")
+    elif args.command == "promote":
+        model_registry.promote(args.version)
+        print(f"{args.version} is now current")
+    else:
+        print(f"Rolled back to {model_registry.rollback()}")
@@ -0,0 +1,262 @@
+"""Instant rule-based soil report in English and Japanese
+
+Builds the same feedback PROMPT_TEMPLATE1 asks the LLM for. That is:
+congratulations and upkeep advice for Highly fertile soil, strengths and
+weaknesses for Fertile soil, and the limiting factors for Less fertile soil.
+It is built from agronomic ratings (common soil-test bands), the reading's
+position within the dataset1.csv distribution, and the model's drivers when
+present. It renders in well under a millisecond. The app shows it first,
+and it stands in for the LLM narrative when the LLM is slow or unavailable.
+"""
+import csv
+
+import numpy as np
+
+from soil import DRIVER_NAMES, FEATURE_COLUMNS
+
+# Column order of the model inputs and of data_json's values
+VARIABLES = FEATURE_COLUMNS
+# Names used in the drivers of data_json, mapped to VARIABLES
+DRIVER_ALIASES = dict(zip(DRIVER_NAMES, FEATURE_COLUMNS))
+
+UNITS = {"N": "kg/ha", "P": "kg/ha", "K": "kg/ha", "pH": "", "EC": "dS/m", "OC": "%",
+         "S": "ppm", "Zn": "ppm", "Fe": "ppm", "Cu": "ppm", "Mn": "ppm", "B": "ppm"}
+
+# (low below, high above) bands of common soil-test ratings for available nutrients
+NUTRIENT_BANDS = {
+    "N": (280, 560), "P": (10, 25), "K": (110, 280), "OC": (0.5, 0.75), "S": (10, 20),
+    "Zn": (0.6, 1.2), "Fe": (4.5, 9.0), "Cu": (0.2, 0.4), "Mn": (2.0, 4.0), "B": (0.5, 1.0),
+}
+PH_ACIDIC, PH_SLIGHTLY_ALKALINE, PH_STRONGLY_ALKALINE = 6.0, 7.5, 8.5
+EC_CAUTION, EC_SALINE = 1.0, 2.0
+
+TEXT = {
+    "English": {
+        "title": "### 🌱 Soil report: {status}",
+        "intro_highly_fertile": "🎉 Excellent news! This soil is highly fertile and well suited to crops and plantations.",
+        "intro_fertile": "This soil is fertile. Its strengths and the factors that could still improve are below.",
+        "intro_less_fertile": "This soil is currently less fertile. These are the factors holding it back and how to fix them.",
+        "strengths": "**Strengths**",
+        "weaknesses": "**Needs attention**",
+        "limiting": "**Limiting factors**",
+        "recommendations": "**Recommendations**",
+        "maintain": "**Keep it fertile**",
+        "percentile": "higher than {pct}% of reference samples",
+        "ratings": {"low": "low", "medium": "medium", "high": "high", "acidic": "acidic", "suitable": "suitable",
+                    "slightly_alkaline": "slightly alkaline", "strongly_alkaline": "strongly alkaline",
+                    "normal": "normal", "caution": "slightly saline", "saline": "saline"},
+        "names": {"N": "Nitrogen (N)", "P": "Phosphorus (P)", "K": "Potassium (K)", "pH": "pH",
+                  "EC": "Electrical conductivity (EC)", "OC": "Organic carbon (OC)", "S": "Sulfur (S)",
+                  "Zn": "Zinc (Zn)", "Fe": "Iron (Fe)", "Cu": "Copper (Cu)", "Mn": "Manganese (Mn)", "B": "Boron (B)"},
+        "remedies": {
+            "N": "Apply nitrogen in split doses (urea or ammonium sulphate) and grow legumes or green manure in the rotation.",
+            "P": "Apply a phosphate fertilizer such as DAP or single super phosphate at sowing, placed near the roots.",
+            "K": "Apply muriate of potash and return crop residues to the field.",
+            "OC": "Add farmyard manure or compost and leave crop residues on the field to build organic carbon.",
+            "S": "Use gypsum or single super phosphate, which also supply sulphur.",
+            "Zn": "Apply zinc sulphate to the soil (about 25 kg/ha) or as a foliar spray.",
+            "Fe": "Spray ferrous sulphate on the leaves; organic matter helps free iron in alkaline soil.",
+            "Cu": "Apply copper sulphate in small doses.",
+            "Mn": "Spray manganese sulphate on the leaves.",
+            "B": "Apply borax at a low rate (about 10 kg/ha); boron is harmful in excess.",
+            "pH_acidic": "Apply agricultural lime to raise the pH.",
+            "pH_alkaline": "Apply gypsum or elemental sulphur and add organic matter to bring the pH down.",
+            "EC": "Improve drainage and leach salts with good-quality irrigation water; avoid salty fertilizers.",
+            "reference": "Bring {name} closer to {value} {unit}, the median of fertile samples.",
+        },
+        "maintain_tips": [
+            "Keep rotating crops, including legumes.",
+            "Return crop residues or compost every season to hold organic carbon.",
+            "Test the soil each season and fertilize only to replace what crops remove.",
+        ],
+        "no_weakness": "No variable stands out as a problem.",
+        "validation_invalid": "⚠️ Possible sensor error: the value of {variables} cannot be right. "
+                              "Check the sensor before acting on this report.",
+        "validation_ood": "⚠️ This reading is unlike the samples the model was trained on ({variables}). "
+                          "Treat the result with caution.",
+        "unusual_combination": "an unusual combination of values",
+        "llm_skipped": "_The AI commentary was skipped for this reading._",
+    },
+    "Japanese": {
+        "title": "### 🌱 土壌レポート: {status}",
+        "intro_highly_fertile": "🎉 素晴らしい結果です！この土壌は非常に肥沃で、作物や植林に最適です。",
+        "intro_fertile": "この土壌は肥沃です。強みと、さらに改善できる要因は以下のとおりです。",
+        "intro_less_fertile": "この土壌は現在、肥沃度が低い状態です。原因となっている要因と改善方法は以下のとおりです。",
+        "strengths": "**強み**",
+        "weaknesses": "**注意が必要な項目**",
+        "limiting": "**制限要因**",
+        "recommendations": "**推奨事項**",
+        "maintain": "**肥沃度を保つために**",
+        "percentile": "参照サンプルの{pct}%より高い",
+        "ratings": {"low": "低い", "medium": "中程度", "high": "高い", "acidic": "酸性", "suitable": "適正",
+                    "slightly_alkaline": "弱アルカリ性", "strongly_alkaline": "強アルカリ性",
+                    "normal": "正常", "caution": "やや塩類集積", "saline": "塩類集積"},
+        "names": {"N": "窒素 (N)", "P": "リン (P)", "K": "カリウム (K)", "pH": "pH",
+                  "EC": "電気伝導度 (EC)", "OC": "有機炭素 (OC)", "S": "硫黄 (S)",
+                  "Zn": "亜鉛 (Zn)", "Fe": "鉄 (Fe)", "Cu": "銅 (Cu)", "Mn": "マンガン (Mn)", "B": "ホウ素 (B)"},
+        "remedies": {
+            "N": "窒素を分施し（尿素や硫酸アンモニウム）、輪作にマメ科作物や緑肥を取り入れてください。",
+            "P": "播種時にDAPや過リン酸石灰などのリン酸肥料を根の近くに施用してください。",
+            "K": "塩化カリを施用し、作物残渣を圃場に戻してください。",
+            "OC": "堆肥や厩肥を施用し、作物残渣を圃場に残して有機炭素を増やしてください。",
+            "S": "硫黄も供給できる石膏や過リン酸石灰を使用してください。",
+            "Zn": "硫酸亜鉛を土壌施用（約25 kg/ha）または葉面散布してください。",
+            "Fe": "硫酸第一鉄を葉面散布してください。アルカリ性土壌では有機物が鉄の可給化を助けます。",
+            "Cu": "硫酸銅を少量ずつ施用してください。",
+            "Mn": "硫酸マンガンを葉面散布してください。",
+            "B": "ホウ砂を少量（約10 kg/ha）施用してください。ホウ素は過剰になると有害です。",
+            "pH_acidic": "農業用石灰を施用してpHを上げてください。",
+            "pH_alkaline": "石膏や硫黄を施用し、有機物を加えてpHを下げてください。",
+            "EC": "排水を改善し、良質な灌漑水で塩類を洗い流してください。塩分の多い肥料は避けてください。",
+            "reference": "{name}を肥沃なサンプルの中央値である{value} {unit}に近づけてください。",
+        },
+        "maintain_tips": [
+            "マメ科作物を含む輪作を続けてください。",
+            "毎シーズン作物残渣や堆肥を戻し、有機炭素を維持してください。",
+            "毎シーズン土壌検査を行い、作物が吸収した分だけを施肥してください。",
+        ],
+        "no_weakness": "特に問題となる項目はありません。",
+        "validation_invalid": "⚠️ センサーの異常の可能性があります: {variables}の値はあり得ません。"
+                              "このレポートに基づいて対策する前にセンサーを確認してください。",
+        "validation_ood": "⚠️ この測定値はモデルの学習データとは異なります（{variables}）。結果は慎重に扱ってください。",
+        "unusual_combination": "値の組み合わせが通常と異なります",
+        "llm_skipped": "_この測定値についてはAIによる解説を省略しました。_",
+    },
+}
+
+STATUS_TEXT = {
+    "English": {"Less fertile": "Less fertile", "Fertile": "Fertile", "Highly fertile": "Highly fertile"},
+    "Japanese": {"Less fertile": "低肥沃度", "Fertile": "肥沃", "Highly fertile": "高肥沃度"},
+}
+
+
+def read_reference(path):
+    """(values in VARIABLES order, labels) of a CSV in the dataset1.csv layout"""
+    with open(path, newline="") as infile:
+        reader = csv.reader(infile)
+        header = next(reader)
+        rows = np.array([[float(cell) for cell in row] for row in reader if row])
+    columns = [header.index(name) for name in VARIABLES]
+    return rows[:, columns], rows[:, header.index("Output")].astype(int)
+
+
+class ReferenceStats:
+    """Per-variable distribution of the training data, overall and for fertile samples"""
+
+    def __init__(self, values, labels):
+        self.sorted_values = np.sort(values, axis=0)
+        # Median of the samples labelled Fertile or Highly fertile
+        fertile = values[labels >= 1] if np.any(labels >= 1) else values
+        self.fertile_median = np.median(fertile, axis=0)
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(*read_reference(path))
+
+    def percentile(self, i, value):
+        """Share (0-100) of reference samples below value for variable i"""
+        column = self.sorted_values[:, i]
+        return int(round(100 * np.searchsorted(column, value, side="left") / len(column)))
+
+
+def rate(variable, value):
+    """Agronomic rating key for one variable's value"""
+    if variable == "pH":
+        if value < PH_ACIDIC:
+            return "acidic"
+        if value > PH_STRONGLY_ALKALINE:
+            return "strongly_alkaline"
+        return "slightly_alkaline" if value > PH_SLIGHTLY_ALKALINE else "suitable"
+    if variable == "EC":
+        return "saline" if value > EC_SALINE else "caution" if value > EC_CAUTION else "normal"
+    low, high = NUTRIENT_BANDS[variable]
+    return "low" if value < low else "high" if value > high else "medium"
+
+
+def problem_severity(variable, value):
+    """How far outside its acceptable range a value is (0 when it is fine)"""
+    if variable == "pH":
+        return max(PH_ACIDIC - value, value - PH_STRONGLY_ALKALINE, 0.0)
+    if variable == "EC":
+        return max(value - EC_CAUTION, 0.0) / EC_CAUTION
+    low = NUTRIENT_BANDS[variable][0]
+    return max(low - value, 0.0) / low
+
+
+def remedy(variable, value, text, stats):
+    """Recommendation for a weak variable"""
+    remedies = text["remedies"]
+    if variable == "pH":
+        if value < PH_ACIDIC:
+            return remedies["pH_acidic"]
+        if value > PH_SLIGHTLY_ALKALINE:
+            return remedies["pH_alkaline"]
+    elif problem_severity(variable, value) > 0:
+        return remedies[variable]
+    # Flagged by the model rather than by a threshold
+    target = stats.fertile_median[VARIABLES.index(variable)]
+    return remedies["reference"].format(name=text["names"][variable], value=f"{target:g}", unit=UNITS[variable])
+
+
+def describe(variable, value, text, stats):
+    i = VARIABLES.index(variable)
+    unit = f" {UNITS[variable]}" if UNITS[variable] else ""
+    rating = text["ratings"][rate(variable, value)]
+    pct = text["percentile"].format(pct=stats.percentile(i, value))
+    return f"- {text['names'][variable]}: {value:g}{unit} — {rating}; {pct}"
+
+
+def validation_notice(validation, text):
+    """Warning line for a reading that failed validation.py's checks"""
+    variables = ", ".join(validation.get("variables") or []) or text["unusual_combination"]
+    key = "validation_invalid" if validation["result"] == "invalid" else "validation_ood"
+    notice = text[key].format(variables=variables)
+    if validation.get("llm") == "skipped":
+        notice += "\n\n" + text["llm_skipped"]
+    return notice
+
+
+def generate_report(data_json, stats, language="English", max_items=4):
+    """Markdown report for a get_data_JSON result"""
+    text = TEXT.get(language, TEXT["English"])
+    status = data_json["status"]
+    values = dict(zip(VARIABLES, [float(value) for key, value in data_json.items()
+                                  if key not in ("status", "drivers", "validation")]))
+    drivers = data_json.get("drivers") or {}
+    raising = [DRIVER_ALIASES.get(name, name) for name in drivers.get("raising_fertility", {})]
+    lowering = [DRIVER_ALIASES.get(name, name) for name in drivers.get("lowering_fertility", {})]
+
+    # Threshold problems first (worst first), then what the model says lowers fertility
+    problems = sorted((v for v in VARIABLES if problem_severity(v, values[v]) > 0),
+                      key=lambda v: -problem_severity(v, values[v]))
+    weak = list(dict.fromkeys(problems + lowering))[:max_items]
+    adequate = [v for v in VARIABLES if rate(v, values[v]) in ("medium", "high", "suitable", "normal")]
+    strong = [v for v in dict.fromkeys(raising + adequate)
+              if v not in weak and problem_severity(v, values[v]) == 0][:max_items]
+
+    lines = [text["title"].format(status=STATUS_TEXT.get(language, STATUS_TEXT["English"]).get(status, status)), ""]
+    validation = data_json.get("validation")
+    if validation:
+        lines += [validation_notice(validation, text), ""]
+    if status == "Highly fertile":
+        lines += [text["intro_highly_fertile"], "", text["strengths"]]
+        lines += [describe(v, values[v], text, stats) for v in strong]
+        lines += ["", text["maintain"]] + [f"- {tip}" for tip in text["maintain_tips"]]
+        if problems:
+            lines += ["", text["weaknesses"]] + [describe(v, values[v], text, stats) for v in problems[:2]]
+            lines += [f"- {remedy(v, values[v], text, stats)}" for v in problems[:2]]
+        return "\n".join(lines)
+
+    if status == "Fertile":
+        lines += [text["intro_fertile"], "", text["strengths"]]
+        lines += [describe(v, values[v], text, stats) for v in strong]
+        lines += ["", text["weaknesses"]]
+    else:
+        lines += [text["intro_less_fertile"], "", text["limiting"]]
+    if weak:
+        lines += [describe(v, values[v], text, stats) for v in weak]
+        lines += ["", text["recommendations"]]
+        lines += [f"- {remedy(v, values[v], text, stats)}" for v in dict.fromkeys(weak)]
+    else:
+        lines.append(text["no_weakness"])
+    return "\n".join(lines)
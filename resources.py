@@ -0,0 +1,143 @@
+"""Lazily created shared resources (model, LLM client, chains) with startup timing
+
+Heavy objects are registered as factories and only built on first access, or
+warmed in a background thread so the Streamlit UI can draw its first frame
+while they load. Every import and initialization step is timed, and the
+collected timings form the startup report.
+
+Run this file directly to measure a cold start:
+
+    python resources.py [--max-seconds 20]
+"""
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ResourceRegistry:
+    """Thread-safe registry of named, lazily built resources"""
+
+    def __init__(self):
+        self._factories = {}
+        self._values = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._warm_thread = None
+        self.timings = []
+
+    def register(self, name, factory):
+        """Register a zero-argument factory that builds the named resource"""
+        with self._lock:
+            self._factories[name] = factory
+            self._locks[name] = threading.Lock()
+
+    def get(self, name):
+        """Return the resource, building it on first use"""
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        if name not in self._factories:
+            raise KeyError(f"Unknown resource: {name}")
+        with self._locks[name]:
+            # Another thread may have finished building it while we waited
+            if name not in self._values:
+                with self.timed(f"init {name}"):
+                    value = self._factories[name]()
+                self.set(name, value)
+        return self._values[name]
+
+    def get_many(self, names):
+        """List of several resources taken from one snapshot, never mixing two set_many() calls"""
+        for name in names:
+            self.get(name)
+        values = self._values
+        return [values[name] for name in names]
+
+    def set(self, name, value):
+        """Replace a resource; readers see either the old or the new object"""
+        self.set_many({name: value})
+
+    def set_many(self, values):
+        """Replace several resources in one step"""
+        with self._lock:
+            # A new dict rather than updates in place, so a snapshot is all old or all new
+            self._values = {**self._values, **values}
+
+    def is_registered(self, name):
+        return name in self._factories
+
+    def is_loaded(self, name):
+        return name in self._values
+
+    def warm(self, names=None, background=True):
+        """Build resources ahead of first use, by default in a daemon thread"""
+        names = list(self._factories) if names is None else list(names)
+
+        def load_all():
+            for name in names:
+                self.get(name)
+
+        if not background:
+            load_all()
+            return None
+        with self._lock:
+            if self._warm_thread is None or not self._warm_thread.is_alive():
+                if not all(self.is_loaded(name) for name in names):
+                    self._warm_thread = threading.Thread(
+                        target=load_all, name="resource-warmup", daemon=True
+                    )
+                    self._warm_thread.start()
+        return self._warm_thread
+
+    @contextmanager
+    def timed(self, step):
+        """Record the wall time of a startup step"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((step, time.perf_counter() - start))
+
+    def timed_import(self, module_name):
+        """Import a module and record how long it took"""
+        with self.timed(f"import {module_name}"):
+            return importlib.import_module(module_name)
+
+    def report(self):
+        """Format the recorded startup steps as a text table"""
+        width = max([len(step) for step, _ in self.timings] + [10])
+        lines = [f"{'step':<{width}}  seconds"]
+        for step, seconds in self.timings:
+            lines.append(f"{step:<{width}}  {seconds:7.3f}")
+        return "\n".join(lines)
+
+
+# Shared registry used by soil.py and infer.py
+registry = ResourceRegistry()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Measure cold-start time of the soil analysis backend")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="exit with status 1 if the total startup time exceeds this budget")
+    args = parser.parse_args()
+
+    # Use the registry instance that soil.py imports, not this __main__ copy
+    from resources import registry
+
+    start = time.perf_counter()
+    with registry.timed("import infer"):
+        import infer  # noqa: F401
+    registry.warm(background=False)
+    total = time.perf_counter() - start
+
+    print(registry.report())
+    print(f"total cold start: {total:.3f} s")
+    if args.max_seconds is not None and total > args.max_seconds:
+        print(f"startup exceeded budget of {args.max_seconds:.3f} s")
+        sys.exit(1)
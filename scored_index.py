@@ -0,0 +1,110 @@
+"""Precomputed predictions for every reading in a SensorStore
+
+The index keeps a class label, class probabilities and the model version for
+each stored reading. It is aligned with the store's sorted timestamps and
+saved as .npy files in a scores/ folder next to the store's own arrays.
+refresh() scores only the readings it has not seen, matched by timestamp
+and a digest of the values, so a corrected reading is rescored.
+When the model version changes, it rescores everything in one batched pass.
+"""
+import json
+import os
+
+import numpy as np
+
+from soil import STATUS_LABELS
+
+
+class ScoredIndex:
+    """Labels, probabilities and model version aligned with a store's readings"""
+
+    def __init__(self, timestamps, labels, proba, model_version, digests=None):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        # row_digests() of the scored values; without them nothing is reused
+        self.digests = None if digests is None else np.asarray(digests, dtype=np.uint64)
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.proba = np.asarray(proba, dtype=np.float32)
+        self.model_version = model_version
+        # The store this index was last aligned with
+        self.store = None
+
+    @classmethod
+    def empty(cls, model_version=None):
+        return cls(np.empty(0, np.int64), np.empty(0, np.int8), np.empty((0, len(STATUS_LABELS)), np.float32),
+                   model_version, np.empty(0, np.uint64))
+
+    @classmethod
+    def open(cls, directory):
+        """Load a saved index, or None if there is none"""
+        try:
+            with open(os.path.join(directory, "meta.json"), "r") as infile:
+                meta = json.load(infile)
+            return cls(np.load(os.path.join(directory, "timestamps.npy"), mmap_mode="r"),
+                       np.load(os.path.join(directory, "labels.npy"), mmap_mode="r"),
+                       np.load(os.path.join(directory, "proba.npy"), mmap_mode="r"),
+                       meta["model_version"],
+                       np.load(os.path.join(directory, "digests.npy"), mmap_mode="r"))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name, array in (("timestamps", self.timestamps), ("labels", self.labels), ("proba", self.proba),
+                            ("digests", self.digests)):
+            # Replace rather than overwrite: an older index may still have the file memory-mapped
+            tmp_path = os.path.join(directory, f"{name}.tmp.npy")
+            np.save(tmp_path, np.ascontiguousarray(array))
+            os.replace(tmp_path, os.path.join(directory, f"{name}.npy"))
+        tmp_path = os.path.join(directory, "meta.tmp.json")
+        with open(tmp_path, "w") as outfile:
+            json.dump({"model_version": self.model_version, "count": len(self)}, outfile)
+        os.replace(tmp_path, os.path.join(directory, "meta.json"))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def is_current(self, store, model_version):
+        return self.store is store and self.model_version == model_version
+
+    def refresh(self, store, get_model, model_version, batch_size=65536):
+        """Return an index aligned with store, scoring only new readings; second value is the number scored
+
+        get_model() is only called when something needs scoring.
+        """
+        if self.model_version == model_version and len(self) and self.digests is not None:
+            # Readings already scored by this model keep their results, unless their values changed
+            positions = np.searchsorted(self.timestamps, store.timestamps)
+            positions = np.minimum(positions, len(self) - 1)
+            known = (self.timestamps[positions] == store.timestamps) & (self.digests[positions] == store.digests)
+        else:
+            positions = np.zeros(len(store), dtype=np.intp)
+            known = np.zeros(len(store), dtype=bool)
+
+        labels = np.empty(len(store), dtype=np.int8)
+        proba = np.empty((len(store), len(STATUS_LABELS)), dtype=np.float32)
+        labels[known] = self.labels[positions[known]]
+        proba[known] = self.proba[positions[known]]
+        missing = np.flatnonzero(~known)
+        model = get_model() if len(missing) else None
+        for start in range(0, len(missing), batch_size):
+            rows = missing[start:start + batch_size]
+            block = np.asarray(model.predict_proba(store.values[rows]), dtype=np.float32)
+            proba[rows] = block
+            labels[rows] = block.argmax(axis=1)
+
+        index = ScoredIndex(store.timestamps, labels, proba, model_version, store.digests)
+        index.store = store
+        return index, len(missing)
+
+    def status(self, index):
+        """Fertility status string of the reading at a store position"""
+        return str(STATUS_LABELS[min(int(self.labels[index]), len(STATUS_LABELS) - 1)])
+
+    def lookup(self, index):
+        """(label, status, probabilities) of the reading at a store position"""
+        return int(self.labels[index]), self.status(index), self.proba[index].tolist()
+
+    def status_counts(self):
+        """Number of stored readings per fertility status"""
+        counts = np.bincount(self.labels, minlength=len(STATUS_LABELS))
+        return {str(status): int(count) for status, count in zip(STATUS_LABELS, counts)}
@@ -0,0 +1,257 @@
+"""Parallel hyperparameter search for the soil fertility model
+
+Searches depth, number of trees, learning rate and class weighting. Each
+candidate is cross-validated on the training split from train.py (the test
+split is never seen) and runs in its own process. The CV folds are built
+once, including the SMOTE resampling, and saved as .npy files under
+.cache/search_folds/. Workers open them memory-mapped instead of receiving
+copies. Each candidate is scored on three things:
+
+    accuracy      mean CV accuracy (log loss is kept as a tie-breaker)
+    latency       median single-reading predict_proba time of the compiled trees,
+                  measured one candidate at a time after the pool has finished
+    size          serialized booster size in bytes
+
+The Pareto-optimal candidates are printed and written to search_results.json.
+The chosen trade-off is the fastest Pareto candidate whose accuracy is within
+--tolerance of the best. --export trains it with train.py as a model version:
+
+    python search.py --workers 8
+    python search.py --max-depth 2 3 4 --n-estimators 50 100 --export --promote
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import train
+
+FOLD_ARRAYS = ("X_train", "y_train", "X_val", "y_val")
+
+
+def fold_cache_dir(args, X, y):
+    """Cache folder keyed by the data and every setting that changes the folds"""
+    digest = hashlib.sha256()
+    digest.update(X.tobytes())
+    digest.update(y.tobytes())
+    digest.update(f"{args.folds}:{args.seed}:{args.test_size}".encode())
+    return os.path.join(args.cache_dir, digest.hexdigest()[:16])
+
+
+def prepare_folds(args):
+    """Write raw and SMOTE-resampled CV folds once; returns the cache folder"""
+    from sklearn.model_selection import StratifiedKFold, train_test_split
+
+    X, y = train.read_dataset(args.data)
+    X_train, _, y_train, _ = train_test_split(X, y, test_size=args.test_size, random_state=args.seed, stratify=y)
+    cache_dir = fold_cache_dir(args, X, y)
+    if os.path.exists(os.path.join(cache_dir, "done")):
+        return cache_dir
+
+    folds = StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=args.seed)
+    for i, (train_index, val_index) in enumerate(folds.split(X_train, y_train)):
+        X_fit, y_fit = X_train[train_index], y_train[train_index]
+        variants = {"raw": (X_fit, y_fit), "smote": train.oversample(X_fit, y_fit, args.seed)}
+        for variant, (X_part, y_part) in variants.items():
+            arrays = {"X_train": X_part, "y_train": y_part,
+                      "X_val": X_train[val_index], "y_val": y_train[val_index]}
+            fold_dir = os.path.join(cache_dir, f"fold{i}", variant)
+            os.makedirs(fold_dir, exist_ok=True)
+            for name in FOLD_ARRAYS:
+                np.save(os.path.join(fold_dir, f"{name}.npy"), np.ascontiguousarray(arrays[name]))
+    # Written last, so an interrupted run rebuilds the folds
+    open(os.path.join(cache_dir, "done"), "w").close()
+    return cache_dir
+
+
+def load_fold(cache_dir, fold, variant):
+    fold_dir = os.path.join(cache_dir, f"fold{fold}", variant)
+    return [np.load(os.path.join(fold_dir, f"{name}.npy"), mmap_mode="r") for name in FOLD_ARRAYS]
+
+
+def candidate_grid(args):
+    """Every combination of the searched parameters"""
+    keys = ("max_depth", "n_estimators", "learning_rate", "class_weight")
+    values = (args.max_depth, args.n_estimators, args.learning_rate, args.class_weight)
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+def inference_latency_ms(model, rows, repeat=200):
+    """Median time for one single-reading predict_proba of the compiled trees"""
+    import trees
+
+    compiled = trees.compile_model(model)
+    samples = []
+    for i in range(repeat):
+        row = rows[i % len(rows)][None, :]
+        start = time.perf_counter()
+        compiled.predict_proba(row)
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples) * 1000)
+
+
+def evaluate_candidate(cache_dir, folds, params, seed, threads):
+    """Cross-validate one candidate (runs in a worker process)"""
+    from sklearn.metrics import accuracy_score, log_loss
+    from xgboost import XGBClassifier
+
+    # balanced class weights replace SMOTE; otherwise train on the SMOTE folds
+    variant = "raw" if params["class_weight"] == "balanced" else "smote"
+    accuracies, losses, fit_seconds = [], [], []
+    model = X_val = None
+    for fold in range(folds):
+        X_fit, y_fit, X_val, y_val = load_fold(cache_dir, fold, variant)
+        model = XGBClassifier(objective="multi:softprob", tree_method="hist", n_jobs=threads, random_state=seed,
+                              max_depth=params["max_depth"], n_estimators=params["n_estimators"],
+                              learning_rate=params["learning_rate"])
+        sample_weight = train.class_weights(np.asarray(y_fit)) if variant == "raw" else None
+        start = time.perf_counter()
+        model.fit(X_fit, y_fit, sample_weight=sample_weight)
+        fit_seconds.append(time.perf_counter() - start)
+        proba = model.predict_proba(X_val)
+        accuracies.append(accuracy_score(y_val, proba.argmax(axis=1)))
+        losses.append(log_loss(y_val, proba, labels=list(range(proba.shape[1]))))
+
+    booster = model.get_booster()
+    booster.feature_names = list(train.FEATURE_COLUMNS)
+    raw = booster.save_raw("ubj")
+    # Latency is timed by the parent: here the other workers would still be training
+    return {
+        "params": params,
+        "accuracy": float(np.mean(accuracies)),
+        "accuracy_std": float(np.std(accuracies)),
+        "log_loss": float(np.mean(losses)),
+        "size_bytes": len(raw),
+        "fit_seconds": float(np.mean(fit_seconds)),
+    }, bytes(raw)
+
+
+def measure_latency(results, boosters, cache_dir, folds):
+    """Time every candidate's compiled trees one after another, on an otherwise idle machine"""
+    from xgboost import Booster
+
+    rows = np.asarray(load_fold(cache_dir, folds - 1, "raw")[2], dtype=np.float64)
+    for result, raw in zip(results, boosters):
+        booster = Booster()
+        booster.load_model(bytearray(raw))
+        result["latency_ms"] = inference_latency_ms(booster, rows)
+
+
+def dominates(a, b):
+    """a is at least as good as b on every objective and better on one"""
+    no_worse = a["accuracy"] >= b["accuracy"] and a["latency_ms"] <= b["latency_ms"] and a["size_bytes"] <= b["size_bytes"]
+    better = a["accuracy"] > b["accuracy"] or a["latency_ms"] < b["latency_ms"] or a["size_bytes"] < b["size_bytes"]
+    return no_worse and better
+
+
+def pareto_front(results):
+    front = [r for r in results if not any(dominates(other, r) for other in results)]
+    return sorted(front, key=lambda r: (-r["accuracy"], r["latency_ms"]))
+
+
+def choose(front, tolerance):
+    """Fastest (then smallest) Pareto candidate within tolerance of the best accuracy"""
+    best_accuracy = max(r["accuracy"] for r in front)
+    eligible = [r for r in front if r["accuracy"] >= best_accuracy - tolerance]
+    return min(eligible, key=lambda r: (r["latency_ms"], r["size_bytes"], -r["accuracy"]))
+
+
+def run_search(args):
+    started = time.perf_counter()
+    cache_dir = prepare_folds(args)
+    prepared = time.perf_counter() - started
+    candidates = candidate_grid(args)
+    workers = args.workers or os.cpu_count() or 1
+    print(f"{len(candidates)} candidates, {args.folds} folds, {workers} workers (folds in {cache_dir})")
+
+    results, boosters = [], []
+    # spawn: xgboost's thread pool does not survive fork reliably
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(evaluate_candidate, cache_dir, args.folds, params, args.seed, args.threads)
+                   for params in candidates]
+        for future in as_completed(futures):
+            result, raw = future.result()
+            results.append(result)
+            boosters.append(raw)
+    measure_latency(results, boosters, cache_dir, args.folds)
+    front = pareto_front(results)
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "data": args.data,
+        "folds": args.folds,
+        "seed": args.seed,
+        "fold_prepare_seconds": round(prepared, 3),
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "results": sorted(results, key=lambda r: -r["accuracy"]),
+        "pareto": front,
+        "chosen": choose(front, args.tolerance),
+        "tolerance": args.tolerance,
+    }
+
+
+def print_report(report):
+    print(f"\nPareto front ({len(report['pareto'])} of {len(report['results'])} candidates, "
+          f"{report['wall_seconds']:.1f} s):")
+    print(f"  {'depth':>5} {'trees':>6} {'lr':>6} {'weight':>9} {'accuracy':>9} {'latency ms':>11} {'size KB':>8}")
+    for r in report["pareto"]:
+        p = r["params"]
+        mark = "  <- chosen" if r is report["chosen"] else ""
+        print(f"  {p['max_depth']:>5} {p['n_estimators']:>6} {p['learning_rate']:>6} {p['class_weight']:>9} "
+              f"{r['accuracy']:>9.4f} {r['latency_ms']:>11.3f} {r['size_bytes'] / 1024:>8.1f}{mark}")
+
+
+def export(report, args):
+    """Train the chosen candidate on the full training split as a model version"""
+    p = report["chosen"]["params"]
+    argv = ["--data", *args.data, "--out", args.out, "--seed", str(args.seed), "--test-size", str(args.test_size),
+            "--max-depth", str(p["max_depth"]), "--n-estimators", str(p["n_estimators"]),
+            "--learning-rate", str(p["learning_rate"]), "--class-weight", p["class_weight"],
+            "--early-stopping-rounds", "0"]
+    if p["class_weight"] == "balanced":
+        argv.append("--no-smote")
+    if args.version:
+        argv += ["--version", args.version]
+    if args.promote:
+        argv.append("--promote")
+    return train.main(argv)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search XGBoost hyperparameters for accuracy, latency and size")
+    parser.add_argument("--data", nargs="+", default=["dataset1.csv"])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--max-depth", type=int, nargs="+", default=[2, 3, 4, 6])
+    parser.add_argument("--n-estimators", type=int, nargs="+", default=[50, 100, 200, 300])
+    parser.add_argument("--learning-rate", type=float, nargs="+", default=[0.05, 0.1, 0.3])
+    parser.add_argument("--class-weight", nargs="+", choices=["none", "balanced"], default=["none", "balanced"])
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--threads", type=int, default=1, help="xgboost threads per worker")
+    parser.add_argument("--tolerance", type=float, default=0.005, help="accuracy given up for a faster model")
+    parser.add_argument("--cache-dir", default=os.path.join(".cache", "search_folds"))
+    parser.add_argument("--results", default="search_results.json")
+    parser.add_argument("--export", action="store_true", help="train the chosen candidate with train.py")
+    parser.add_argument("--out", default=os.getenv("SOIL_MODEL_DIR") or "models")
+    parser.add_argument("--version", default=None)
+    parser.add_argument("--promote", action="store_true", help="with --export, make it the current model")
+    args = parser.parse_args()
+
+    report = run_search(args)
+    print_report(report)
+    with open(args.results, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    print(f"\nWrote {args.results}")
+    if args.export:
+        export(report, args)
+
+
+if __name__ == "__main__":
+    main()
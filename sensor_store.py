@@ -0,0 +1,136 @@
+"""Columnar store for timestamped sensor readings
+
+Readings live in one contiguous (n, 12) float array next to a sorted int64
+timestamp index (seconds since the epoch). Both arrays are saved as .npy files
+and opened memory-mapped, so large archives load without parsing JSON.
+"""
+import json
+import os
+import random
+import numpy as np
+
+
+def parse_timestamps(timestamps):
+    """Convert "YYYY-mm-dd HH:MM:SS" strings to int64 epoch seconds"""
+    return np.array(timestamps, dtype="datetime64[s]").astype(np.int64)
+
+
+def row_digests(values):
+    """64-bit FNV-1a hash of each row's float64 values, to tell corrected readings apart"""
+    bits = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64).reshape(len(values), -1)
+    digests = np.full(len(bits), 0xCBF29CE484222325, dtype=np.uint64)
+    for column in bits.T:
+        digests = (digests ^ column) * np.uint64(0x100000001B3)
+    return digests
+
+
+def format_timestamps(seconds):
+    """Convert epoch seconds back to "YYYY-mm-dd HH:MM:SS" strings"""
+    as_datetime = np.asarray(seconds, dtype=np.int64).astype("datetime64[s]")
+    return [t.replace("T", " ") for t in np.datetime_as_string(as_datetime, unit="s")]
+
+
+class SensorStore:
+    """Sensor readings sorted by timestamp, backed by NumPy arrays"""
+
+    def __init__(self, timestamps, values):
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim != 2 or len(values) != len(timestamps):
+            raise ValueError("values must be an (n, features) array with one row per timestamp")
+        if len(timestamps) > 1 and np.any(np.diff(timestamps) < 0):
+            order = np.argsort(timestamps, kind="stable")
+            timestamps, values = timestamps[order], values[order]
+        self.timestamps = timestamps
+        self.values = values
+        self._digests = None
+
+    @classmethod
+    def from_json(cls, path):
+        """Build a store from a {timestamp: [12 values]} JSON file"""
+        with open(path, "r") as infile:
+            data = json.load(infile)
+        if not data:
+            return cls(np.empty(0, dtype=np.int64), np.empty((0, 12)))
+        return cls(parse_timestamps(list(data.keys())), np.array(list(data.values()), dtype=np.float64))
+
+    @classmethod
+    def open(cls, directory, mmap=True):
+        """Open a store written by save(), memory-mapped by default"""
+        mode = "r" if mmap else None
+        return cls(
+            np.load(os.path.join(directory, "timestamps.npy"), mmap_mode=mode),
+            np.load(os.path.join(directory, "values.npy"), mmap_mode=mode),
+        )
+
+    def save(self, directory):
+        """Write the arrays as .npy files"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "timestamps.npy"), np.ascontiguousarray(self.timestamps))
+        np.save(os.path.join(directory, "values.npy"), np.ascontiguousarray(self.values))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def digests(self):
+        """row_digests() of every reading, computed on first use"""
+        if self._digests is None:
+            self._digests = row_digests(self.values)
+        return self._digests
+
+    def timestamp(self, index):
+        """Timestamp string of the reading at index"""
+        return format_timestamps(self.timestamps[index:index + 1])[0]
+
+    def index_of(self, timestamp):
+        """Position of the reading with this exact timestamp string"""
+        seconds = parse_timestamps([timestamp])[0]
+        index = int(np.searchsorted(self.timestamps, seconds))
+        if index == len(self) or self.timestamps[index] != seconds:
+            raise KeyError(timestamp)
+        return index
+
+    def reading(self, index):
+        """The 12 values of one reading as a list of floats"""
+        return self.values[index].tolist()
+
+    def sample(self, k, rng=random):
+        """Indices of k distinct random readings, in random order
+
+        Uses Floyd's algorithm, so the cost is O(k) regardless of store size.
+        """
+        n = len(self)
+        k = min(k, n)
+        chosen = {}
+        for j in range(n - k, n):
+            t = rng.randint(0, j)
+            chosen[j if t in chosen else t] = None
+        indices = list(chosen)
+        rng.shuffle(indices)
+        return np.array(indices, dtype=np.intp)
+
+    def range(self, start=None, end=None):
+        """Slice of readings with start <= timestamp < end (strings, either optional)"""
+        lo = 0 if start is None else int(np.searchsorted(self.timestamps, parse_timestamps([start])[0], "left"))
+        hi = len(self) if end is None else int(np.searchsorted(self.timestamps, parse_timestamps([end])[0], "left"))
+        return slice(lo, max(lo, hi))
+
+    def latest(self, n):
+        """Indices of the n most recent readings, newest first"""
+        n = min(n, len(self))
+        return np.arange(len(self) - 1, len(self) - 1 - n, -1, dtype=np.intp)
+
+
+def load_store(json_path, cache_dir):
+    """Open the cached store for json_path, rebuilding it if the JSON is newer"""
+    values_path = os.path.join(cache_dir, "values.npy")
+    if os.path.exists(values_path) and os.path.getmtime(values_path) >= os.path.getmtime(json_path):
+        return SensorStore.open(cache_dir)
+    store = SensorStore.from_json(json_path)
+    try:
+        store.save(cache_dir)
+    except OSError:
+        # A read-only deployment can still serve from memory
+        pass
+    return store
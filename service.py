@@ -0,0 +1,389 @@
+"""Headless HTTP service for scoring, analysis and chat
+
+Serves the model and chains from soil.py/infer.py over asyncio (aiohttp) for
+gateways and dashboards. No Streamlit is involved:
+
+    POST /predict   {"readings": [[12 values], ...], "drivers": false}
+                    -> {"model_version", "predictions": [{"label", "status", "probabilities"[, "drivers"]}]}
+    POST /analyze   {"reading": [12 values], "language": "English", "narrative": true}
+                    -> {"status", "report", "narrative", "explanation", "data", "error"}
+                    (422 when the validation policy rejects the reading)
+    POST /chat      {"message", "history": [{"role", "content"}], "analysis": {data from /analyze}, "language"}
+                    -> {"response", "prompt_tokens"}
+    GET  /health    model version, queue depth and batcher counters
+    GET  /drift     drift of the scored readings against the training data (drift.py)
+    GET  /metrics   Prometheus text (metrics.py)
+
+The model stays loaded for the life of the process and follows hot reloads
+(model_registry.py). Concurrent /predict and /analyze requests are
+micro-batched: rows arriving within SOIL_PREDICT_BATCH_WAIT_MS are scored
+together in one model call of up to SOIL_PREDICT_BATCH rows. Requests beyond
+SOIL_SERVICE_MAX_INFLIGHT are refused with 503.
+
+    python service.py --port 8080
+    curl -s localhost:8080/predict -d '{"readings": [[138, 8.6, 560, 7.46, 0.62, 0.7, 5.9, 0.24, 0.31, 0.77, 8.71, 11.36]]}'
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from aiohttp import web
+
+import infer
+import soil
+from chat_context import ChatContext
+from explain import top_drivers
+from metrics import metrics
+from resources import registry
+from soil import DRIVER_NAMES, FEATURE_KEYS, STATUS_LABELS
+from validation import VALIDATION_POLICY, InvalidReading
+
+SERVICE_PORT = int(os.getenv("SOIL_SERVICE_PORT", "8080"))
+PREDICT_BATCH = int(os.getenv("SOIL_PREDICT_BATCH", "256"))
+PREDICT_BATCH_WAIT = float(os.getenv("SOIL_PREDICT_BATCH_WAIT_MS", "2")) / 1000
+MAX_INFLIGHT = int(os.getenv("SOIL_SERVICE_MAX_INFLIGHT", "256"))
+
+QUEUE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class MicroBatcher:
+    """Combines rows from concurrent requests into one predict call
+
+    submit() queues a request's rows and waits. A single worker task takes the
+    queued requests until max_batch rows are collected or max_wait has passed
+    since the first one. It then scores them in one call on a worker thread,
+    so the event loop keeps accepting requests meanwhile.
+    """
+
+    def __init__(self, score, max_batch=PREDICT_BATCH, max_wait=PREDICT_BATCH_WAIT):
+        # score(X) -> one result per row of X
+        self.score = score
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = None
+        self.pending_rows = 0
+        self._worker = None
+        self.stats = {"requests": 0, "rows": 0, "batches": 0, "largest_batch": 0}
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, X):
+        """Results for the rows of X, scored together with other waiting requests"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending_rows += len(X)
+        await self.queue.put((X, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            rows = len(items[0][0])
+            deadline = loop.time() + self.max_wait
+            while rows < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                rows += len(item[0])
+            self.pending_rows -= rows
+            X = np.concatenate([item[0] for item in items])
+            try:
+                with metrics.span("predict_batch"):
+                    results = await loop.run_in_executor(None, self.score, X)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.stats["requests"] += len(items)
+            self.stats["rows"] += rows
+            self.stats["batches"] += 1
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], rows)
+            metrics.observe("soil_service_batch_rows", rows, buckets=QUEUE_BUCKETS,
+                            help_text="Rows scored per micro-batch")
+            start = 0
+            for X_part, future in items:
+                if not future.done():
+                    future.set_result(results[start:start + len(X_part)])
+                start += len(X_part)
+
+
+def score_rows(X, model=None):
+    """(label, probabilities) for each row, from the resident model (compiled or xgboost by batch size)"""
+    proba = np.asarray((soil.scoring_model if model is None else model).predict_proba(X), dtype=np.float64)
+    return list(zip(proba.argmax(axis=1), proba))
+
+
+def explain_rows(X):
+    """(label, probabilities, fertility effects) for each row; effects are cached per reading"""
+    model, drivers = soil.scoring_model.with_drivers(len(X))
+    effects = drivers.effects(X)
+    return [(label, proba, effect) for (label, proba), effect in zip(score_rows(X, model), effects)]
+
+
+def parse_readings(body, key="readings"):
+    """(n, 12) float array from a request body, or a 400 error"""
+    readings = body.get(key)
+    if key == "reading" and readings is not None:
+        readings = [readings]
+    try:
+        X = np.asarray(readings, dtype=np.float64)
+    except (TypeError, ValueError):
+        X = None
+    if X is None or X.ndim != 2 or X.shape[1] != len(FEATURE_KEYS) or len(X) == 0 or not np.isfinite(X).all():
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"'{key}' must hold readings of {len(FEATURE_KEYS)} "
+                                                           "finite numbers"}), content_type="application/json")
+    return X
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "expected a JSON object"}),
+                                 content_type="application/json")
+    return body
+
+
+def is_chat_message(item):
+    return isinstance(item, dict) and isinstance(item.get("role"), str) and isinstance(item.get("content"), str)
+
+
+def route_name(request):
+    """The matched route's path template, so metric labels stay bounded"""
+    resource = request.match_info.route.resource
+    return resource.canonical if resource is not None else "unmatched"
+
+
+def status_of(label):
+    return str(STATUS_LABELS[min(int(label), len(STATUS_LABELS) - 1)])
+
+
+async def predict(request):
+    body = await read_json(request)
+    X = parse_readings(body)
+    # TreeSHAP drivers cost far more than a prediction, so they have their own batcher
+    batcher = request.app["explain_batcher" if body.get("drivers") else "batcher"]
+    predictions = []
+    # Readings are never refused here; failing ones carry a "validation" entry for the caller
+    validation = registry.get("input_validator").check(X) if VALIDATION_POLICY != "off" else None
+    results = await batcher.submit(X)
+    # Only readings that pass validation count towards drift; update() may save the state, so off the loop
+    passed = np.ones(len(X), dtype=bool) if validation is None else ~validation.failed
+    await asyncio.get_running_loop().run_in_executor(
+        None, registry.get("drift_monitor").update, X[passed], [int(results[i][0]) for i in np.flatnonzero(passed)])
+    for i, result in enumerate(results):
+        label, proba = result[:2]
+        prediction = {"label": int(label), "status": status_of(label), "probabilities": proba.round(6).tolist()}
+        if body.get("drivers"):
+            prediction["drivers"] = top_drivers(result[2], DRIVER_NAMES)
+        if validation is not None and validation.failed[i]:
+            prediction["validation"] = validation.summary(i)
+        predictions.append(prediction)
+    return web.json_response({"model_version": soil.model_version, "predictions": predictions})
+
+
+async def analyze(request):
+    body = await read_json(request)
+    X = parse_readings(body, "reading")
+    language = body.get("language", "English")
+    [(label, _, effects)] = await request.app["explain_batcher"].submit(X)
+    data_json = dict(zip(FEATURE_KEYS, X[0].tolist()))
+    data_json["status"] = status_of(label)
+    data_json["drivers"] = top_drivers(effects, DRIVER_NAMES)
+    infer.validate_readings(X, [data_json])
+    await asyncio.get_running_loop().run_in_executor(None, infer.record_drift, X, [data_json])
+    try:
+        allowed = infer.narrative_allowed(data_json)
+    except InvalidReading as e:
+        raise web.HTTPUnprocessableEntity(text=json.dumps({"error": "reading rejected", "issues": e.issues,
+                                                           "data": data_json}), content_type="application/json")
+    report = infer.instant_report(data_json, language)
+
+    narrative, error = None, None
+    if body.get("narrative", infer.LLM_NARRATIVE) and allowed:
+        try:
+            with metrics.trace("service_analyze", language=language):
+                narrative = await asyncio.wait_for(
+                    soil.chain1.apredict(data_JSON=json.dumps(data_json, indent=2), language=language),
+                    infer.ANALYZE_TIMEOUT)
+        except Exception as e:
+            # The report alone is the degraded answer
+            infer.record_fallback("chain1", e)
+            error = f"{type(e).__name__}: {e}"
+    explanation = report if narrative is None else report + infer.NARRATIVE_SEPARATOR + narrative
+    return web.json_response({"status": data_json["status"], "report": report, "narrative": narrative,
+                              "explanation": explanation, "data": data_json, "error": error})
+
+
+async def chat(request):
+    body = await read_json(request)
+    message = body.get("message")
+    history = body.get("history") or []
+    analysis = body.get("analysis")
+    if (not isinstance(message, str) or not message.strip() or not isinstance(history, list)
+            or not all(is_chat_message(item) for item in history)
+            or not (analysis is None or isinstance(analysis, dict))):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "'message' must be text, 'history' a list of "
+                                                           "{\"role\", \"content\"} text objects and "
+                                                           "'analysis' an object"}),
+                                 content_type="application/json")
+    language = body.get("language", "English")
+    context = ChatContext(analysis)
+    inputs = infer.chat_inputs(history, message, language, context)
+    with metrics.trace("service_chat", language=language):
+        try:
+            response = await asyncio.wait_for(soil.chain2.apredict(language=language, **inputs),
+                                              infer.ANALYZE_TIMEOUT)
+        except Exception as e:
+            infer.record_fallback("chain2", e)
+            raise web.HTTPServiceUnavailable(text=json.dumps({"error": f"{type(e).__name__}: {e}"}),
+                                             content_type="application/json")
+    return web.json_response({"response": response, "prompt_tokens": context.last_prompt_tokens})
+
+
+async def health(request):
+    app = request.app
+    return web.json_response({
+        "model_version": soil.model_version,
+        "inflight": app["inflight"],
+        # Rows waiting for the next micro-batch
+        "queue_depth": app["batcher"].pending_rows + app["explain_batcher"].pending_rows,
+        "batcher": app["batcher"].stats,
+        "explain_batcher": app["explain_batcher"].stats,
+        "max_batch": app["batcher"].max_batch,
+        "max_wait_ms": app["batcher"].max_wait * 1000,
+    })
+
+
+async def drift(request):
+    monitor = registry.get("drift_monitor")
+    report = await asyncio.get_running_loop().run_in_executor(None, monitor.drift)
+    return web.json_response(dict(report, monitor=monitor.stats))
+
+
+async def prometheus(request):
+    return web.Response(text=metrics.prometheus_text(), content_type="text/plain")
+
+
+@web.middleware
+async def track_inflight(request, handler):
+    """Counts requests in progress, records the depth each one saw and refuses overload"""
+    app = request.app
+    if app["inflight"] >= app["max_inflight"]:
+        metrics.increment("soil_service_rejected_total", help_text="Requests refused with 503 (overload)")
+        raise web.HTTPServiceUnavailable(text=json.dumps({"error": "overloaded"}), content_type="application/json")
+    metrics.observe("soil_service_queue_depth", app["inflight"], buckets=QUEUE_BUCKETS,
+                    help_text="Requests already in progress when one arrives")
+    app["inflight"] += 1
+    start = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        app["inflight"] -= 1
+        metrics.observe("soil_service_request_seconds", time.perf_counter() - start,
+                        help_text="Service request latency", path=route_name(request))
+
+
+def create_app(max_batch=PREDICT_BATCH, max_wait=PREDICT_BATCH_WAIT, max_inflight=MAX_INFLIGHT):
+    app = web.Application(middlewares=[track_inflight])
+    app["batcher"] = MicroBatcher(score_rows, max_batch, max_wait)
+    app["explain_batcher"] = MicroBatcher(explain_rows, max_batch, max_wait)
+    app["inflight"] = 0
+    app["max_inflight"] = max_inflight
+
+    async def on_startup(app):
+        # Load the model, drivers and chains before the first request
+        await asyncio.get_running_loop().run_in_executor(None, lambda: soil.warm_up(background=False))
+        app["batcher"].start()
+        app["explain_batcher"].start()
+
+    async def on_cleanup(app):
+        await app["batcher"].stop()
+        await app["explain_batcher"].stop()
+        # Keep the drift window across restarts
+        await asyncio.get_running_loop().run_in_executor(None, registry.get("drift_monitor").save)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.add_routes([
+        web.post("/predict", predict),
+        web.post("/analyze", analyze),
+        web.post("/chat", chat),
+        web.get("/health", health),
+        web.get("/drift", drift),
+        web.get("/metrics", prometheus),
+    ])
+    return app
+
+
+class ServiceThread:
+    """Runs the service on its own event loop in a daemon thread (benchmarks, tests)"""
+
+    def __init__(self, app=None, host="127.0.0.1", port=0):
+        self.app = app or create_app()
+        self.host = host
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        """Start serving and wait until the service is ready; returns self"""
+        ready = threading.Event()
+
+        async def serve():
+            self._runner = web.AppRunner(self.app)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            self.port = self._runner.addresses[0][1]
+            ready.set()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(serve())
+            self.loop.run_forever()
+
+        threading.Thread(target=run, name="soil-service", daemon=True).start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve soil scoring, analysis and chat over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--max-batch", type=int, default=PREDICT_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=PREDICT_BATCH_WAIT * 1000)
+    args = parser.parse_args()
+    web.run_app(create_app(args.max_batch, args.max_wait_ms / 1000), host=args.host, port=args.port)
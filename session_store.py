@@ -0,0 +1,341 @@
+"""Server-side state for app sessions, with memory caps
+
+A browser session's st.session_state holds only its session id. The samples,
+analysis results, chat history and chat context live in a Session kept by the
+shared SessionStore:
+
+    samples     one float64 array of readings plus timestamps and statuses;
+                the sample dicts the app uses are rebuilt on access
+    results     per sample id: the status-bearing data_json and the explanation
+                (zlib-compressed). There is no copy of the sample.
+    chat        the newest `recent_turns` messages are kept as plain text;
+                older ones are zlib-compressed
+
+Memory is accounted per session after every change. A session above
+max_session_bytes first drops its oldest chat turns that the ChatContext has
+already folded into its summary, and then the explanations of samples that are
+not open. When all sessions together exceed max_total_bytes, the least
+recently used sessions are evicted. An evicted user's next rerun starts a
+fresh session with new samples.
+
+    python session_store.py --simulate 2000      # footprint and evictions for simulated users
+"""
+import os
+import sys
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import metrics
+from soil import FEATURE_KEYS
+
+
+def _pack(text):
+    """zlib-compressed UTF-8 bytes, or the text itself when that is smaller"""
+    data = zlib.compress(text.encode("utf-8"), 6)
+    return data if len(data) < sys.getsizeof(text) else text
+
+
+def _unpack(value):
+    return zlib.decompress(value).decode("utf-8") if isinstance(value, bytes) else value
+
+
+def deep_size(obj):
+    """Approximate bytes held by obj and everything it contains"""
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.base is None else obj.nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key) + deep_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item) for item in obj)
+    return size
+
+
+class Session:
+    """Compact samples, results and chat of one browser session"""
+
+    def __init__(self, session_id, recent_turns=6, on_change=None):
+        self.session_id = session_id
+        self.recent_turns = recent_turns
+        self.on_change = on_change
+        self.timestamps = []
+        self.values = np.empty((0, 0), dtype=np.float64)
+        self.statuses = []
+        self._results = {}
+        self._turns = []
+        # Bytes held by the turn tuples, kept up to date so accounting is O(1) in history length
+        self._turn_bytes = 0
+        self.compressed_turns = 0
+        # Turns trimmed from the front of the history to fit the session cap
+        self.dropped_turns = 0
+        self.current_analysis = None
+        self.chat_context = None
+
+    # Samples
+
+    def set_samples(self, samples):
+        """Replace the samples; clears results and chat, which refer to them"""
+        self.timestamps = [sample["timestamp"] for sample in samples]
+        self.values = np.array([sample["input_sensor"] for sample in samples], dtype=np.float64)
+        self.statuses = [sample.get("status") for sample in samples]
+        self._results = {}
+        self.current_analysis = None
+        self.chat_context = None
+        self.reset_chat()
+
+    @property
+    def samples(self):
+        """Sample dicts in the shape returned by infer.get_multiple_sensor_samples"""
+        return [self.sample(i) for i in range(len(self.timestamps))]
+
+    def sample(self, i):
+        input_sensor = self.values[i].tolist()
+        return {
+            "data_dict": dict(zip(FEATURE_KEYS, input_sensor)),
+            "input_sensor": input_sensor,
+            "timestamp": self.timestamps[i],
+            "status": self.statuses[i],
+            "sample_id": f"Sample {i + 1}",
+        }
+
+    # Analysis results
+
+    def set_result(self, sample_id, explanation, data_json):
+        self._results[sample_id] = [None if explanation is None else _pack(explanation), data_json]
+        self._changed()
+
+    def set_explanation(self, sample_id, explanation):
+        if sample_id in self._results:
+            self._results[sample_id][0] = _pack(explanation)
+            self._changed()
+
+    def has_result(self, sample_id):
+        return sample_id in self._results
+
+    def result(self, sample_id):
+        """{'explanation', 'data_json'} of an analyzed sample, or None"""
+        if sample_id not in self._results:
+            return None
+        explanation, data_json = self._results[sample_id]
+        return {"explanation": None if explanation is None else _unpack(explanation), "data_json": data_json}
+
+    def open_analysis(self, sample_id, chat_context):
+        """Make sample_id the analysis the chat is about"""
+        self.current_analysis = sample_id
+        self.chat_context = chat_context
+
+    # Chat
+
+    @property
+    def history(self):
+        """Chat messages as {'role', 'content'} dicts, oldest first"""
+        return [{"role": role, "content": _unpack(content)} for role, content in self._turns]
+
+    def add_turn(self, role, content):
+        self._turns.append((role, content))
+        self._turn_bytes += deep_size(self._turns[-1])
+        # Compress the turn that just left the recent window
+        old = len(self._turns) - self.recent_turns - 1
+        if old >= 0 and isinstance(self._turns[old][1], str):
+            packed = (self._turns[old][0], _pack(self._turns[old][1]))
+            self._turn_bytes += deep_size(packed) - deep_size(self._turns[old])
+            self._turns[old] = packed
+            self.compressed_turns += 1
+        self._changed()
+
+    def reset_chat(self, messages=()):
+        self._turns = []
+        self._turn_bytes = 0
+        self.compressed_turns = 0
+        self.dropped_turns = 0
+        for message in messages:
+            self.add_turn(message["role"], message["content"])
+        self._changed()
+
+    # Memory
+
+    def footprint(self):
+        """Approximate bytes held, by part"""
+        context = self.chat_context
+        parts = {
+            "samples": deep_size(self.values) + deep_size(self.timestamps) + deep_size(self.statuses),
+            "results": deep_size(self._results),
+            "chat": sys.getsizeof(self._turns) + self._turn_bytes,
+            "context": 0 if context is None else deep_size(context.summary) + deep_size(context.analysis)
+                       + deep_size(context.token_log),
+        }
+        parts["total"] = sum(parts.values())
+        return parts
+
+    def shrink(self, max_bytes):
+        """Drop what can be rebuilt or is already summarized until under max_bytes; returns bytes"""
+        size = self.footprint()["total"]
+        context = self.chat_context
+        while size > max_bytes and context is not None and context.summarized_count > 0 \
+                and len(self._turns) > self.recent_turns:
+            # The ChatContext summary already covers this turn
+            self._turn_bytes -= deep_size(self._turns.pop(0))
+            context.forget(1)
+            self.dropped_turns += 1
+            metrics.increment("soil_session_turns_dropped_total", help_text="Chat turns dropped to fit the session cap")
+            size = self.footprint()["total"]
+        for sample_id, result in self._results.items():
+            if size <= max_bytes:
+                break
+            if sample_id != self.current_analysis and result[0] is not None:
+                # Re-analyzing the sample brings it back (usually from the response cache)
+                result[0] = None
+                size = self.footprint()["total"]
+        return size
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+
+class SessionStore:
+    """Sessions by id, with per-session and global memory caps and LRU eviction"""
+
+    def __init__(self, max_session_bytes=256 * 1024, max_total_bytes=64 * 1024 * 1024, recent_turns=6):
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self.recent_turns = recent_turns
+        self._sessions = OrderedDict()
+        self._bytes = {}
+        self._lock = threading.RLock()
+        self.stats = {"created": 0, "evicted": 0, "over_cap": 0, "total_bytes": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_session_bytes=int(float(os.getenv("SOIL_SESSION_MAX_KB", "256")) * 1024),
+            max_total_bytes=int(float(os.getenv("SOIL_SESSION_TOTAL_MB", "64")) * 1024 * 1024),
+            recent_turns=int(os.getenv("SOIL_SESSION_RECENT_TURNS", "6")),
+        )
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    def get(self, session_id):
+        """The session with this id, created if it is new or was evicted; marks it recently used"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, self.recent_turns, on_change=self._account)
+                self._sessions[session_id] = session
+                self.stats["created"] += 1
+                self._account(session)
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self.stats["total_bytes"] -= self._bytes.pop(session_id, 0)
+
+    def _account(self, session):
+        size = session.footprint()["total"]
+        if size > self.max_session_bytes:
+            size = session.shrink(self.max_session_bytes)
+            if size > self.max_session_bytes:
+                self.stats["over_cap"] += 1
+        with self._lock:
+            if session.session_id not in self._sessions:
+                return
+            self.stats["total_bytes"] += size - self._bytes.get(session.session_id, 0)
+            self._bytes[session.session_id] = size
+            # Least recently used first; the session being changed is never evicted
+            while self.stats["total_bytes"] > self.max_total_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                if oldest == session.session_id:
+                    break
+                self.discard(oldest)
+                self.stats["evicted"] += 1
+                metrics.increment("soil_sessions_evicted_total", help_text="Sessions evicted by the global memory cap")
+
+    def footprints(self):
+        """(session_id, footprint) of every session, most recently used first"""
+        with self._lock:
+            sessions = list(self._sessions.values())[::-1]
+        return [(session.session_id, session.footprint()) for session in sessions]
+
+    def report(self, limit=10):
+        """Text table of the largest sessions and the store totals"""
+        rows = sorted(self.footprints(), key=lambda item: -item[1]["total"])[:limit]
+        lines = [f"{'session':<12} {'samples':>8} {'results':>8} {'chat':>8} {'context':>8} {'total':>8}"]
+        for session_id, parts in rows:
+            lines.append(f"{session_id[:12]:<12} " + " ".join(
+                f"{parts[part]:>8}" for part in ("samples", "results", "chat", "context", "total")))
+        lines.append(f"{len(self)} sessions, {self.stats['total_bytes'] / 1024:.1f} KB "
+                     f"(cap {self.max_total_bytes / 1024:.0f} KB), {self.stats['evicted']} evicted")
+        return "\n".join(lines)
+
+
+# Shared by every session of the Streamlit process
+sessions = SessionStore.from_env()
+
+
+def _simulate(users, turns, explanation_chars, seed):
+    """Fill a store the way the app does and compare with keeping plain dicts"""
+    import random
+    import time
+
+    from chat_context import ChatContext
+
+    rng = random.Random(seed)
+    words = "soil nitrogen phosphorus potassium organic carbon compost lime zinc boron yield crop".split()
+
+    def text(n):
+        return " ".join(rng.choice(words) for _ in range(n // 7)) + "."
+
+    store = SessionStore.from_env()
+    plain = []
+    start = time.perf_counter()
+    for user in range(users):
+        session = store.get(store.new_id())
+        samples = [{"timestamp": f"2026-01-01 00:00:{i:02d}", "input_sensor": [rng.uniform(0, 500) for _ in range(12)],
+                    "status": "Fertile", "sample_id": f"Sample {i + 1}"} for i in range(3)]
+        session.set_samples(samples)
+        results = {}
+        for sample in samples:
+            data_json = {"status": "Fertile", "N": 200.0}
+            explanation = text(explanation_chars)
+            session.set_result(sample["sample_id"], explanation, data_json)
+            results[sample["sample_id"]] = {"explanation": explanation, "data_json": data_json, "sample": dict(sample)}
+        context = ChatContext(results["Sample 1"]["data_json"])
+        session.open_analysis("Sample 1", context)
+        history = []
+        for turn in range(turns):
+            message = {"role": "user" if turn % 2 == 0 else "assistant", "content": text(400 if turn % 2 else 60)}
+            session.add_turn(message["role"], message["content"])
+            history.append(message)
+            # The app builds chat inputs every turn, which folds old turns into the summary
+            context.build(session.history, "next question", lambda inputs: " ".join(inputs.values()))
+        plain.append((samples, results, history))
+    elapsed = time.perf_counter() - start
+    print(store.report(limit=5))
+    print(f"\n{users} users x {turns} turns in {elapsed:.2f} s; plain session_state would hold "
+          f"{deep_size(plain) / 1024:.1f} KB with no cap")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Session store footprint for simulated users")
+    parser.add_argument("--simulate", type=int, default=500, metavar="USERS")
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--explanation-chars", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    _simulate(args.simulate, args.turns, args.explanation_chars, args.seed)
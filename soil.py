@@ -1,87 +1,172 @@
-from xgboost import XGBClassifier
-from langchain_groq import ChatGroq
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 import numpy as np
 import os
-from dotenv import load_dotenv
-load_dotenv()
+import threading
+import time
+from explain import FeatureDrivers, top_drivers
+from metrics import metrics
+from model_registry import ModelRegistry, ModelWatcher
+from resources import registry
 
-# Load the model
-import joblib
-loaded_model = joblib.load("xgb_soil_analysis.bin")
+# xgboost, joblib and langchain are imported by the resource factories below,
+# so importing this module stays cheap until a model or chain is needed
+with registry.timed("load .env"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 
-def get_data_JSON(relevant_data, model):
-    """Convert sensor data to JSON format with prediction"""
-    keys = [
-        "N - Ratio of Nitrogen (NH4+) content in soil",
-        "P - Ratio of Phosphorous (P) content in soil",
-        "K - Ratio of Potassium (K) content in soil",
-        "pH - Soil acidity (pH)",
-        "ec - Electrical conductivity",
-        "oc - Organic carbon",
-        "S - Sulfur (S)",
-        "zn - Zinc (Zn)",
-        "fe - Iron (Fe)",
-        "cu - Copper (Cu)",
-        "Mn - Manganese (Mn)",
-        "B - Boron (B)"
-    ]
-    
-    # Make prediction
-    output = model.predict(np.array(relevant_data).reshape(1, -1))
-    
-    # Determine fertility status
-    if output[0] == 0:
-        status = "Less fertile"
-    elif output[0] == 1:
-        status = "Fertile"
+# Versioned models in xgboost's native format; see model_registry.py
+models = ModelRegistry(os.getenv("SOIL_MODEL_DIR") or "models")
+LEGACY_MODEL_PATH = "xgb_soil_analysis.bin"
+
+
+def _current_model_version():
+    """Promoted registry version, or None to use the pickled legacy model"""
+    return models.current()
+
+
+def _load_model():
+    """Load the trained XGBoost classifier"""
+    registry.timed_import("xgboost")
+    version = registry.get("model_version")
+    if version is not None:
+        return models.load(version)
+    joblib = registry.timed_import("joblib")
+    return joblib.load(LEGACY_MODEL_PATH)
+
+
+def _compile_model():
+    """Flat-array copy of the same trees, evaluated with NumPy only"""
+    from trees import compile_model
+    return compile_model(registry.get("loaded_model"))
+
+
+# The NumPy evaluator is faster for a few rows; above about 50, xgboost's
+# multithreaded predictor wins (benchmark.py, predict suite)
+COMPILED_MAX_ROWS = 50
+
+
+class ScoringModel:
+    """Scores small batches with the compiled trees and larger ones with xgboost"""
+
+    def model_for(self, n_rows):
+        return registry.get("compiled_model" if n_rows <= COMPILED_MAX_ROWS else "loaded_model")
+
+    def with_drivers(self, n_rows):
+        """(model, FeatureDrivers) of the same model version, even during a reload"""
+        return registry.get_many(["compiled_model" if n_rows <= COMPILED_MAX_ROWS else "loaded_model",
+                                  "feature_drivers"])
+
+    def predict_proba(self, X):
+        return self.model_for(len(np.atleast_2d(X))).predict_proba(X)
+
+    def predict(self, X):
+        return np.asarray(self.model_for(len(np.atleast_2d(X))).predict(X)).astype(int)
+
+
+# Use this for any prediction; both models follow hot reloads through the registry
+scoring_model = ScoringModel()
+
+
+# Human-readable names of the 12 model inputs, in model column order
+FEATURE_KEYS = [
+    "N - Ratio of Nitrogen (NH4+) content in soil",
+    "P - Ratio of Phosphorous (P) content in soil",
+    "K - Ratio of Potassium (K) content in soil",
+    "pH - Soil acidity (pH)",
+    "ec - Electrical conductivity",
+    "oc - Organic carbon",
+    "S - Sulfur (S)",
+    "zn - Zinc (Zn)",
+    "fe - Iron (Fe)",
+    "cu - Copper (Cu)",
+    "Mn - Manganese (Mn)",
+    "B - Boron (B)"
+]
+
+# Column names used in dataset1.csv, in the same order
+FEATURE_COLUMNS = ["N", "P", "K", "pH", "EC", "OC", "S", "Zn", "Fe", "Cu", "Mn", "B"]
+
+# Short variable names used for the top drivers in the analysis JSON
+DRIVER_NAMES = [key.split(" - ")[0] for key in FEATURE_KEYS]
+
+# Fertility status for each class label predicted by the model
+STATUS_LABELS = np.array(["Less fertile", "Fertile", "Highly fertile"])
+
+
+def to_feature_matrix(data):
+    """Convert readings (array-like or DataFrame) to an (n, 12) float array"""
+    if hasattr(data, "columns"):
+        missing = [c for c in FEATURE_COLUMNS if c not in data.columns]
+        if missing:
+            raise ValueError(f"Missing feature columns: {missing}")
+        data = data[FEATURE_COLUMNS].to_numpy()
+    X = np.asarray(data, dtype=np.float64)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    if X.ndim != 2 or X.shape[1] != len(FEATURE_COLUMNS):
+        raise ValueError(f"Expected readings with {len(FEATURE_COLUMNS)} features, got shape {X.shape}")
+    return X
+
+
+def predict_batch(data, model, return_proba=False):
+    """Predict class labels and fertility status for many readings at once
+
+    Returns (labels, statuses, probabilities); probabilities is None unless
+    return_proba is set.
+    """
+    X = to_feature_matrix(data)
+    if return_proba:
+        proba = model.predict_proba(X)
+        labels = proba.argmax(axis=1)
     else:
-        status = "Highly fertile"
-    
-    # Create dictionary with all data
-    data_dict = dict(zip(keys, relevant_data))
-    data_dict["status"] = status
-    
-    return data_dict
+        proba = None
+        labels = np.asarray(model.predict(X)).astype(int)
+    # Labels above the known range are treated as the highest class
+    statuses = STATUS_LABELS[np.clip(labels, 0, len(STATUS_LABELS) - 1)]
+    return labels, statuses, proba
 
-# Prompt templates - Updated to handle language
-PROMPT_TEMPLATE1 = """
-You are a Soil Quality Expert. Using the given data on soil health and its associated variables, provide feedback to the user. 
 
-{language_instruction}
+def get_data_JSON_batch(readings, model, drivers=True, statuses=None):
+    """Convert many sensor readings to JSON-ready dicts with one prediction call
 
-Health Status: This could be "Less fertile", "Fertile", or "Highly fertile".
-Variables associated with soil health:
-N - Ratio of Nitrogen (NH4+) content in soil
-P - Ratio of Phosphorous (P) content in soil
-K - Ratio of Potassium (K) content in soil
-pH - Soil acidity (pH)
-ec - Electrical conductivity
-oc - Organic carbon
-S - Sulfur (S)
-zn - Zinc (Zn)
-fe - Iron (Fe)
-cu - Copper (Cu)
-Mn - Manganese (Mn)
-B - Boron (B)
+    With drivers set, each dict also names the variables that raise and lower
+    fertility most for that reading (cached TreeSHAP effects, see explain.py).
+    Statuses that are already known (e.g. from the scored index) skip the model.
+    """
+    if model is scoring_model:
+        model, feature_drivers = scoring_model.with_drivers(len(readings))
+    else:
+        feature_drivers = registry.get("feature_drivers")
+    if statuses is None:
+        _, statuses, _ = predict_batch(readings, model)
+    effects = feature_drivers.effects(to_feature_matrix(readings)) if drivers else None
+    data_dicts = []
+    for i, (relevant_data, status) in enumerate(zip(readings, statuses)):
+        data_dict = dict(zip(FEATURE_KEYS, relevant_data))
+        data_dict["status"] = str(status)
+        if effects is not None:
+            data_dict["drivers"] = top_drivers(effects[i], DRIVER_NAMES)
+        data_dicts.append(data_dict)
+    return data_dicts
 
-Based on the health status and the variables provided, please provide feedback as follows:
 
-Highly fertile:
-- Congratulate the user with an excitement-filled message. Mention how the soil is perfect for crops and plantations.
-- Suggest practices they should use to maintain the fertility of their soil.
+def get_data_JSON(relevant_data, model, drivers=True, status=None):
+    """Convert sensor data to JSON format with prediction"""
+    return get_data_JSON_batch([relevant_data], model, drivers, None if status is None else [status])[0]
 
-Fertile:
-- Identify which of the provided indicators make the soil quality good.
-- Mention the weaker factors and provide suggestions on how they can be improved.
+# Prompt templates - Updated to handle language
+PROMPT_TEMPLATE1 = """
+You are a Soil Quality Expert. Using the given data on soil health, provide feedback to the user.
 
-Less fertile:
-- Point out which factors are causing the soil to be less fertile.
-- Offer solutions and practices on how the soil quality can be improved.
+{language_instruction}
+
+The JSON below holds the health status ("Less fertile", "Fertile" or "Highly fertile") and the measured variables.
+"drivers" lists the variables that raise and lower fertility most for this sample, with the size of each effect; rely on it rather than judging the raw numbers.
+
+Highly fertile: congratulate the user with an excitement-filled message, and suggest practices to maintain the fertility of their soil.
+Fertile: name the raising variables as the soil's strengths, and suggest how to improve the lowering ones.
+Less fertile: explain that the lowering variables are limiting fertility, and offer practices to improve them.
 
-Following is a JSON containing the health status and variables:
 {data_JSON}
 """
 
@@ -107,18 +192,38 @@ B - Boron (B)
 
 Based on the health status and the variables provided, please provide expert feedback based on the chat history and user message as follows:
 
-Following is the conversation history between user and expert(You):
+Following is the analysis result for the soil sample being discussed:
+{analysis}
+
+Following is a summary of the earlier conversation:
+{conversation_summary}
+
+Following is the recent conversation history between user and expert(You):
 {user_history}
 
 Following is the user message:
 {user_message}
 """
 
-# Initialize LLM and chains
-llm = ChatGroq(model_name="llama-3.1-8b-instant", api_key=os.getenv("GROQ_API_KEY"))
+def _create_llm():
+    """Build the Groq chat client; GROQ_API_BASE points it at another endpoint"""
+    ChatGroq = registry.timed_import("langchain_groq").ChatGroq
+    http_client, http_async_client = registry.get("llm_http_clients")
+    return ChatGroq(
+        model_name="llama-3.1-8b-instant",
+        api_key=os.getenv("GROQ_API_KEY"),
+        base_url=os.getenv("GROQ_API_BASE") or None,
+        # A slow LLM falls back to the instant report (see infer.py) instead of hanging
+        timeout=float(os.getenv("SOIL_LLM_TIMEOUT", "30")),
+        # Retries, hedging and the circuit breaker live in the shared transport
+        max_retries=0,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
 
 # Create prompts with language handling
 def create_prompt1(language="English"):
+    from langchain_core.prompts import PromptTemplate
     lang_instruction = "Please provide your entire response in Japanese language." if language == "Japanese" else "Please provide your response in English."
     return PromptTemplate(
         template=PROMPT_TEMPLATE1,
@@ -127,24 +232,198 @@ def create_prompt1(language="English"):
     )
 
 def create_prompt2(language="English"):
+    from langchain_core.prompts import PromptTemplate
     lang_instruction = "Please provide your entire response in Japanese language." if language == "Japanese" else "Please provide your response in English."
     return PromptTemplate(
         template=PROMPT_TEMPLATE2,
-        input_variables=['user_history', 'user_message'],
+        input_variables=['analysis', 'conversation_summary', 'user_history', 'user_message'],
         partial_variables={'language_instruction': lang_instruction}
     )
 
 # Modified chains to use LCEL pipe syntax
 class LanguageAwareLLMChain:
-    def __init__(self, llm, prompt_creator):
+    def __init__(self, llm, prompt_creator, cache=None, name="chain"):
         self.llm = llm
         self.prompt_creator = prompt_creator
+        self.cache = cache
+        self.name = name
+        from langchain_core.output_parsers import StrOutputParser
         self.output_parser = StrOutputParser()
+        # Prompt per language, built on first use and reused
+        self._prompts = {}
+
+    def prompt(self, language="English"):
+        """Return the prompt template for a language"""
+        if language not in self._prompts:
+            self._prompts[language] = self.prompt_creator(language)
+        return self._prompts[language]
+
+    def cache_key(self, prompt, language, inputs):
+        """Content-addressed key for a rendered request to this chain"""
+        model_name = getattr(self.llm, "model_name", type(self.llm).__name__)
+        return self.cache.make_key(prompt.template, model_name, language, inputs)
+
+    def _cached(self, prompt, language, inputs):
+        """Return (key, cached response); both None when caching is off"""
+        if self.cache is None:
+            return None, None
+        with metrics.span("cache_lookup", chain=self.name):
+            key = self.cache_key(prompt, language, inputs)
+            return key, self.cache.get(key)
+
+    def _render(self, prompt, inputs):
+        with metrics.span("render_prompt", chain=self.name):
+            return prompt.invoke(inputs)
+
+    def _parse(self, message):
+        with metrics.span("parse_output", chain=self.name):
+            return self.output_parser.invoke(message)
+
+    # The pipeline stages run one by one (rather than as `prompt | llm | parser`)
+    # so each gets its own timing span and the raw LLM message,
+    # with its token usage, is available before parsing
 
     def predict(self, language="English", **kwargs):
-        prompt = self.prompt_creator(language)
-        chain = prompt | self.llm | self.output_parser
-        return chain.invoke(kwargs)
+        prompt = self.prompt(language)
+        key, cached = self._cached(prompt, language, kwargs)
+        if cached is not None:
+            return cached
+        prompt_value = self._render(prompt, kwargs)
+        with metrics.span("llm_call", chain=self.name):
+            message = self.llm.invoke(prompt_value)
+        metrics.record_llm(self.name, message)
+        response = self._parse(message)
+        if key is not None:
+            self.cache.put(key, response)
+        return response
+
+    async def apredict(self, language="English", **kwargs):
+        """Async version of predict()"""
+        prompt = self.prompt(language)
+        key, cached = self._cached(prompt, language, kwargs)
+        if cached is not None:
+            return cached
+        prompt_value = self._render(prompt, kwargs)
+        with metrics.span("llm_call", chain=self.name):
+            message = await self.llm.ainvoke(prompt_value)
+        metrics.record_llm(self.name, message)
+        response = self._parse(message)
+        if key is not None:
+            self.cache.put(key, response)
+        return response
+
+    def stream(self, language="English", **kwargs):
+        """Yield the response as it is generated"""
+        prompt = self.prompt(language)
+        key, cached = self._cached(prompt, language, kwargs)
+        if cached is not None:
+            yield cached
+            return
+        prompt_value = self._render(prompt, kwargs)
+        start = time.perf_counter()
+        first_token, message, chunks = None, None, []
+        for chunk in self.llm.stream(prompt_value):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            message = chunk if message is None else message + chunk
+            text = self.output_parser.invoke(chunk)
+            chunks.append(text)
+            yield text
+        metrics.record_span("llm_call", time.perf_counter() - start, chain=self.name)
+        metrics.record_llm(self.name, message, first_token)
+        # Only complete responses are cached
+        if key is not None:
+            self.cache.put(key, "".join(chunks))
+
+    async def astream(self, language="English", **kwargs):
+        """Async version of stream()"""
+        prompt = self.prompt(language)
+        key, cached = self._cached(prompt, language, kwargs)
+        if cached is not None:
+            yield cached
+            return
+        prompt_value = self._render(prompt, kwargs)
+        start = time.perf_counter()
+        first_token, message, chunks = None, None, []
+        async for chunk in self.llm.astream(prompt_value):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            message = chunk if message is None else message + chunk
+            text = self.output_parser.invoke(chunk)
+            chunks.append(text)
+            yield text
+        metrics.record_span("llm_call", time.perf_counter() - start, chain=self.name)
+        metrics.record_llm(self.name, message, first_token)
+        if key is not None:
+            self.cache.put(key, "".join(chunks))
+
+
+def _create_response_cache():
+    """Shared LLM response cache; set SOIL_LLM_CACHE=off to disable"""
+    if os.getenv("SOIL_LLM_CACHE", "on").lower() in ("off", "0", "false"):
+        return None
+    from llm_cache import ResponseCache
+    return ResponseCache(path=os.getenv("SOIL_LLM_CACHE_PATH", ".cache/llm_responses.sqlite"))
+
+
+# Register resources; they are built on first access (e.g. soil.chain1)
+# or ahead of time with warm_up()
+registry.register("model_version", _current_model_version)
+registry.register("loaded_model", _load_model)
+registry.register("compiled_model", _compile_model)
+registry.register("feature_drivers", lambda: FeatureDrivers(registry.get("loaded_model"), registry.get("model_version")))
+registry.register("llm_http_clients", lambda: registry.timed_import("transport").create_http_clients())
+registry.register("llm", _create_llm)
+registry.register("response_cache", _create_response_cache)
+registry.register("chain1", lambda: LanguageAwareLLMChain(
+    registry.get("llm"), create_prompt1, cache=registry.get("response_cache"), name="chain1"))
+registry.register("chain2", lambda: LanguageAwareLLMChain(
+    registry.get("llm"), create_prompt2, cache=registry.get("response_cache"), name="chain2"))
+
+
+def reload_model(version):
+    """Load and compile a model version, then swap it in for new predictions"""
+    from trees import compile_model
+
+    # Built off to the side; predictions already running keep the objects they hold
+    model = models.load(version)
+    drivers = FeatureDrivers(model, version)
+    swap = {"compiled_model": compile_model(model), "feature_drivers": drivers,
+            "loaded_model": model, "model_version": version}
+    if registry.is_loaded("feature_drivers"):
+        # Attribute the archive the old model had pinned with the new one before it is served
+        pinned = registry.get("feature_drivers").pinned_rows()
+        if len(pinned):
+            swap["archive_drivers"] = drivers.precompute(pinned)
+    # One step, so no caller sees parts of two versions
+    registry.set_many(swap)
+
+
+_model_watcher = None
+_model_watcher_lock = threading.Lock()
+
+
+def start_model_watcher():
+    """Poll the registry for newly promoted models (SOIL_MODEL_RELOAD_SECONDS, 0 disables)"""
+    global _model_watcher
+    interval = float(os.getenv("SOIL_MODEL_RELOAD_SECONDS", "10"))
+    if interval <= 0:
+        return None
+    with _model_watcher_lock:
+        if _model_watcher is None:
+            _model_watcher = ModelWatcher(models, reload_model, interval,
+                                          current=registry.get("model_version")).start()
+    return _model_watcher
+
+
+def warm_up(background=True):
+    """Start building the model, LLM client and chains before they are needed"""
+    start_model_watcher()
+    return registry.warm(background=background)
+
 
-chain1 = LanguageAwareLLMChain(llm, create_prompt1)
-chain2 = LanguageAwareLLMChain(llm, create_prompt2)
+def __getattr__(name):
+    # Keep soil.loaded_model, soil.chain1, ... working as lazy attributes
+    if not registry.is_registered(name):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return registry.get(name)
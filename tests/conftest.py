@@ -0,0 +1,19 @@
+"""Shared setup: the repo root on sys.path and every cache or state path in a temporary directory"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Set before the modules under test read them at import time
+STATE_DIR = tempfile.mkdtemp(prefix="soil-tests-")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ["SOIL_LLM_CACHE"] = "off"
+os.environ["SOIL_MODEL_DIR"] = os.path.join(ROOT, "models")
+os.environ["SOIL_MODEL_RELOAD_SECONDS"] = "0"
+os.environ["SOIL_SENSOR_STORE"] = os.path.join(STATE_DIR, "sensor_store")
+os.environ["SOIL_DRIFT_STATE"] = os.path.join(STATE_DIR, "drift_state.npz")
+os.environ["SOIL_DRIVERS_CACHE"] = os.path.join(STATE_DIR, "drivers")
+os.environ.pop("SOIL_METRICS_FILE", None)
+os.environ.pop("SOIL_TRACE_LOG", None)
@@ -0,0 +1,39 @@
+import pytest
+
+from chat_context import ChatContext, count_tokens, truncate_tokens
+
+TEMPLATE = "Analysis: {analysis}\nSummary: {conversation_summary}\nHistory: {user_history}\nUser: {user_message}"
+
+
+def render(inputs):
+    return TEMPLATE.format(**inputs)
+
+
+def test_truncate_tokens_stays_within_the_limit():
+    assert truncate_tokens("a b c", 5) == "a b c"
+    assert truncate_tokens("a b c d e", 3) == "a b…"
+    assert count_tokens(truncate_tokens("a b c d e", 3)) == 3
+    assert truncate_tokens("a b", 1) == ""
+
+
+def test_old_turns_are_folded_into_the_summary():
+    context = ChatContext({"status": "Fertile", "N - Nitrogen": 1.0}, token_budget=200, recent_messages=2)
+    history = [{"role": "user", "content": f"Question {i}. " + "detail " * 20} for i in range(10)]
+    inputs = context.build(history, "Next?", render)
+    assert context.last_prompt_tokens <= 200
+    assert "Question 9" in inputs["user_history"]
+    assert "Question 0" not in inputs["user_history"]
+    assert inputs["user_message"] == "Next?"
+
+
+def test_message_and_analysis_are_cut_to_the_hard_budget():
+    analysis = {f"V{i} - variable": float(i) for i in range(100)}
+    for budget in (300, 60, 20):
+        context = ChatContext(analysis, token_budget=budget)
+        inputs = context.build([], "why " * 500, render)
+        assert count_tokens(render(inputs)) == context.last_prompt_tokens <= budget
+
+
+def test_template_over_the_budget_raises():
+    with pytest.raises(ValueError):
+        ChatContext(token_budget=3).build([], "hi", render)
@@ -0,0 +1,87 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from conftest import ROOT
+from drift import DriftMonitor, DriftState, SketchGrid, psi
+from report import read_reference
+
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return read_reference(os.path.join(ROOT, "dataset1.csv"))
+
+
+def monitor(reference, **kwargs):
+    return DriftMonitor(reference, **kwargs)
+
+
+def test_state_merge_equals_adding_everything_at_once(reference):
+    values, labels = reference
+    grid = SketchGrid()
+    edges = np.quantile(values, np.linspace(0, 1, 11)[1:-1], axis=0).T
+    whole, first, second = (DriftState(grid.n_buckets, edges.shape[1] + 1) for _ in range(3))
+    whole.add(grid, edges, values, labels)
+    first.add(grid, edges, values[:100], labels[:100])
+    second.add(grid, edges, values[100:], labels[100:])
+    merged = first.merge(second)
+    assert merged.count == whole.count == len(values)
+    assert (merged.sketch == whole.sketch).all() and (merged.hist == whole.hist).all()
+    assert (merged.classes == whole.classes).all()
+
+
+def test_training_data_is_stable_and_a_shift_is_major(reference):
+    values, labels = reference
+    rng = np.random.default_rng(0)
+    stable = monitor(reference)
+    rows = rng.integers(0, len(values), 500)
+    stable.update(values[rows], labels[rows], now=time.time())
+    assert stable.drift()["level"] == "stable"
+
+    shifted = monitor(reference)
+    moved = values[rows].copy()
+    moved[:, 0] *= 3
+    shifted.update(moved, labels[rows], now=time.time())
+    report = shifted.drift()
+    assert report["level"] == "major" and report["features"]["N"]["psi"] > 0.25
+    assert psi(np.array([[10, 10]]), np.array([[10, 10]]))[0] == pytest.approx(0)
+
+
+def test_monitors_sharing_a_file_merge_without_double_counting(reference, tmp_path):
+    values, labels = reference
+    path = str(tmp_path / "drift.npz")
+    app, service = monitor(reference, path=path), monitor(reference, path=path)
+    app.update(values[:60], labels[:60], now=NOW)
+    service.update(values[60:160], labels[60:160], now=NOW)
+    app.save()
+    service.save()
+    app.save()
+    assert service.current(now=NOW).count == 160
+    assert app.current(now=NOW).count == 160
+    assert monitor(reference, path=path).current(now=NOW).count == 160
+
+
+def test_failed_save_keeps_the_readings_for_the_next_attempt(reference, tmp_path):
+    values, labels = reference
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    failing = monitor(reference, path=str(blocker / "drift.npz"))
+    failing.update(values[:5], labels[:5], now=NOW)
+    with pytest.raises(OSError):
+        failing.save()
+    path = str(tmp_path / "drift.npz")
+    failing.save(path)
+    assert monitor(reference, path=path).current(now=NOW).count == 5
+
+
+def test_old_panes_leave_the_window(reference):
+    values, labels = reference
+    windowed = monitor(reference, panes=2, pane_seconds=60)
+    windowed.update(values[:10], labels[:10], now=NOW)
+    windowed.update(values[10:15], labels[10:15], now=NOW + 60)
+    assert windowed.current(now=NOW + 60).count == 15
+    assert windowed.current(now=NOW + 120).count == 5
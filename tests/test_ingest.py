@@ -0,0 +1,71 @@
+import json
+import time
+
+import numpy as np
+import pytest
+
+from ingest import IngestPipeline, ReadingBuffer, parse_line
+
+VALUES = [295.0, 9.9, 486.0, 7.4, 0.21, 0.39, 6.64, 0.32, 3.21, 1.25, 5.25, 0.23]
+
+
+class StubModel:
+    def predict(self, X):
+        return np.zeros(len(X), dtype=int)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_parse_json_and_csv_lines():
+    timestamp, values = parse_line(json.dumps({"timestamp": "2023-09-14 19:20:43", "values": VALUES}))
+    assert timestamp == int(np.datetime64("2023-09-14T19:20:43", "s").astype(np.int64))
+    assert values.tolist() == VALUES
+    csv_timestamp, csv_values = parse_line("2023-09-14 19:20:43," + ",".join(map(str, VALUES)))
+    assert csv_timestamp == timestamp and csv_values.tolist() == VALUES
+
+
+@pytest.mark.parametrize("line", [
+    json.dumps({"timestamp": 123, "values": VALUES}),
+    json.dumps({"timestamp": None, "values": VALUES}),
+    json.dumps({"timestamp": "2023-09-14 19:20:43", "values": VALUES[:5]}),
+    json.dumps({"timestamp": "2023-09-14 19:20:43", "values": VALUES[:-1] + [float("nan")]}),
+    "",
+])
+def test_bad_lines_raise_value_error(line):
+    with pytest.raises(ValueError):
+        parse_line(line)
+
+
+def test_scorer_survives_bad_lines_and_failing_listeners():
+    pipeline = IngestPipeline(StubModel, max_wait=0.01).start()
+
+    def broken_listener(*args):
+        raise RuntimeError("listener failed")
+
+    pipeline.add_listener(broken_listener)
+    try:
+        good = json.dumps({"timestamp": "2023-09-14 19:20:43", "values": VALUES})
+        for line in (json.dumps({"timestamp": 123, "values": VALUES}), "[1, 2]", '{"values": "x"}', good):
+            pipeline.submit(line)
+        assert wait_for(lambda: pipeline.stats["scored"] == 1 and pipeline.stats["invalid"] == 3)
+        assert all(thread.is_alive() for thread in pipeline._threads)
+        pipeline.submit(good)
+        assert wait_for(lambda: pipeline.stats["scored"] == 2)
+        assert pipeline.stats["errors"] == 2
+    finally:
+        pipeline.stop()
+
+
+def test_reading_buffer_keeps_the_newest_rows():
+    buffer = ReadingBuffer(3)
+    for i in range(5):
+        buffer.append(np.array([i]), np.full((1, 12), float(i)), np.array([i % 3]))
+    timestamps, values, _ = buffer.latest(10)
+    assert len(buffer) == 3
+    assert timestamps.tolist() == [4, 3, 2]
+    assert values[:, 0].tolist() == [4.0, 3.0, 2.0]
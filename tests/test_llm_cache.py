@@ -0,0 +1,39 @@
+import time
+
+from llm_cache import ResponseCache
+
+
+def test_key_depends_on_every_input():
+    key = ResponseCache.make_key("template", "model", "English", {"a": 1})
+    assert key == ResponseCache.make_key("template", "model", "English", {"a": 1})
+    assert key != ResponseCache.make_key("template", "model", "Japanese", {"a": 1})
+    assert key != ResponseCache.make_key("template 2", "model", "English", {"a": 1})
+    assert key != ResponseCache.make_key("template", "model", "English", {"a": 2})
+
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ResponseCache(path).put("k", "response")
+    other = ResponseCache(path)
+    assert other.get("k") == "response"
+    assert other.get("k") == "response"
+    assert other.stats()["hits_disk"] == 1 and other.stats()["hits_memory"] == 1
+    assert other.get("missing") is None
+
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl_seconds=0.05)
+    cache.put("k", "response")
+    time.sleep(0.1)
+    assert ResponseCache(cache.path, ttl_seconds=0.05).get("k") is None
+
+
+def test_tiers_stay_within_their_limits(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_memory_items=2, max_disk_items=3)
+    for i in range(5):
+        cache.put(f"k{i}", f"v{i}")
+        time.sleep(0.01)
+    stats = cache.stats()
+    assert stats["memory_items"] == 2 and stats["disk_items"] == 3
+    assert ResponseCache(cache.path).get("k0") is None
+    assert ResponseCache(cache.path).get("k4") == "v4"
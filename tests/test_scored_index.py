@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from scored_index import ScoredIndex
+from sensor_store import SensorStore
+
+
+class CountingModel:
+    """Class follows the first value; counts the rows it scored"""
+
+    def __init__(self):
+        self.rows = 0
+
+    def predict_proba(self, X):
+        self.rows += len(X)
+        proba = np.zeros((len(X), 3))
+        proba[np.arange(len(X)), np.minimum((X[:, 0] * 3).astype(int), 2)] = 1
+        return proba
+
+
+@pytest.fixture
+def store():
+    rng = np.random.default_rng(0)
+    return SensorStore(np.arange(50, dtype=np.int64) * 900, rng.random((50, 12)) * 0.3)
+
+
+def test_only_new_readings_are_scored(store):
+    model = CountingModel()
+    index, scored = ScoredIndex.empty().refresh(store, lambda: model, "v1")
+    assert scored == 50
+    rng = np.random.default_rng(1)
+    grown = SensorStore(np.append(store.timestamps, 10 ** 6), np.vstack([store.values, rng.random((1, 12))]))
+    index, scored = index.refresh(grown, lambda: model, "v1")
+    assert scored == 1 and model.rows == 51
+
+
+def test_corrected_reading_with_the_same_timestamp_is_rescored(store, tmp_path):
+    model = CountingModel()
+    index, _ = ScoredIndex.empty().refresh(store, lambda: model, "v1")
+    assert index.labels[7] == 0
+    values = store.values.copy()
+    values[7, 0] = 0.99
+    corrected = SensorStore(store.timestamps, values)
+
+    index.save(str(tmp_path))
+    reopened = ScoredIndex.open(str(tmp_path))
+    refreshed, scored = reopened.refresh(corrected, lambda: model, "v1")
+    assert scored == 1
+    assert refreshed.labels[7] == 2
+
+
+def test_new_model_version_rescores_everything(store):
+    index, _ = ScoredIndex.empty().refresh(store, CountingModel, "v1")
+    _, scored = index.refresh(store, CountingModel, "v2")
+    assert scored == len(store)
+
+
+def test_index_without_digests_is_not_reused(store, tmp_path):
+    index, _ = ScoredIndex.empty().refresh(store, CountingModel, "v1")
+    legacy = ScoredIndex(index.timestamps, index.labels, index.proba, "v1")
+    _, scored = legacy.refresh(store, CountingModel, "v1")
+    assert scored == len(store)
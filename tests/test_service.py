@@ -0,0 +1,54 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import service
+from soil import STATUS_LABELS
+from metrics import metrics
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    running = service.ServiceThread().start()
+    yield running.base_url
+    running.stop()
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_predict_scores_readings(base_url):
+    status, body = post(base_url + "/predict", {"readings": [[138, 8.6, 560, 7.46, 0.62, 0.7, 5.9, 0.24, 0.31,
+                                                              0.77, 8.71, 11.1]]})
+    assert status == 200 and body["predictions"][0]["status"] in map(str, STATUS_LABELS)
+    assert post(base_url + "/predict", {"readings": [[1, 2]]})[0] == 400
+
+
+@pytest.mark.parametrize("body", [
+    {"message": ""},
+    {"message": "hi", "history": "not a list"},
+    {"message": "hi", "history": [{"role": "user"}]},
+    {"message": "hi", "history": [["user", "hello"]]},
+    {"message": "hi", "analysis": ["N"]},
+])
+def test_malformed_chat_requests_are_rejected(base_url, body):
+    status, response = post(base_url + "/chat", body)
+    assert status == 400 and "error" in response
+
+
+def test_unknown_paths_share_one_latency_label(base_url):
+    for path in ("/a", "/b/c", "/predict/x"):
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(base_url + path)
+    text = metrics.prometheus_text()
+    assert 'path="unmatched"' in text
+    assert 'path="/a"' not in text and 'path="/b/c"' not in text
@@ -0,0 +1,62 @@
+import random
+import string
+
+import numpy as np
+
+from chat_context import ChatContext
+from session_store import SessionStore
+
+
+def text(n, seed=0):
+    """Random words, which zlib cannot shrink much"""
+    rng = random.Random(seed)
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=6)) for _ in range(n // 7))
+
+
+def samples(n=3):
+    return [{"timestamp": f"2023-09-14 19:0{i}:00", "input_sensor": list(np.arange(12.0) + i), "status": "Fertile"}
+            for i in range(n)]
+
+
+def test_least_recently_used_sessions_are_evicted():
+    store = SessionStore(max_session_bytes=10 ** 6, max_total_bytes=40 * 1024)
+    ids = [store.new_id() for _ in range(3)]
+    for session_id in ids:
+        session = store.get(session_id)
+        session.set_samples(samples())
+        session.set_result("Sample 1", text(20000, seed=len(store)), {"status": "Fertile"})
+    store.get(ids[0])
+    store.get(ids[2]).set_result("Sample 2", text(20000, seed=99), {"status": "Fertile"})
+    assert ids[2] in store
+    assert ids[1] not in store
+    assert store.stats["evicted"] >= 1
+    assert store.stats["total_bytes"] <= store.max_total_bytes
+
+
+def test_session_cap_drops_summarized_turns_and_unopened_explanations():
+    store = SessionStore(max_session_bytes=16 * 1024, recent_turns=2)
+    session = store.get(store.new_id())
+    session.set_samples(samples())
+    session.set_result("Sample 1", "open explanation " + text(1000), {"status": "Fertile"})
+    session.set_result("Sample 2", text(8000, seed=1), {"status": "Fertile"})
+    context = ChatContext({"status": "Fertile"})
+    session.open_analysis("Sample 1", context)
+    for i in range(40):
+        session.add_turn("user" if i % 2 == 0 else "assistant", f"turn {i} " + text(1000, seed=i))
+    context.summarized_count = len(session.history) - 2
+    session.add_turn("user", "one more")
+    assert session.footprint()["total"] <= store.max_session_bytes
+    assert session.dropped_turns > 0
+    assert session.result("Sample 1")["explanation"].startswith("open explanation")
+    assert session.result("Sample 2")["explanation"] is None
+    assert session.history[-1]["content"] == "one more"
+
+
+def test_chat_history_round_trips_through_compression():
+    store = SessionStore(recent_turns=2)
+    session = store.get(store.new_id())
+    messages = [{"role": "user", "content": f"message {i} " * 50} for i in range(6)]
+    for message in messages:
+        session.add_turn(message["role"], message["content"])
+    assert session.compressed_turns == 4
+    assert session.history == messages
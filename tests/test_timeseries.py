@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from report import VARIABLES
+from sensor_store import SensorStore
+from timeseries import TimeSeries
+
+
+def scored(store, model_version="v1"):
+    # Labels follow the values, like a real model's would
+    return SimpleNamespace(model_version=model_version, labels=(store.values[:, 0] * 3).astype(np.int8))
+
+
+def rebuilt(store):
+    series = TimeSeries()
+    series.add(store.timestamps, store.values, scored(store).labels)
+    return series
+
+
+def assert_same(a, b):
+    for name in a.rollups:
+        assert np.array_equal(a.rollups[name].starts, b.rollups[name].starts)
+        assert np.allclose(a.rollups[name].total, b.rollups[name].total)
+        assert np.array_equal(a.rollups[name].count, b.rollups[name].count)
+        assert np.array_equal(a.rollups[name].status, b.rollups[name].status)
+
+
+@pytest.fixture
+def store():
+    rng = np.random.default_rng(0)
+    return SensorStore(np.arange(200, dtype=np.int64) * 900, rng.random((200, 12)))
+
+
+def test_hourly_mean_matches_pandas(store):
+    series = rebuilt(store)
+    frame = pd.DataFrame(store.values, index=pd.to_datetime(store.timestamps, unit="s"), columns=VARIABLES)
+    sums, counts = frame.resample("h").sum(min_count=1), frame.resample("h").count()
+    expected = sums.rolling(3, min_periods=1).sum() / counts.rolling(3, min_periods=1).sum()
+    assert np.allclose(series.frame("hour", "mean", 3).values, expected.values, equal_nan=True)
+
+
+def test_refresh_adds_only_new_rows_including_equal_timestamps(store):
+    series = TimeSeries()
+    series.refresh(store, scored(store))
+    rng = np.random.default_rng(1)
+    last = store.timestamps[-1]
+    grown = SensorStore(np.append(store.timestamps, [last, last]), np.vstack([store.values, rng.random((2, 12))]))
+    assert series.refresh(grown, scored(grown)) == 2
+    assert series.stats["rebuilds"] == 1
+    assert_same(series, rebuilt(grown))
+
+
+def test_refresh_rebuilds_after_a_back_dated_reading(store):
+    series = TimeSeries()
+    series.refresh(store, scored(store))
+    rng = np.random.default_rng(2)
+    back_dated = SensorStore(np.append(store.timestamps, 10), np.vstack([store.values, rng.random((1, 12))]))
+    series.refresh(back_dated, scored(back_dated))
+    assert series.stats["rebuilds"] == 2
+    assert_same(series, rebuilt(back_dated))
+
+
+def test_saved_rollups_rebuild_for_a_replaced_store_of_the_same_size(store, tmp_path):
+    series = TimeSeries()
+    series.refresh(store, scored(store))
+    path = str(tmp_path / "rollups.npz")
+    series.save(path)
+
+    reopened = TimeSeries.open(path)
+    assert reopened.refresh(store, scored(store)) == 0
+    assert reopened.is_current(store, "v1")
+
+    values = store.values.copy()
+    values[50] += 1
+    replaced = SensorStore(store.timestamps, values)
+    reopened = TimeSeries.open(path)
+    assert reopened.refresh(replaced, scored(replaced)) == len(replaced)
+    assert_same(reopened, rebuilt(replaced))
+
+
+def test_new_model_version_rebuilds_statuses(store):
+    series = TimeSeries()
+    series.refresh(store, scored(store))
+    relabelled = SimpleNamespace(model_version="v2", labels=np.zeros(len(store), dtype=np.int8))
+    series.refresh(store, relabelled)
+    assert series.model_version == "v2"
+    assert series.rollups["day"].status[:, 0].sum() == len(store)
@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from transport import (AsyncResilientTransport, CircuitBreaker, CircuitOpenError, ResilientTransport,
+                       TransportSettings)
+
+URL = "http://groq.test/openai/v1/chat/completions"
+
+
+def fast_settings(**kwargs):
+    return TransportSettings(**{"backoff_base": 0.001, "backoff_max": 0.001, **kwargs})
+
+
+def test_breaker_opens_after_threshold_and_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN and not breaker.allow()
+
+
+def test_retries_429_until_success():
+    statuses = iter([429, 503, 200])
+    transport = ResilientTransport(fast_settings(max_retries=3), inner=httpx.MockTransport(
+        lambda request: httpx.Response(next(statuses), json={})))
+    with httpx.Client(transport=transport) as client:
+        assert client.post(URL, json={}).status_code == 200
+    assert transport.breaker.failures == 0
+
+
+def test_out_of_retries_returns_the_error_response():
+    transport = ResilientTransport(fast_settings(max_retries=1, failure_threshold=10),
+                                   inner=httpx.MockTransport(lambda request: httpx.Response(503)))
+    with httpx.Client(transport=transport) as client:
+        assert client.post(URL, json={}).status_code == 503
+    assert transport.breaker.failures == 2
+
+
+def test_open_circuit_fails_fast():
+    def refuse(request):
+        raise httpx.ConnectError("down", request=request)
+
+    transport = ResilientTransport(fast_settings(max_retries=0, failure_threshold=2, reset_timeout=60),
+                                   inner=httpx.MockTransport(refuse))
+    with httpx.Client(transport=transport) as client:
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                client.post(URL, json={})
+        with pytest.raises(CircuitOpenError):
+            client.post(URL, json={})
+
+
+class SlowTransport(httpx.AsyncBaseTransport):
+    """Answers 200 after the given delays, one per call; counts cancellations"""
+
+    def __init__(self, *delays):
+        self.delays = list(delays)
+        self.calls = 0
+        self.cancelled = 0
+
+    async def handle_async_request(self, request):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return httpx.Response(200, json={})
+
+
+def test_cancelled_trial_does_not_leave_the_circuit_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    transport = AsyncResilientTransport(fast_settings(max_retries=0), breaker, inner=SlowTransport(1.0, 0.0))
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.post(URL, json={}), 0.05)
+            await asyncio.sleep(0.06)
+            return (await client.post(URL, json={})).status_code
+
+    assert asyncio.run(run()) == 200
+    assert breaker.state == breaker.CLOSED
+
+
+def test_hedge_cancels_the_losing_request():
+    inner = SlowTransport(1.0, 0.01)
+    transport = AsyncResilientTransport(fast_settings(hedge_after=0.05), inner=inner)
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            start = time.perf_counter()
+            response = await client.post(URL, json={})
+            await asyncio.sleep(0.01)
+            return response.status_code, time.perf_counter() - start
+
+    status, seconds = asyncio.run(run())
+    assert status == 200 and seconds < 0.5
+    assert inner.calls == 2 and inner.cancelled == 1
+
+
+def test_each_event_loop_gets_its_own_pool_and_aclose_closes_all():
+    transport = AsyncResilientTransport(fast_settings())
+
+    async def pool():
+        return transport.inner
+
+    loop = asyncio.new_event_loop()
+    try:
+        first = loop.run_until_complete(pool())
+        assert loop.run_until_complete(pool()) is first
+
+        async def close_from_another_loop():
+            assert await pool() is not first
+            await transport.aclose()
+
+        asyncio.run(close_from_another_loop())
+        assert len(transport._pools) == 0
+    finally:
+        loop.close()
@@ -0,0 +1,42 @@
+import json
+import os
+
+import joblib
+import pandas as pd
+import pytest
+
+import soil
+from conftest import ROOT
+from trees import check_parity, compile_model
+
+
+def dataset_rows():
+    return pd.read_csv(os.path.join(ROOT, "dataset1.csv")).drop(columns=["Output"]).to_numpy()
+
+
+def sensor_rows():
+    with open(os.path.join(ROOT, "assets", "sensor_data.json"), "r") as infile:
+        return list(json.load(infile).values())
+
+
+@pytest.fixture(scope="module", params=["registry", "legacy"])
+def model(request):
+    if request.param == "registry":
+        return soil.models.load(soil.models.current())
+    return joblib.load(os.path.join(ROOT, soil.LEGACY_MODEL_PATH))
+
+
+@pytest.mark.parametrize("rows", [dataset_rows, sensor_rows], ids=["dataset1.csv", "sensor_data.json"])
+def test_compiled_margins_match_booster_on_every_row(model, rows):
+    max_diff, mismatches = check_parity(compile_model(model), model, rows())
+    assert max_diff <= 1e-4
+    assert mismatches == 0
+
+
+def test_saved_compiled_model_round_trips(model, tmp_path):
+    compiled = compile_model(model)
+    path = str(tmp_path / "model.npz")
+    compiled.save(path)
+    reloaded = type(compiled).load(path)
+    rows = sensor_rows()
+    assert (reloaded.margins(rows) == compiled.margins(rows)).all()
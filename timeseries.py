@@ -0,0 +1,285 @@
+"""Incrementally maintained time-bucket aggregates of sensor readings
+
+For each resolution (hourly and daily by default) a Rollup keeps one row per
+non-empty time bucket, with the reading count, per-variable sum, min and max,
+and the count of each predicted fertility status. add() folds new readings
+into the existing buckets in one vectorized pass. Sums, counts and extremes
+combine exactly, so charts over months of readings are drawn from a few
+hundred bucket rows and never rescan the raw data:
+
+    mean / min / max    per bucket, optionally over a rolling window of buckets
+    status timeline     share of each status per bucket, the dominant status,
+                        and runs of buckets with the same dominant status
+
+TimeSeries holds the rollups of one source. For the sensor store it also
+keeps a fingerprint of the rows folded in (their timestamps and values).
+refresh() adds only the rows after them while the store still starts with
+those rows, and rebuilds everything when it does not (a back-dated or
+corrected reading, a replaced file) or when the model version changes.
+Rollups are saved as one .npz next to the store's arrays.
+
+    python timeseries.py --resolution day --window 3
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from report import VARIABLES
+from soil import STATUS_LABELS
+
+RESOLUTIONS = {"hour": 3600, "day": 86400}
+
+
+class Rollup:
+    """Per-bucket count, sum, min, max and status counts at one resolution"""
+
+    def __init__(self, seconds, starts=None, count=None, total=None, low=None, high=None, status=None):
+        features, classes = len(VARIABLES), len(STATUS_LABELS)
+        self.seconds = seconds
+        self.starts = np.empty(0, np.int64) if starts is None else starts
+        self.count = np.empty(0, np.int64) if count is None else count
+        self.total = np.empty((0, features)) if total is None else total
+        self.low = np.empty((0, features)) if low is None else low
+        self.high = np.empty((0, features)) if high is None else high
+        self.status = np.empty((0, classes), np.int64) if status is None else status
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_readings(cls, seconds, timestamps, values, labels):
+        """Aggregate a batch of readings (timestamps in epoch seconds) into buckets"""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        labels = np.clip(np.asarray(labels, dtype=np.intp), 0, len(STATUS_LABELS) - 1)
+        keys = timestamps - timestamps % seconds
+        order = np.argsort(keys, kind="stable")
+        keys, values, labels = keys[order], values[order], labels[order]
+        starts, first, count = np.unique(keys, return_index=True, return_counts=True)
+        if not len(starts):
+            return cls(seconds)
+        group = np.repeat(np.arange(len(starts)), count)
+        status = np.bincount(group * len(STATUS_LABELS) + labels,
+                             minlength=len(starts) * len(STATUS_LABELS)).reshape(len(starts), -1)
+        return cls(seconds, starts, count, np.add.reduceat(values, first), np.minimum.reduceat(values, first),
+                   np.maximum.reduceat(values, first), status)
+
+    def merge(self, other):
+        """Rollup over the readings of both"""
+        if not len(other):
+            return self
+        if not len(self):
+            return other
+        starts = np.union1d(self.starts, other.starts)
+        mine, theirs = np.searchsorted(starts, self.starts), np.searchsorted(starts, other.starts)
+        merged = Rollup(self.seconds, starts, np.zeros(len(starts), np.int64),
+                        np.zeros((len(starts), len(VARIABLES))), np.full((len(starts), len(VARIABLES)), np.inf),
+                        np.full((len(starts), len(VARIABLES)), -np.inf),
+                        np.zeros((len(starts), len(STATUS_LABELS)), np.int64))
+        for positions, rollup in ((mine, self), (theirs, other)):
+            merged.count[positions] += rollup.count
+            merged.total[positions] += rollup.total
+            merged.low[positions] = np.minimum(merged.low[positions], rollup.low)
+            merged.high[positions] = np.maximum(merged.high[positions], rollup.high)
+            merged.status[positions] += rollup.status
+        return merged
+
+    def add(self, timestamps, values, labels):
+        """Rollup with a batch of readings folded in"""
+        return self.merge(Rollup.from_readings(self.seconds, timestamps, values, labels))
+
+    def dense(self, start=None, end=None):
+        """Rollup on a regular grid from start to end (epoch seconds), with empty buckets filled in"""
+        if not len(self):
+            return self
+        first = self.starts[0] if start is None else start - start % self.seconds
+        last = self.starts[-1] if end is None else end - end % self.seconds
+        grid = np.arange(first, last + 1, self.seconds, dtype=np.int64)
+        inside = (self.starts >= first) & (self.starts <= last)
+        positions = (self.starts[inside] - first) // self.seconds
+        dense = Rollup(self.seconds, grid, np.zeros(len(grid), np.int64), np.zeros((len(grid), len(VARIABLES))),
+                       np.full((len(grid), len(VARIABLES)), np.inf), np.full((len(grid), len(VARIABLES)), -np.inf),
+                       np.zeros((len(grid), len(STATUS_LABELS)), np.int64))
+        dense.count[positions] = self.count[inside]
+        dense.total[positions] = self.total[inside]
+        dense.low[positions] = self.low[inside]
+        dense.high[positions] = self.high[inside]
+        dense.status[positions] = self.status[inside]
+        return dense
+
+    def rolling(self, window=1):
+        """(mean, min, max) per bucket over the last `window` buckets (use on a dense() rollup); NaN if empty"""
+        if window > 1 and len(self):
+            # Running sums make every window mean O(1); extremes use a strided view of the padded arrays
+            total = np.cumsum(np.vstack([np.zeros((1, len(VARIABLES))), self.total]), axis=0)
+            count = np.cumsum(np.concatenate([[0], self.count]))
+            end = np.arange(1, len(self) + 1)
+            begin = np.maximum(end - window, 0)
+            total, count = total[end] - total[begin], count[end] - count[begin]
+            padding = ((window - 1, 0), (0, 0))
+            low = np.lib.stride_tricks.sliding_window_view(
+                np.pad(self.low, padding, constant_values=np.inf), window, axis=0).min(axis=-1)
+            high = np.lib.stride_tricks.sliding_window_view(
+                np.pad(self.high, padding, constant_values=-np.inf), window, axis=0).max(axis=-1)
+        else:
+            total, count, low, high = self.total, self.count, self.low, self.high
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count[:, None]
+        empty = count == 0
+        mean[empty] = np.nan
+        return mean, np.where(np.isinf(low), np.nan, low), np.where(np.isinf(high), np.nan, high)
+
+
+def to_datetime(seconds):
+    return pd.to_datetime(np.asarray(seconds, dtype=np.int64), unit="s")
+
+
+def fingerprint(store, rows):
+    """Hash of the timestamps and values of the first `rows` readings of store"""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(store.timestamps[:rows]).tobytes())
+    digest.update(np.ascontiguousarray(store.digests[:rows]).tobytes())
+    return digest.hexdigest()
+
+
+class TimeSeries:
+    """Rollups of one source at every resolution, kept up to date incrementally"""
+
+    def __init__(self, resolutions=None, model_version=None):
+        resolutions = RESOLUTIONS if resolutions is None else resolutions
+        self.rollups = {name: Rollup(seconds) for name, seconds in resolutions.items()}
+        self.model_version = model_version
+        # Readings added, and for a store the fingerprint of those rows
+        self.rows = 0
+        self.fingerprint = None
+        # The store object refresh() last brought this up to date with
+        self.store = None
+        self.stats = {"readings": 0, "rebuilds": 0}
+
+    def add(self, timestamps, values, labels):
+        """Fold scored readings (epoch seconds, (n, 12) values, class indices) into every rollup"""
+        if not len(timestamps):
+            return
+        for name, rollup in self.rollups.items():
+            self.rollups[name] = rollup.add(timestamps, values, labels)
+        self.rows += len(timestamps)
+        self.stats["readings"] += len(timestamps)
+
+    def on_scored(self, timestamps, values, labels, statuses):
+        """IngestPipeline listener"""
+        self.add(timestamps, values, labels)
+
+    def is_current(self, store, model_version):
+        return self.store is store and self.model_version == model_version
+
+    def refresh(self, store, scored):
+        """Fold in the store rows not added yet; returns the number added
+
+        scored is the ScoredIndex aligned with store. If the store no longer
+        starts with the rows already added, or the model version changed,
+        everything is rebuilt.
+        """
+        if (scored.model_version != self.model_version or self.rows > len(store)
+                or (self.rows and fingerprint(store, self.rows) != self.fingerprint)):
+            self.rollups = {name: Rollup(rollup.seconds) for name, rollup in self.rollups.items()}
+            self.model_version = scored.model_version
+            self.rows = 0
+            self.stats["rebuilds"] += 1
+        first = self.rows
+        new = slice(first, len(store))
+        self.add(store.timestamps[new], store.values[new], scored.labels[new])
+        self.fingerprint = fingerprint(store, self.rows)
+        self.store = store
+        return len(store) - first
+
+    def frame(self, resolution="hour", stat="mean", window=1, start=None, end=None, variables=VARIABLES):
+        """DataFrame of a statistic per bucket (rows: bucket start times, columns: variables)
+
+        start and end are epoch seconds. stat is "mean", "min" or "max", over
+        a rolling window of `window` buckets. Empty buckets appear as NaN.
+        """
+        rollup = self.rollups[resolution].dense(start, end)
+        if not len(rollup):
+            return pd.DataFrame(columns=list(variables), dtype=float)
+        mean, low, high = rollup.rolling(window)
+        values = {"mean": mean, "min": low, "max": high}[stat]
+        columns = [VARIABLES.index(variable) for variable in variables]
+        return pd.DataFrame(values[:, columns], index=to_datetime(rollup.starts), columns=list(variables))
+
+    def status_timeline(self, resolution="hour", start=None, end=None):
+        """DataFrame of the share of each status per bucket, plus the readings and dominant status"""
+        rollup = self.rollups[resolution].dense(start, end)
+        counts = rollup.status
+        with np.errstate(invalid="ignore", divide="ignore"):
+            shares = counts / counts.sum(axis=1, keepdims=True)
+        frame = pd.DataFrame(shares, index=to_datetime(rollup.starts), columns=[str(s) for s in STATUS_LABELS])
+        frame["readings"] = rollup.count
+        frame["dominant"] = np.where(rollup.count > 0, STATUS_LABELS[counts.argmax(axis=1)], None)
+        return frame
+
+    def status_segments(self, resolution="hour"):
+        """Runs of consecutive non-empty buckets with the same dominant status"""
+        rollup = self.rollups[resolution]
+        if not len(rollup):
+            return []
+        dominant = rollup.status.argmax(axis=1)
+        gap = np.diff(rollup.starts) > rollup.seconds
+        breaks = np.flatnonzero((np.diff(dominant) != 0) | gap) + 1
+        bounds = np.concatenate([[0], breaks, [len(rollup)]])
+        return [{"start": to_datetime(rollup.starts[a]), "end": to_datetime(rollup.starts[b - 1] + rollup.seconds),
+                 "status": str(STATUS_LABELS[dominant[a]]), "readings": int(rollup.count[a:b].sum())}
+                for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def save(self, path):
+        """Write all rollups to one .npz (tmp file + rename)"""
+        arrays = {"rows": np.array(self.rows, dtype=np.int64), "fingerprint": np.array(self.fingerprint or ""),
+                  "model_version": np.array(self.model_version or "")}
+        for name, rollup in self.rollups.items():
+            arrays.update({f"{name}.seconds": np.array(rollup.seconds), f"{name}.starts": rollup.starts,
+                           f"{name}.count": rollup.count, f"{name}.total": rollup.total, f"{name}.low": rollup.low,
+                           f"{name}.high": rollup.high, f"{name}.status": rollup.status})
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path, resolutions=None):
+        """Load saved rollups, or None if there are none or they use other resolutions"""
+        resolutions = RESOLUTIONS if resolutions is None else resolutions
+        try:
+            with np.load(path) as saved:
+                series = cls(resolutions, str(saved["model_version"]) or None)
+                for name, seconds in resolutions.items():
+                    if int(saved[f"{name}.seconds"]) != seconds:
+                        return None
+                    series.rollups[name] = Rollup(seconds, *(saved[f"{name}.{field}"] for field in
+                                                             ("starts", "count", "total", "low", "high", "status")))
+                series.rows = int(saved["rows"])
+                series.fingerprint = str(saved["fingerprint"]) or None
+        except (OSError, ValueError, KeyError):
+            return None
+        return series
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import infer
+
+    parser = argparse.ArgumentParser(description="Rolling aggregates and status timeline of the sensor store")
+    parser.add_argument("--resolution", choices=list(RESOLUTIONS), default="day")
+    parser.add_argument("--stat", choices=["mean", "min", "max"], default="mean")
+    parser.add_argument("--window", type=int, default=1, help="rolling window in buckets")
+    args = parser.parse_args()
+    series = infer.get_sensor_rollups()
+    with pd.option_context("display.width", 160, "display.max_columns", 20):
+        print(series.frame(args.resolution, args.stat, args.window).round(2))
+        print()
+        print(series.status_timeline(args.resolution).round(2))
+    for segment in series.status_segments(args.resolution):
+        print(f"{segment['start']} - {segment['end']}  {segment['status']} ({segment['readings']} readings)")
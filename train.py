@@ -0,0 +1,243 @@
+"""Reproducible training of the soil fertility model
+
+Replaces the training steps of Soil_Analysis_ML.ipynb. Reads one or more
+CSV/Parquet files with the 12 nutrient columns and `Output`, makes stratified
+train/validation/test splits, and oversamples the training split with seeded
+SMOTE. It then trains a `hist` XGBoost classifier on all cores, with early
+stopping on the validation split. Every run is published to the model
+registry (model_registry.py) as models/<version>/, in xgboost's native
+format. Its metadata.json holds the test metrics, parameters, data
+fingerprint, wall time and peak memory.
+
+    python train.py                                    # dataset1.csv, seed 42
+    python train.py --data lab_2024.parquet dataset1.csv --version 2024-06
+    python train.py --promote                          # also make it the current model
+"""
+import argparse
+import hashlib
+import os
+import platform
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from model_registry import ModelRegistry
+from soil import FEATURE_COLUMNS
+
+TARGET_COLUMN = "Output"
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process so far, in MB"""
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if platform.system() == "Darwin" else peak / 1024
+
+
+def fingerprint(paths):
+    """sha256 over the input files, so a metrics file names the exact data it came from"""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as infile:
+            for block in iter(lambda: infile.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def read_dataset(paths):
+    """Concatenate CSV/Parquet inputs into float32 features and int labels"""
+    columns = FEATURE_COLUMNS + [TARGET_COLUMN]
+    frames = []
+    for path in paths:
+        if path.endswith(".parquet"):
+            frame = pd.read_parquet(path, columns=columns)
+        else:
+            frame = pd.read_csv(path, usecols=columns,
+                                dtype={**{name: np.float32 for name in FEATURE_COLUMNS}, TARGET_COLUMN: np.int64})
+        frames.append(frame)
+    frame = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    frame = frame.dropna()
+    X = frame[FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+    y = frame[TARGET_COLUMN].to_numpy(dtype=np.int64)
+    return X, y
+
+
+def split(X, y, test_size, validation_size, seed):
+    """Stratified train/validation/test split; validation is taken from the training part"""
+    from sklearn.model_selection import train_test_split
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=test_size, random_state=seed, stratify=y)
+    X_train, X_val, y_train, y_val = train_test_split(
+        X_train, y_train, test_size=validation_size, random_state=seed, stratify=y_train)
+    return X_train, X_val, X_test, y_train, y_val, y_test
+
+
+def oversample(X, y, seed):
+    """Seeded SMOTE on the training split only"""
+    from imblearn.over_sampling import SMOTE
+
+    # SMOTE needs k_neighbors < the size of the smallest class
+    smote = SMOTE(random_state=seed, k_neighbors=max(1, min(5, int(np.bincount(y).min()) - 1)))
+    X_resampled, y_resampled = smote.fit_resample(X, y)
+    return X_resampled.astype(np.float32, copy=False), y_resampled
+
+
+def class_weights(y):
+    """Per-row weights that give every class the same total weight"""
+    counts = np.bincount(y)
+    return (len(y) / (len(counts) * counts))[y].astype(np.float32)
+
+
+def model_params(args):
+    return {
+        "objective": "multi:softprob",
+        "tree_method": "hist",
+        "n_estimators": args.n_estimators,
+        "learning_rate": args.learning_rate,
+        "max_depth": args.max_depth,
+        "max_bin": args.max_bin,
+        "subsample": args.subsample,
+        "colsample_bytree": args.colsample_bytree,
+        "early_stopping_rounds": args.early_stopping_rounds or None,
+        "eval_metric": "mlogloss",
+        "n_jobs": args.n_jobs,
+        "random_state": args.seed,
+    }
+
+
+def evaluate(model, X, y):
+    """Accuracy, per-class report and confusion matrix on held-out data"""
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix, log_loss
+
+    proba = model.predict_proba(X)
+    predicted = proba.argmax(axis=1)
+    labels = list(range(proba.shape[1]))
+    return {
+        "accuracy": float(accuracy_score(y, predicted)),
+        "log_loss": float(log_loss(y, proba, labels=labels)),
+        "classification_report": classification_report(y, predicted, labels=labels, output_dict=True,
+                                                        zero_division=0),
+        "confusion_matrix": confusion_matrix(y, predicted, labels=labels).tolist(),
+    }
+
+
+def train(args):
+    """Run one training job; returns the metrics stored with the published model"""
+    import xgboost
+    from xgboost import XGBClassifier
+
+    started = time.perf_counter()
+    timings = {}
+
+    def mark(phase, since):
+        timings[phase] = round(time.perf_counter() - since, 4)
+        return time.perf_counter()
+
+    phase = time.perf_counter()
+    X, y = read_dataset(args.data)
+    phase = mark("read", phase)
+    X_train, X_val, X_test, y_train, y_val, y_test = split(X, y, args.test_size, args.validation_size, args.seed)
+    train_counts = np.bincount(y_train).tolist()
+    if args.smote:
+        X_train, y_train = oversample(X_train, y_train, args.seed)
+    phase = mark("split_and_resample", phase)
+
+    sample_weight = class_weights(y_train) if args.class_weight == "balanced" else None
+    model = XGBClassifier(**model_params(args))
+    model.fit(X_train, y_train, sample_weight=sample_weight, eval_set=[(X_val, y_val)], verbose=False)
+    if args.early_stopping_rounds:
+        best_iteration, best_score = model.best_iteration, model.best_score
+    else:
+        best_iteration = args.n_estimators - 1
+        best_score = model.evals_result()["validation_0"]["mlogloss"][-1]
+    if best_iteration + 1 < args.n_estimators:
+        # Keep only the rounds early stopping chose; the app and trees.py use every tree in the booster
+        booster = model.get_booster()[:best_iteration + 1]
+        model = XGBClassifier(**{**model_params(args), "n_estimators": best_iteration + 1,
+                                 "early_stopping_rounds": None})
+        model.load_model(bytearray(booster.save_raw("ubj")))
+    # The app builds DMatrix inputs with these names
+    model.get_booster().feature_names = list(FEATURE_COLUMNS)
+    phase = mark("fit", phase)
+    test_metrics = evaluate(model, X_test, y_test)
+    mark("evaluate", phase)
+
+    metrics = {
+        "version": args.version,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "data": {
+            "paths": args.data,
+            "sha256": fingerprint(args.data),
+            "rows": int(len(y)),
+            "class_counts": np.bincount(y).tolist(),
+            "train_rows": int(sum(train_counts)),
+            "train_class_counts": train_counts,
+            "train_rows_resampled": int(len(y_train)),
+            "validation_rows": int(len(y_val)),
+            "test_rows": int(len(y_test)),
+        },
+        "params": {**model_params(args), "smote": args.smote, "class_weight": args.class_weight,
+                   "test_size": args.test_size,
+                   "validation_size": args.validation_size},
+        "best_iteration": int(best_iteration),
+        "n_trees": int(best_iteration + 1),
+        "validation_mlogloss": float(best_score),
+        "test": test_metrics,
+        "timings_seconds": timings,
+        "wall_seconds": round(time.perf_counter() - started, 4),
+        "peak_memory_mb": round(peak_memory_mb(), 1),
+        "versions": {
+            "python": platform.python_version(),
+            "xgboost": xgboost.__version__,
+            "numpy": np.__version__,
+        },
+        "cpu_count": os.cpu_count(),
+    }
+    models = ModelRegistry(args.out)
+    models.publish(model, args.version, metrics=metrics, fmt=args.format, source="train.py")
+    if args.promote:
+        models.promote(args.version)
+    return metrics
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Train the soil fertility XGBoost model")
+    parser.add_argument("--data", nargs="+", default=["dataset1.csv"], help="CSV or Parquet files")
+    parser.add_argument("--out", default=os.getenv("SOIL_MODEL_DIR") or "models", help="model registry folder")
+    parser.add_argument("--version", default=None, help="artifact version (default: timestamp)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--validation-size", type=float, default=0.15, help="fraction of the training split")
+    parser.add_argument("--no-smote", dest="smote", action="store_false")
+    parser.add_argument("--n-estimators", type=int, default=1000, help="upper bound; early stopping picks the count")
+    parser.add_argument("--early-stopping-rounds", type=int, default=30, help="0 trains all --n-estimators trees")
+    parser.add_argument("--class-weight", choices=["none", "balanced"], default="none",
+                        help="weight rows so each class counts equally (an alternative to SMOTE)")
+    parser.add_argument("--learning-rate", type=float, default=0.1)
+    parser.add_argument("--max-depth", type=int, default=6)
+    parser.add_argument("--max-bin", type=int, default=256)
+    parser.add_argument("--subsample", type=float, default=1.0)
+    parser.add_argument("--colsample-bytree", type=float, default=1.0)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="threads (-1 for all cores)")
+    parser.add_argument("--format", choices=["ubj", "json"], default="ubj", help="xgboost model file format")
+    parser.add_argument("--promote", action="store_true", help="make this version the one the app serves")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.version is None:
+        args.version = time.strftime("%Y%m%d-%H%M%S")
+    metrics = train(args)
+    print(f"Model {metrics['version']}: accuracy {metrics['test']['accuracy']:.4f}, "
+          f"log loss {metrics['test']['log_loss']:.4f}, best iteration {metrics['best_iteration']}")
+    print(f"Trained in {metrics['wall_seconds']:.2f} s, peak memory {metrics['peak_memory_mb']} MB "
+          f"-> {os.path.join(args.out, args.version)}")
+    return metrics
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""Managed HTTP transport for the Groq chat clients
+
+Every chain in a process shares one keep-alive connection pool. The pool
+is wrapped in a transport that adds these behaviours:
+
+    deadlines        a total budget per call covering all attempts; each
+                     attempt's timeouts are capped by what is left of it
+    retries          connection errors, timeouts, 429 and 5xx responses are
+                     retried with jittered exponential backoff (Retry-After
+                     is honoured) while the deadline allows
+    hedging          optional: if no response has arrived after hedge_after
+                     seconds, a second identical request is sent and the first
+                     response wins (the other is cancelled or closed)
+    circuit breaker  after `failure_threshold` consecutive failed attempts, calls
+                     fail immediately with CircuitOpenError for `reset_timeout`
+                     seconds; then one trial call decides whether to close it
+
+A failing or open circuit surfaces as a connection error in the Groq SDK.
+infer.py then serves the instant report (report.py) as the degraded
+response. ChatGroq runs with max_retries=0, so this layer owns the retry
+policy. Settings are read from SOIL_LLM_* environment variables (see
+TransportSettings.from_env).
+
+    python transport.py --check      # exercise the policies against mock_groq.py
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+from metrics import metrics
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without contacting the server while the circuit is open"""
+
+
+class TransportSettings:
+    """Timeouts, retry, hedging, breaker and pool settings for one transport"""
+
+    def __init__(self, deadline=30.0, connect_timeout=5.0, read_timeout=20.0, max_retries=2,
+                 backoff_base=0.5, backoff_max=8.0, hedge_after=0.0, failure_threshold=5,
+                 reset_timeout=30.0, max_connections=20, keepalive_expiry=60.0):
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+
+    @classmethod
+    def from_env(cls):
+        env = os.getenv
+        return cls(
+            deadline=float(env("SOIL_LLM_TIMEOUT", "30")),
+            connect_timeout=float(env("SOIL_LLM_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(env("SOIL_LLM_READ_TIMEOUT", "20")),
+            max_retries=int(env("SOIL_LLM_RETRIES", "2")),
+            hedge_after=float(env("SOIL_LLM_HEDGE_AFTER", "0")),
+            failure_threshold=int(env("SOIL_LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(env("SOIL_LLM_BREAKER_RESET", "30")),
+            max_connections=int(env("SOIL_LLM_POOL_SIZE", "20")),
+        )
+
+    def limits(self):
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker shared by the sync and async transports"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, name="groq"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go out now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                # Let exactly one trial call through
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.increment("soil_llm_circuit_transitions_total", help_text="Circuit breaker state changes",
+                          circuit=self.name, state=state)
+
+
+def backoff_delay(attempt, settings, response=None):
+    """Retry-After if the server sent one, else full-jitter exponential backoff"""
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), settings.backoff_max)
+        except ValueError:
+            pass
+    return random.uniform(0, min(settings.backoff_base * 2 ** attempt, settings.backoff_max))
+
+
+def _attempt_timeout(settings, remaining):
+    """httpx timeout extension for one attempt, capped by the remaining deadline"""
+    remaining = max(remaining, 0.001)
+    return {"connect": min(settings.connect_timeout, remaining), "read": min(settings.read_timeout, remaining),
+            "write": min(settings.read_timeout, remaining), "pool": min(settings.connect_timeout, remaining)}
+
+
+def _copy_request(request, remaining, settings):
+    # Requests from the Groq SDK carry their JSON body in memory, so they can be resent
+    extensions = {**request.extensions, "timeout": _attempt_timeout(settings, remaining)}
+    return httpx.Request(request.method, request.url, headers=request.headers, content=request.content,
+                         extensions=extensions)
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """Sync transport adding deadlines, retries, hedging and a circuit breaker"""
+
+    def __init__(self, settings=None, breaker=None, inner=None):
+        self.settings = settings or TransportSettings()
+        self.breaker = breaker or CircuitBreaker(self.settings.failure_threshold, self.settings.reset_timeout)
+        self.inner = inner or httpx.HTTPTransport(limits=self.settings.limits())
+        self._hedge_pool = ThreadPoolExecutor(max_workers=self.settings.max_connections,
+                                              thread_name_prefix="llm-hedge")
+
+    def handle_request(self, request):
+        request.read()
+        deadline = time.monotonic() + self.settings.deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.increment("soil_llm_fast_failures_total", help_text="Calls refused by the open circuit")
+                raise CircuitOpenError("LLM circuit is open", request=request)
+            response, error = None, None
+            try:
+                response = self._send(request, deadline)
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                # Anything else still ends the attempt, so a half-open trial is never left running
+                self.breaker.record_failure()
+                raise
+            if error is None and response.status_code not in RETRY_STATUS:
+                self.breaker.record_success()
+                return response
+            self.breaker.record_failure()
+            delay = backoff_delay(attempt, self.settings, response)
+            if attempt >= self.settings.max_retries or time.monotonic() + delay >= deadline:
+                if error is not None:
+                    raise error
+                # Out of retries: hand the error response to the SDK
+                return response
+            if response is not None:
+                response.close()
+            metrics.increment("soil_llm_retries_total", help_text="LLM HTTP attempts retried",
+                              reason=type(error).__name__ if error is not None else str(response.status_code))
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, request, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise httpx.TimeoutException("LLM call deadline exceeded", request=request)
+        if not self.settings.hedge_after or self.settings.hedge_after >= remaining:
+            return self.inner.handle_request(_copy_request(request, remaining, self.settings))
+
+        primary = self._hedge_pool.submit(self.inner.handle_request, _copy_request(request, remaining, self.settings))
+        done, _ = wait([primary], timeout=self.settings.hedge_after)
+        if done:
+            return primary.result()
+        metrics.increment("soil_llm_hedged_total", help_text="LLM calls that sent a hedge request")
+        hedge = self._hedge_pool.submit(self.inner.handle_request,
+                                        _copy_request(request, deadline - time.monotonic(), self.settings))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    winner = future.result()
+                    for loser in pending:
+                        loser.add_done_callback(_close_result)
+                    if future is hedge:
+                        metrics.increment("soil_llm_hedge_wins_total", help_text="Hedge requests that answered first")
+                    return winner
+                error = future.exception()
+        raise error
+
+    def close(self):
+        self._hedge_pool.shutdown(wait=False)
+        self.inner.close()
+
+
+def _close_result(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+class AsyncResilientTransport(httpx.AsyncBaseTransport):
+    """asyncio version of ResilientTransport, sharing its settings and circuit breaker
+
+    Pooled connections belong to the event loop that opened them, and
+    infer.analyze_all runs a new loop per call, so each loop gets its own
+    connection pool (dropped with the loop).
+    """
+
+    def __init__(self, settings=None, breaker=None, inner=None):
+        self.settings = settings or TransportSettings()
+        self.breaker = breaker or CircuitBreaker(self.settings.failure_threshold, self.settings.reset_timeout)
+        self._inner = inner
+        self._pools = weakref.WeakKeyDictionary()
+
+    @property
+    def inner(self):
+        if self._inner is not None:
+            return self._inner
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = self._pools[loop] = httpx.AsyncHTTPTransport(limits=self.settings.limits())
+        return pool
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        deadline = time.monotonic() + self.settings.deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.increment("soil_llm_fast_failures_total", help_text="Calls refused by the open circuit")
+                raise CircuitOpenError("LLM circuit is open", request=request)
+            response, error = None, None
+            try:
+                response = await self._send(request, deadline)
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                # Cancellation (wait_for, handler timeouts, disconnects) included
+                self.breaker.record_failure()
+                raise
+            if error is None and response.status_code not in RETRY_STATUS:
+                self.breaker.record_success()
+                return response
+            self.breaker.record_failure()
+            delay = backoff_delay(attempt, self.settings, response)
+            if attempt >= self.settings.max_retries or time.monotonic() + delay >= deadline:
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                await response.aclose()
+            metrics.increment("soil_llm_retries_total", help_text="LLM HTTP attempts retried",
+                              reason=type(error).__name__ if error is not None else str(response.status_code))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send(self, request, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise httpx.TimeoutException("LLM call deadline exceeded", request=request)
+        if not self.settings.hedge_after or self.settings.hedge_after >= remaining:
+            return await self.inner.handle_async_request(_copy_request(request, remaining, self.settings))
+
+        primary = asyncio.ensure_future(
+            self.inner.handle_async_request(_copy_request(request, remaining, self.settings)))
+        tasks, winner = [primary], None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.settings.hedge_after)
+            if done:
+                winner = primary
+                return primary.result()
+            metrics.increment("soil_llm_hedged_total", help_text="LLM calls that sent a hedge request")
+            hedge = asyncio.ensure_future(self.inner.handle_async_request(
+                _copy_request(request, deadline - time.monotonic(), self.settings)))
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        if task is hedge:
+                            metrics.increment("soil_llm_hedge_wins_total",
+                                              help_text="Hedge requests that answered first")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Cancel the request that lost the race (both, if this call was cancelled)
+            # and close any finished response that is not returned
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task is not winner:
+                    task.add_done_callback(_aclose_result)
+
+    async def aclose(self):
+        """Close the connection pools of every event loop that used this transport"""
+        if self._inner is not None:
+            await self._inner.aclose()
+        current = asyncio.get_running_loop()
+        for loop, pool in list(self._pools.items()):
+            if loop is current:
+                await pool.aclose()
+            elif loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(pool.aclose(), loop))
+            # A closed loop's connections went with it; there is nothing left to close
+        self._pools.clear()
+
+
+def _aclose_result(task):
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+def create_http_clients(settings=None):
+    """(httpx.Client, httpx.AsyncClient) sharing one circuit breaker, for ChatGroq"""
+    settings = settings or TransportSettings.from_env()
+    breaker = CircuitBreaker(settings.failure_threshold, settings.reset_timeout)
+    timeout = httpx.Timeout(settings.read_timeout, connect=settings.connect_timeout)
+    sync_client = httpx.Client(transport=ResilientTransport(settings, breaker), timeout=timeout)
+    async_client = httpx.AsyncClient(transport=AsyncResilientTransport(settings, breaker), timeout=timeout)
+    return sync_client, async_client
+
+
+def _check():
+    """Drive retries, hedging and the circuit breaker against local mock servers"""
+    from mock_groq import MockGroqServer
+
+    body = {"model": "mock", "messages": [{"role": "user", "content": "hi"}]}
+
+    def post(client, base_url):
+        start = time.perf_counter()
+        try:
+            status = client.post(f"{base_url}/openai/v1/chat/completions", json=body).status_code
+        except httpx.TransportError as e:
+            status = type(e).__name__
+        return status, time.perf_counter() - start
+
+    # 429s: every request eventually succeeds within its retry budget
+    server = MockGroqServer(("127.0.0.1", 0), latency=0.01, tokens_per_second=5000, error_rate=0.3, seed=1).start()
+    settings = TransportSettings(max_retries=4, backoff_max=0.05, failure_threshold=100)
+    with httpx.Client(transport=ResilientTransport(settings)) as client:
+        statuses = [post(client, server.base_url)[0] for _ in range(40)]
+    print(f"retries:  {statuses.count(200)}/40 succeeded, server saw {server.requests} requests "
+          f"({server.errors} answered 429)")
+    server.stop()
+
+    # Tail latency: hedging after 150 ms cuts the slow requests short
+    server = MockGroqServer(("127.0.0.1", 0), latency=0.01, tokens_per_second=5000, slow_rate=0.2,
+                            slow_latency=1.0, seed=2).start()
+    for hedge_after in (0.0, 0.15):
+        settings = TransportSettings(hedge_after=hedge_after)
+        with httpx.Client(transport=ResilientTransport(settings)) as client:
+            latencies = sorted(post(client, server.base_url)[1] for _ in range(100))
+        print(f"hedge_after={hedge_after}: p50 {latencies[50] * 1000:.0f} ms, p90 {latencies[90] * 1000:.0f} ms, "
+              f"max {latencies[-1] * 1000:.0f} ms")
+    server.stop()
+
+    # Endpoint down: the breaker opens and later calls fail in well under a millisecond
+    settings = TransportSettings(max_retries=0, failure_threshold=3, reset_timeout=0.2)
+    transport = ResilientTransport(settings)
+    with httpx.Client(transport=transport) as client:
+        down = [post(client, "http://127.0.0.1:9") for _ in range(6)]
+        print("down:     " + ", ".join(f"{status} {seconds * 1000:.1f} ms" for status, seconds in down))
+        server = MockGroqServer(("127.0.0.1", 0), latency=0.01, tokens_per_second=5000).start()
+        time.sleep(0.25)
+        print(f"recovered after reset: {post(client, server.base_url)[0]}, breaker {transport.breaker.state}")
+        server.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Resilient HTTP transport for the Groq clients")
+    parser.add_argument("--check", action="store_true", help="exercise the policies against mock_groq.py")
+    if parser.parse_args().check:
+        _check()
+    else:
+        parser.print_help()
@@ -0,0 +1,192 @@
+"""Flat-array export of the XGBoost soil model and a pure NumPy evaluator
+
+compile_model() walks the trees of a fitted XGBClassifier once and stores them
+as flat arrays (feature index, threshold, left/right child, leaf value).
+CompiledEnsemble evaluates those arrays with NumPy only, so predictions do not
+need a DMatrix or the xgboost runtime, and can be saved to / loaded from .npz.
+
+Run this file directly to export the model and check parity against it:
+
+    python trees.py [--model xgb_soil_analysis.bin] [--out xgb_soil_analysis.npz]
+"""
+import json
+import numpy as np
+
+
+class CompiledEnsemble:
+    """Tree ensemble stored as flat node arrays, evaluated level by level"""
+
+    def __init__(self, feature, threshold, left, right, default_left, value,
+                 roots, tree_class, base_margin, max_depth):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float32)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.value = np.asarray(value, dtype=np.float32)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.tree_class = np.asarray(tree_class, dtype=np.int32)
+        self.base_margin = np.asarray(base_margin, dtype=np.float64)
+        self.max_depth = int(max_depth)
+
+        if not np.array_equal(self.right, self.left + 1):
+            raise ValueError("Right children must directly follow left children")
+        self._feature = self.feature.astype(np.intp)
+        self._left = self.left.astype(np.intp)
+        self._roots = self.roots.astype(np.intp)
+
+        self.n_classes = len(self.base_margin)
+        # One-hot (n_trees, n_classes) matrix that sums leaf values per class
+        self._class_matrix = np.zeros((len(self.roots), self.n_classes), dtype=np.float64)
+        self._class_matrix[np.arange(len(self.roots)), self.tree_class] = 1.0
+
+    def leaves(self, data, block_size=128):
+        """Return the leaf node reached in every tree, shape (n_rows, n_trees)"""
+        X = np.asarray(data, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        # Evaluating in row blocks keeps the (rows, trees) node matrix in cache
+        if len(X) > block_size:
+            return np.concatenate([
+                self.leaves(X[i:i + block_size]) for i in range(0, len(X), block_size)
+            ])
+        flat = X.ravel()
+        row_offsets = (np.arange(len(X), dtype=np.intp) * X.shape[1])[:, None]
+        has_nan = bool(np.isnan(X).any())
+        node = np.broadcast_to(self._roots, (len(X), len(self._roots)))
+        # Children are stored as (left, left + 1) and leaves point to
+        # themselves, so a fixed number of steps lands every row on a leaf
+        for _ in range(self.max_depth):
+            x = flat[row_offsets + self._feature[node]]
+            go_right = x >= self.threshold[node]
+            if has_nan:
+                go_right |= np.isnan(x) & ~self.default_left[node]
+            node = self._left[node] + go_right
+        return node
+
+    def margins(self, data):
+        """Raw per-class scores, identical to XGBoost's output_margin=True"""
+        return self.value[self.leaves(data)] @ self._class_matrix + self.base_margin
+
+    def predict_proba(self, data):
+        """Class probabilities (softmax of the margins)"""
+        margins = self.margins(data)
+        margins -= margins.max(axis=1, keepdims=True)
+        proba = np.exp(margins)
+        return proba / proba.sum(axis=1, keepdims=True)
+
+    def predict(self, data):
+        """Predicted class label for each row"""
+        return self.margins(data).argmax(axis=1)
+
+    def save(self, path):
+        """Write the flat arrays to an .npz file"""
+        np.savez(
+            path,
+            feature=self.feature, threshold=self.threshold, left=self.left,
+            right=self.right, default_left=self.default_left, value=self.value,
+            roots=self.roots, tree_class=self.tree_class,
+            base_margin=self.base_margin, max_depth=self.max_depth,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load an ensemble written by save(); needs NumPy only"""
+        with np.load(path) as arrays:
+            return cls(**{k: arrays[k] for k in arrays.files})
+
+
+def compile_model(model):
+    """Export the trees of a fitted XGBClassifier (or Booster) into a CompiledEnsemble"""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    learner = json.loads(booster.save_raw("json"))["learner"]
+
+    objective = learner["objective"]["name"]
+    if objective not in ("multi:softprob", "multi:softmax"):
+        raise ValueError(f"Unsupported objective: {objective}")
+
+    trees = learner["gradient_booster"]["model"]["trees"]
+    tree_info = learner["gradient_booster"]["model"]["tree_info"]
+    n_classes = int(learner["learner_model_param"]["num_class"])
+
+    feature, threshold, left, right, default_left, value = [], [], [], [], [], []
+    roots, max_depth = [], 0
+    for tree in trees:
+        offset = len(feature)
+        roots.append(offset)
+        depth = [0] * len(tree["left_children"])
+        for i, (lc, rc) in enumerate(zip(tree["left_children"], tree["right_children"])):
+            if lc == -1:
+                # Leaf: split_conditions holds the leaf weight, and a NaN
+                # threshold with default_left keeps the walk on this node
+                feature.append(0)
+                threshold.append(np.nan)
+                left.append(offset + i)
+                right.append(offset + i + 1)
+                default_left.append(True)
+                value.append(tree["split_conditions"][i])
+            else:
+                if rc != lc + 1:
+                    raise ValueError("Unexpected tree layout: right child must follow left child")
+                feature.append(tree["split_indices"][i])
+                threshold.append(tree["split_conditions"][i])
+                left.append(offset + lc)
+                right.append(offset + rc)
+                default_left.append(bool(tree["default_left"][i]))
+                value.append(0.0)
+                depth[lc] = depth[rc] = depth[i] + 1
+        max_depth = max(max_depth, max(depth))
+
+    ensemble = CompiledEnsemble(
+        feature, threshold, left, right, default_left, value,
+        roots, tree_info, np.zeros(n_classes), max_depth,
+    )
+
+    # The base score is stored in probability space and its conversion to a
+    # margin depends on the xgboost version, so read it back from the booster
+    import xgboost as xgb
+    probe = np.zeros((1, booster.num_features()), dtype=np.float32)
+    booster_margin = booster.predict(xgb.DMatrix(probe, feature_names=booster.feature_names), output_margin=True)
+    ensemble.base_margin = (booster_margin - ensemble.margins(probe))[0].astype(np.float64)
+    return ensemble
+
+
+def check_parity(compiled, model, data, atol=1e-4):
+    """Compare compiled margins and classes with the xgboost model on data
+
+    Returns (max_abs_margin_diff, n_class_mismatches); raises AssertionError
+    if either exceeds the tolerance.
+    """
+    import xgboost as xgb
+    X = np.asarray(data, dtype=np.float32)
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    expected = booster.predict(xgb.DMatrix(X, feature_names=booster.feature_names), output_margin=True)
+    actual = compiled.margins(X)
+    max_diff = float(np.abs(expected - actual).max())
+    mismatches = int((expected.argmax(axis=1) != actual.argmax(axis=1)).sum())
+    assert max_diff <= atol, f"Margin difference {max_diff} exceeds {atol}"
+    assert mismatches == 0, f"{mismatches} rows predicted a different class"
+    return max_diff, mismatches
+
+
+if __name__ == "__main__":
+    import argparse
+    import joblib
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Compile the soil model to flat NumPy arrays")
+    parser.add_argument("--model", default="xgb_soil_analysis.bin")
+    parser.add_argument("--out", default="xgb_soil_analysis.npz")
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    compiled = compile_model(model)
+    compiled.save(args.out)
+    print(f"Compiled {len(compiled.roots)} trees ({len(compiled.feature)} nodes) to {args.out}")
+
+    with open("assets/sensor_data.json", "r") as infile:
+        sensor_rows = list(json.load(infile).values())
+    dataset_rows = pd.read_csv("dataset1.csv").drop(columns=["Output"]).to_numpy()
+    for name, rows in [("dataset1.csv", dataset_rows), ("sensor_data.json", sensor_rows)]:
+        max_diff, _ = check_parity(compiled, model, rows)
+        print(f"{name}: {len(rows)} rows match, max margin difference {max_diff:.2e}")
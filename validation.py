@@ -0,0 +1,147 @@
+"""Input validation and out-of-distribution gate for sensor readings
+
+Checks run on whole batches in one NumPy pass, using statistics computed once
+from dataset1.csv (the model's training data):
+
+    invalid       physically impossible values: non-finite, negative
+                  concentrations, pH outside 0-14, organic carbon above 100 %
+    out of range  a variable outside the reference quantile range (0.1 % to
+                  99.9 %), widened by `margin` times that range on each side
+    OOD           a Mahalanobis distance, in log space, above `ood_factor`
+                  times the 99.5th percentile of the reference distances; this
+                  catches unusual combinations even when each value looks normal
+
+A reading that fails any check is handled by the policy (SOIL_VALIDATION_POLICY):
+
+    reject          no report or LLM call; infer raises InvalidReading
+    short_circuit   the instant report with a warning, but no LLM call (default)
+    flag            report and LLM narrative as usual, with the warning in the
+                    report and in the data sent to the LLM
+    off             no checks
+
+    python validation.py 138 8.6 560 15.2 0.62 0.7 5.9 0.24 0.31 0.77 8.71 0.11
+"""
+import os
+
+import numpy as np
+
+from report import VARIABLES, read_reference
+
+POLICIES = ("reject", "short_circuit", "flag", "off")
+VALIDATION_POLICY = os.getenv("SOIL_VALIDATION_POLICY", "short_circuit").lower()
+if VALIDATION_POLICY not in POLICIES:
+    raise ValueError(f"SOIL_VALIDATION_POLICY must be one of {', '.join(POLICIES)}, not {VALIDATION_POLICY!r}")
+
+# Physical limits: (lower, upper); None means unbounded
+PHYSICAL_LIMITS = {variable: (0.0, None) for variable in VARIABLES}
+PHYSICAL_LIMITS["pH"] = (0.0, 14.0)
+PHYSICAL_LIMITS["OC"] = (0.0, 100.0)
+
+
+class InvalidReading(ValueError):
+    """A reading rejected by the validation policy"""
+
+    def __init__(self, issues):
+        super().__init__("; ".join(issues))
+        self.issues = issues
+
+
+class ValidationResult:
+    """Per-reading outcome of Validator.check for a batch"""
+
+    def __init__(self, invalid, below, above, distance, ood, variables):
+        self.invalid = invalid          # (n, 12) physically impossible values
+        self.below = below              # (n, 12) under the reference range
+        self.above = above              # (n, 12) over the reference range
+        self.distance = distance        # (n,) Mahalanobis distance
+        self.ood = ood                  # (n,) distance over the threshold
+        self.variables = variables
+        self.failed = invalid.any(axis=1) | below.any(axis=1) | above.any(axis=1) | ood
+
+    def __len__(self):
+        return len(self.failed)
+
+    def kind(self, i):
+        """'invalid', 'out_of_distribution' or None for reading i"""
+        if self.invalid[i].any():
+            return "invalid"
+        return "out_of_distribution" if self.failed[i] else None
+
+    def issues(self, i):
+        """Short English descriptions of what is wrong with reading i"""
+        issues = [f"{name} is physically impossible" for name in np.asarray(self.variables)[self.invalid[i]]]
+        issues += [f"{name} is below the reference range"
+                   for name in np.asarray(self.variables)[self.below[i] & ~self.invalid[i]]]
+        issues += [f"{name} is above the reference range"
+                   for name in np.asarray(self.variables)[self.above[i] & ~self.invalid[i]]]
+        if self.ood[i] and not issues:
+            issues.append("unusual combination of values")
+        return issues
+
+    def summary(self, i):
+        """JSON-ready validation entry for reading i, or None if it passed"""
+        if not self.failed[i]:
+            return None
+        kind = self.kind(i)
+        mask = self.invalid[i] if kind == "invalid" else self.below[i] | self.above[i]
+        return {"result": kind, "variables": np.asarray(self.variables)[mask].tolist(), "issues": self.issues(i),
+                "distance": round(float(self.distance[i]), 2)}
+
+
+class Validator:
+    """Range, quantile and Mahalanobis checks against a reference data set"""
+
+    def __init__(self, values, margin=0.25, quantiles=(0.001, 0.999), ood_quantile=0.995, ood_factor=1.5):
+        values = np.asarray(values, dtype=np.float64)
+        low, high = np.quantile(values, quantiles, axis=0)
+        span = high - low
+        self.lower = low - margin * span
+        self.upper = high + margin * span
+        self.physical_lower = np.array([PHYSICAL_LIMITS[v][0] for v in VARIABLES], dtype=np.float64)
+        self.physical_upper = np.array([np.inf if PHYSICAL_LIMITS[v][1] is None else PHYSICAL_LIMITS[v][1]
+                                        for v in VARIABLES], dtype=np.float64)
+
+        # Concentrations are right-skewed; log1p makes the Mahalanobis ellipsoid fit them
+        logged = np.log1p(np.maximum(values, 0.0))
+        self.mean = logged.mean(axis=0)
+        covariance = np.cov(logged, rowvar=False)
+        # A little ridge keeps the inverse stable for nearly collinear variables
+        covariance += np.eye(len(VARIABLES)) * 1e-3 * np.trace(covariance) / len(VARIABLES)
+        self.precision = np.linalg.inv(covariance)
+        self.threshold = ood_factor * float(np.quantile(self.distance(values), ood_quantile))
+
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        values, _ = read_reference(path)
+        return cls(values, **kwargs)
+
+    def distance(self, X):
+        """Mahalanobis distance of each reading from the reference data, in log space"""
+        centered = np.log1p(np.maximum(X, 0.0)) - self.mean
+        return np.sqrt(np.einsum("ij,jk,ik->i", centered, self.precision, centered))
+
+    def check(self, X):
+        """ValidationResult for a batch of readings (n, 12)"""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        finite = np.isfinite(X)
+        with np.errstate(invalid="ignore"):
+            invalid = ~finite | (X < self.physical_lower) | (X > self.physical_upper)
+            below = X < self.lower
+            above = X > self.upper
+            # Missing values are placed at the reference centre, so only the other variables count
+            distance = self.distance(np.where(finite, X, np.expm1(self.mean)))
+        ood = distance > self.threshold
+        return ValidationResult(invalid, below, above, distance, ood, VARIABLES)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate one reading against dataset1.csv")
+    parser.add_argument("values", type=float, nargs=len(VARIABLES), metavar="VALUE", help=" ".join(VARIABLES))
+    parser.add_argument("--reference", default="dataset1.csv")
+    args = parser.parse_args()
+    validator = Validator.from_csv(args.reference)
+    result = validator.check([args.values])
+    print(f"distance {result.distance[0]:.2f} (threshold {validator.threshold:.2f})")
+    print(result.summary(0) or "passed")